@@ -24,10 +24,24 @@ from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 
 import logging
+import copy
+import queue
+import threading
+import atexit
+import signal
+import time
+from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from sqlalchemy.orm import joinedload, selectinload
 
 from telemedicion_regalias.empresa import Empresa
 from telemedicion_regalias.medidor_fiscal import MedidorFiscal
-from telemedicion_regalias import base
+from telemedicion_regalias.lectura_res11 import PL_REFLEXIVO, PL_COMPILADO, PL_COLUMNAR, PL_AUTOMATICO, MINIMO_LINEAS_COLUMNAR, logLecturas
+from telemedicion_regalias.conexionremota import ConexionRemota, ConexionFTP, ConexionSFTP, PoolTransportsSFTP, CircuitBreakerHosts
+from telemedicion_regalias.planificador import PlanificadorEmpresas
+from telemedicion_regalias import base, metricas
 import lectura_telemedicion_config as config
 
 
@@ -46,6 +60,9 @@ PROFILE = 0
 
 dryRun = False
 
+#Segundos máximos que el modo daemon espera sin revisar si recibió una señal para detenerse
+ESPERA_MAXIMA_DAEMON = 1
+
 
 class CLIError(Exception):
     '''Generic exception to raise and log different fatal errors.'''
@@ -89,6 +106,280 @@ def consoleLogging(logLevel):
     logging.getLogger().addHandler(console)
 
 
+#Formato de las excepciones de los registros encolados, el mismo que el de logging.Formatter
+_formatoExcepciones = logging.Formatter()
+
+
+class _QueueHandlerDiferido(QueueHandler):
+    '''QueueHandler que no formatea el registro en el hilo que loguea: como la cola es del mismo proceso el registro 
+    se encola sin formatear y el formato (fecha, nivel, etc.) lo aplica el hilo del QueueListener.
+    El mensaje sí se arma antes de encolarlo (con sus argumentos % y la excepción), para que el listener no lea 
+    objetos que el hilo que loguea puede seguir modificando (ej: objetos del ORM)'''
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if (record.exc_info):
+            record.exc_text = _formatoExcepciones.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def loggingAsincronico():
+    '''Reemplaza los handlers del logger raíz (archivo y consola) por un QueueHandler, los handlers originales pasan 
+    a un QueueListener que escribe en su propio hilo, fuera del camino de la importación. 
+    El listener se detiene (vaciando la cola) al terminar el proceso'''
+    logger = logging.getLogger()
+    handlers = logger.handlers[:]
+    cola = queue.SimpleQueue()
+    for hnd in handlers:
+        logger.removeHandler(hnd)
+    logger.addHandler(_QueueHandlerDiferido(cola))
+    listener = QueueListener(cola, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class FiltroMuestreo(logging.Filter):
+    '''Deja pasar como máximo maxPorSegundo mensajes por segundo, el resto se descarta. 
+    El primer mensaje que pasa después de haber descartado informa cuántos se omitieron'''
+    def __init__(self, maxPorSegundo):
+        super().__init__()
+        self.maxPorSegundo = maxPorSegundo
+        self._lock = threading.Lock()
+        self._segundo = None
+        self._cantidad = 0
+        self._omitidos = 0
+
+    def filter(self, record):
+        segundo = int(record.created)
+        with self._lock:
+            if (segundo != self._segundo):
+                self._segundo = segundo
+                self._cantidad = 0
+            self._cantidad += 1
+            if (self._cantidad > self.maxPorSegundo):
+                self._omitidos += 1
+                return False
+            omitidos = self._omitidos
+            self._omitidos = 0
+        if omitidos:
+            record.msg = f"[{omitidos} mensajes omitidos por muestreo] {record.msg}"
+        return True
+
+
+class ResultadoEmpresa():
+    '''Resultado del procesamiento de una empresa, utilizado para armar el resumen final de la ejecución'''
+    def __init__(self, empresaId, nombre):
+        self.empresaId = empresaId
+        self.nombre = nombre
+        self.procesada = False
+        self.cantMedidores = 0
+        self.cantMedidoresErr = 0
+        self.cantArchivosOk = 0
+        self.cantArchivosErr = 0
+        self.errores = []
+
+    def estado(self):
+        if (self.errores):
+            return f"ERROR ({'; '.join(self.errores)})"
+        elif (self.procesada):
+            return "OK"
+        return "NO PROCESADA"
+
+
+def consultaEmpresasAProcesar(session):
+    '''Retorna la consulta de las empresas a procesar con todo su grafo de configuración (conexión, medidores activos 
+    que envían telemetría y sus tipos) cargado con unas pocas consultas, en lugar de una por cada relación de cada medidor'''
+    medidoresActivos = Empresa.medidores.and_(MedidorFiscal.envia_telemetria == True,
+                                              MedidorFiscal.fecha_baja == None)
+    return session.query(Empresa) \
+                  .filter(Empresa.medidores != None, Empresa.conexion != None) \
+                  .options(joinedload(Empresa.conexion),
+                           selectinload(medidoresActivos).joinedload(MedidorFiscal.tipoMedidor)) \
+                  .order_by(Empresa.nombre)
+
+
+def procesarEmpresa(empresa, args, ultimasLecturas=None, relanzarErrores=False):
+    '''Procesa todos los medidores de la empresa indicada y retorna un ResultadoEmpresa
+    ultimasLecturas es el resultado de MedidorFiscal.getUltimasLecturasRamales, si es None la última lectura de cada 
+    ramal se consulta al procesarlo'''
+    resultado = ResultadoEmpresa(empresa.id, empresa.nombre.strip())
+    logging.info("------------------------------------------------------------------------------------------")
+    logging.info(f"Procesando Empresa {empresa.id}-{empresa.nombre}")
+    metricas.etiquetar(empresa=resultado.nombre, medidor=None, ramal=None, archivo=None)
+    if (empresa.conexion):
+        logging.debug(f"Empresa con conexion")
+        try:
+            
+            if (empresa.id == 29):
+                logging.debug('skipping')
+                return resultado
+            empresa.conexion.connectServer()
+            try:
+                if empresa.conexion.connectedServer():
+                    logging.info("Conectado al servidor de la empresa")
+                    resultado.procesada = True
+                    #Procesar cada medidor
+                    for medidor in empresa.medidores:
+                        try:
+                            if(not medidor.envia_telemetria):
+                                logging.debug(f"Medidor no envia telemetria: {medidor.descripcion}")
+                                continue
+                            
+                            if(medidor.fecha_baja != None):
+                                logging.debug(f"Medidor se ha dado de baja: {medidor.descripcion} - {medidor.fecha_baja}")
+                                continue
+                            
+                            logging.info(f"Procesando medidor: {medidor.codigo} - {medidor.descripcion}")
+                            metricas.etiquetar(medidor=medidor.codigo.strip(), ramal=None, archivo=None)
+                            resultado.cantMedidores += 1
+                            medidor.dirDescargas = config.DIR_DESCARGAS
+                            medidor.importacionBulk = args.bulk
+                            medidor.parserLecturas = args.parser
+                            medidor.descargaStreaming = args.streaming
+                            medidor.maxDiasXEjecucion = args.ventanaDias
+                            medidor.descargasParalelas = args.descargasParalelas
+                            medidor.usarMarcasLectura = args.marcasLectura
+                            #Los medidores que no están en ultimasLecturas (ej: dados de alta después de la última recarga
+                            #de la configuración en el modo daemon) consultan la última lectura de cada ramal
+                            medidor.ultimasLecturas = ultimasLecturas.get(medidor.id) if ultimasLecturas is not None else None
+                            #Setear los formatos de fecha, hora, etc que están definidos en la conexión
+#                             medidor.setFormatosFromDict(empresa.conexion.filtros2Dict())
+                            cantOk, cantErr = medidor.cargarNuevasLecturas()
+                            resultado.cantArchivosOk += cantOk
+                            resultado.cantArchivosErr += cantErr
+                        except Exception as e:
+                            resultado.cantMedidoresErr += 1
+                            logging.error(f"Error al procesar el medidor (error={e})")
+#                            Es necesario continuar con la conexion activa hasta que termine el bucle completo
+#                            if (DEBUG or TESTRUN):
+#                                raise(e)
+            finally:
+                empresa.conexion.disconnectServer()            
+        except Exception as e:
+            #El mensaje de la excepción ya viene formateado "msg (error=e)"
+            logging.error(e)
+            resultado.errores.append(str(e))
+            if (relanzarErrores):
+                raise(e)
+    else:
+        logging.warning("No existe conexión definida")
+    return resultado
+
+
+def procesarEmpresaEnWorker(empresaId, args, ultimasLecturas=None):
+    '''Procesa una empresa dentro de un worker, utilizando una sesión propia de SQLAlchemy'''
+    with base.unidadDeTrabajo(expirarEnCommit=False) as session:
+        empresa = consultaEmpresasAProcesar(session).filter(Empresa.id == empresaId).one()
+        return procesarEmpresa(empresa, args, ultimasLecturas)
+
+
+def logResumen(resultados):
+    '''Muestra el resumen de la ejecución agregando los resultados de todas las empresas'''
+    logging.info("==========================================================================================")
+    logging.info("Resumen de la ejecución")
+    for resultado in sorted(resultados, key=lambda r: r.nombre):
+        logging.info(f"Empresa {resultado.empresaId}-{resultado.nombre}: {resultado.estado()} - "
+                     f"medidores: {resultado.cantMedidores} (con error: {resultado.cantMedidoresErr}) - "
+                     f"archivos ok: {resultado.cantArchivosOk} - archivos con error: {resultado.cantArchivosErr}")
+    logging.info(f"Total empresas: {len(resultados)} - "
+                 f"con error: {sum(1 for r in resultados if r.errores)} - "
+                 f"archivos ok: {sum(r.cantArchivosOk for r in resultados)} - "
+                 f"archivos con error: {sum(r.cantArchivosErr for r in resultados)}")
+
+
+def logMetricas(args):
+    '''Muestra el resumen de las mediciones de las etapas y las guarda en los archivos indicados'''
+    metricas.registro.logResumen()
+    if (args.metricasJson):
+        metricas.registro.guardarJSON(args.metricasJson)
+    if (args.metricasPrometheus):
+        metricas.registro.guardarPrometheus(args.metricasPrometheus)
+
+
+def cargarConfiguracionDaemon(args):
+    '''Retorna los ids de las empresas a procesar y la última lectura de todos los ramales de sus medidores'''
+    with base.unidadDeTrabajo() as session:
+        empresas = consultaEmpresasAProcesar(session).all()
+        ultimasLecturas = MedidorFiscal.getUltimasLecturasRamales(session, 
+                                                                  [medidor for empresa in empresas for medidor in empresa.medidores],
+                                                                  args.marcasLectura)
+        return [empresa.id for empresa in empresas], ultimasLecturas
+
+
+def ejecutarDaemon(args, intervalos):
+    '''Procesa las empresas en forma continua, cada una según su propio intervalo, hasta recibir SIGTERM o SIGINT.
+    El engine, los pools de conexiones y la configuración se mantienen entre lecturas, la configuración (empresas, 
+    medidores y últimas lecturas) se recarga cada args.recargaConfiguracion minutos. 
+    Cada empresa se procesa en un worker con su propia sesión, como máximo args.workers a la vez'''
+    planificador = PlanificadorEmpresas(args.intervalo * 60, intervalos, args.jitter / 100)
+    detener = threading.Event()
+
+    def senialDetener(signum, frame):
+        #Una segunda señal termina el proceso sin esperar las lecturas en curso
+        signal.signal(signum, signal.SIG_DFL)
+        detener.set()
+
+    signal.signal(signal.SIGTERM, senialDetener)
+    signal.signal(signal.SIGINT, senialDetener)
+    logging.info(f"Modo daemon: intervalo por defecto {args.intervalo} minutos, "
+                 f"intervalos propios: {({empresaId: segundos // 60 for empresaId, segundos in intervalos.items()})}")
+    ultimasLecturas = None
+    proximaRecarga = time.monotonic()
+    enProceso = {}
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='empresa') as executor:
+        while not detener.is_set():
+            ahora = time.monotonic()
+            if (ahora >= proximaRecarga):
+                try:
+                    idsEmpresas, ultimasLecturas = cargarConfiguracionDaemon(args)
+                    planificador.actualizarEmpresas(idsEmpresas, ahora)
+                    logging.info(f"Configuración cargada: {len(idsEmpresas)} empresas a procesar")
+                except Exception as e:
+                    logging.error(f"Error al cargar la configuración, se mantiene la anterior (error={e})")
+                proximaRecarga = ahora + args.recargaConfiguracion * 60
+
+            for empresaId in planificador.pendientes(ahora, args.workers - len(enProceso)):
+                enProceso[executor.submit(procesarEmpresaEnWorker, empresaId, args, ultimasLecturas)] = empresaId
+
+            proxima = planificador.proximaEjecucion()
+            espera = (proximaRecarga if proxima is None else min(proxima, proximaRecarga)) - time.monotonic()
+            espera = min(max(espera, 0), ESPERA_MAXIMA_DAEMON)
+            if (enProceso):
+                terminados, _ = wait(enProceso, timeout=espera, return_when=FIRST_COMPLETED)
+            else:
+                terminados = ()
+                time.sleep(espera)
+
+            for futuro in terminados:
+                empresaId = enProceso.pop(futuro)
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    resultado = ResultadoEmpresa(empresaId, '')
+                    resultado.errores.append(str(e))
+                segundos = planificador.finalizar(empresaId, not resultado.errores)
+                if (segundos is None):
+                    proximaLectura = "ninguna, la empresa ya no se procesa"
+                else:
+                    proximaLectura = f"{datetime.now() + timedelta(seconds=segundos):%d/%m/%Y %H:%M}"
+                    if (resultado.errores):
+                        proximaLectura += f" (errores consecutivos: {planificador.fallosConsecutivos(empresaId)})"
+                logging.info(f"Empresa {resultado.empresaId}-{resultado.nombre}: {resultado.estado()} - "
+                             f"archivos ok: {resultado.cantArchivosOk} - archivos con error: {resultado.cantArchivosErr} - "
+                             f"próxima lectura: {proximaLectura}")
+            #Las mediciones se informan y reinician cada vez que terminan todas las empresas en proceso
+            if (terminados) and (not enProceso) and (metricas.registro is not None):
+                logMetricas(args)
+                metricas.activar()
+
+        if (enProceso):
+            logging.info(f"Deteniendo el proceso, esperando que terminen {len(enProceso)} empresas en proceso")
+    logging.info("Proceso de lecturas detenido")
+
+
 DEBUG_LEVELS=dict(critical=logging.CRITICAL, error=logging.ERROR, warning=logging.WARNING, 
               info=logging.INFO, debug=logging.DEBUG)
 
@@ -130,12 +421,176 @@ def main(argv=None): # IGNORE:C0111
                             dest="dryRun", 
                             action="store_true",
                             help="ejecutar en modo simulación")
+        parser.add_argument("-w", "--workers", 
+                            dest="workers", 
+                            type=int,
+                            help="cantidad de empresas a procesar en paralelo [default: %(default)s]")
+        parser.add_argument("--bulk", 
+                            dest="bulk", 
+                            action="store_true",
+                            help="importar las lecturas con inserciones masivas (executemany) [default: %(default)s]")
+        parser.add_argument("--streaming", 
+                            dest="streaming", 
+                            action="store_true",
+                            help="procesar los archivos a medida que se leen del servidor, sin descargarlos a disco [default: %(default)s]")
+        parser.add_argument("-p", "--parser", 
+                            dest="parser", 
+                            choices=[PL_REFLEXIVO, PL_COMPILADO, PL_COLUMNAR, PL_AUTOMATICO], 
+                            help="parser de las líneas de los archivos de lecturas. El parser columnar (requiere numpy) convierte el archivo completo por columnas y "
+                                 f"{PL_AUTOMATICO} lo utiliza para los archivos de al menos {MINIMO_LINEAS_COLUMNAR} líneas. Valores validos: %(choices)s [default: %(default)s]")
+        parser.add_argument("--ventana-dias", 
+                            dest="ventanaDias", 
+                            type=int,
+                            help="cantidad máxima de archivos diarios pendientes a procesar por ramal [default: %(default)s]")
+        parser.add_argument("--descargas-paralelas", 
+                            dest="descargasParalelas", 
+                            type=int,
+                            help="cantidad de archivos a descargar en paralelo por ramal (solo SFTP) [default: %(default)s]")
+        parser.add_argument("--marcas-lectura", 
+                            dest="marcasLectura", 
+                            action="store_true",
+                            help="leer y mantener la tabla de últimas lecturas por ramal (tlm_ultimas_lecturas_res11) [default: %(default)s]")
+        parser.add_argument("--pool-sftp", 
+                            dest="poolSftp", 
+                            action="store_true",
+                            help="reutilizar los transports SFTP autenticados entre las conexiones al mismo host y usuario [default: %(default)s]")
+        parser.add_argument("--timeout-conexion", 
+                            dest="timeoutConexion", 
+                            type=int,
+                            help="segundos de espera para establecer la conexión con los servidores (TCP, banner y login) [default: %(default)s]")
+        parser.add_argument("--timeout-lectura", 
+                            dest="timeoutLectura", 
+                            type=int,
+                            help="segundos de espera de cada respuesta de los servidores una vez conectado [default: %(default)s]")
+        parser.add_argument("--circuit-breaker", 
+                            dest="circuitBreaker", 
+                            action="store_true",
+                            help="recordar los hosts que fallaron (en config.ARCHIVO_ESTADO_HOSTS) y no reintentarlos mientras no respondan [default: %(default)s]")
+        parser.add_argument("--circuit-breaker-espera", 
+                            dest="circuitBreakerEspera", 
+                            type=float,
+                            help="horas desde el último fallo de un host durante las que se verifica que responda antes de conectarse, "
+                                 "debe ser mayor al intervalo entre ejecuciones [default: %(default)s]")
+        parser.add_argument("--keepalive-ftp", 
+                            dest="keepaliveFtp", 
+                            type=int,
+                            help="segundos de inactividad a partir de los cuales se verifica la conexión FTP con un NOOP, si no se indica el estado de la conexión solo se lleva localmente [default: %(default)s]")
+        parser.add_argument("--log-asincronico", 
+                            dest="logAsincronico", 
+                            action="store_true",
+                            help="escribir el log desde un hilo propio (QueueHandler/QueueListener), sin demorar el proceso [default: %(default)s]")
+        parser.add_argument("--debug-muestreo", 
+                            dest="debugMuestreo", 
+                            type=int,
+                            help="máximo de mensajes por segundo del diagnóstico de cada línea y campo de los archivos (nivel debug), el resto se descarta [default: sin límite]")
+        parser.add_argument("--metricas", 
+                            dest="metricas", 
+                            action="store_true",
+                            help="medir los tiempos de cada etapa (conexión, listado, descarga, parseo, validación, inserción masiva, flush y commit) y mostrarlos en el resumen [default: %(default)s]")
+        parser.add_argument("--metricas-json", 
+                            dest="metricasJson", 
+                            help="archivo en el que se guardan las mediciones de las etapas en formato JSON (activa --metricas)")
+        parser.add_argument("--metricas-prometheus", 
+                            dest="metricasPrometheus", 
+                            help="archivo en el que se guardan los totales de las etapas en formato de texto de Prometheus (activa --metricas)")
+        parser.add_argument("--sftp-ventana", 
+                            dest="sftpVentana", 
+                            type=int,
+                            help="tamaño en KB de la ventana de cada canal SFTP, si no se indica se utiliza el de paramiko [default: %(default)s]")
+        parser.add_argument("--sftp-pedido", 
+                            dest="sftpPedido", 
+                            type=int,
+                            help="tamaño en KB de cada pedido de lectura SFTP, no debe superar el máximo del servidor, si no se indica se utiliza el de paramiko [default: %(default)s]")
+        parser.add_argument("--sftp-rangos", 
+                            dest="sftpRangos", 
+                            type=int,
+                            help="cantidad de rangos en que se dividen los archivos SFTP grandes para descargarlos a la vez [default: %(default)s]")
+        parser.add_argument("--daemon", 
+                            dest="daemon", 
+                            action="store_true",
+                            help="ejecutar en forma continua, leyendo cada empresa según su intervalo hasta recibir SIGTERM o SIGINT [default: %(default)s]")
+        parser.add_argument("--intervalo", 
+                            dest="intervalo", 
+                            type=int,
+                            help="minutos entre lecturas de cada empresa en el modo daemon [default: %(default)s]")
+        parser.add_argument("--intervalo-empresa", 
+                            dest="intervalosEmpresa", 
+                            action="append",
+                            metavar="EMPRESA=MINUTOS",
+                            help="minutos entre lecturas de una empresa en el modo daemon, se puede repetir y reemplaza a config.INTERVALOS_EMPRESAS")
+        parser.add_argument("--jitter", 
+                            dest="jitter", 
+                            type=int,
+                            help="porcentaje del intervalo que se suma o resta al azar a cada espera del modo daemon [default: %(default)s]")
+        parser.add_argument("--recarga-configuracion", 
+                            dest="recargaConfiguracion", 
+                            type=int,
+                            help="minutos entre recargas de la configuración (empresas, medidores y últimas lecturas) en el modo daemon [default: %(default)s]")
+        parser.add_argument("--pool-db", 
+                            dest="poolDb", 
+                            type=int,
+                            help="conexiones a la base que se mantienen abiertas [default: la cantidad de workers + 1, como mínimo 5]")
+        parser.add_argument("--pool-db-overflow", 
+                            dest="poolDbOverflow", 
+                            type=int,
+                            help="conexiones a la base que se pueden abrir por encima de --pool-db, se cierran al liberarlas [default: %(default)s]")
+        parser.add_argument("--pool-db-reciclar", 
+                            dest="poolDbReciclar", 
+                            type=int,
+                            help="segundos después de los cuales se reemplaza cada conexión a la base [default: sin límite]")
+        parser.add_argument("--pool-oracle", 
+                            dest="poolOracle", 
+                            action="store_true",
+                            help="tomar las conexiones de un pool de sesiones de Oracle (cx_Oracle.SessionPool) de --pool-db sesiones, en lugar del pool de SQLAlchemy [default: %(default)s]")
+        parser.add_argument("--cache-sentencias", 
+                            dest="cacheSentencias", 
+                            type=int,
+                            help="sentencias preparadas que se mantienen en el cache de cada conexión Oracle [default: el de cx_Oracle]")
+        parser.add_argument("--arraysize", 
+                            dest="arraysize", 
+                            type=int,
+                            help="filas que se traen de Oracle en cada viaje al recorrer una consulta [default: el de SQLAlchemy]")
+        parser.add_argument("--prefetchrows", 
+                            dest="prefetchrows", 
+                            type=int,
+                            help="filas que Oracle envía junto con la ejecución de cada consulta [default: el de cx_Oracle]")
 
         parser.set_defaults(db="TAXWEBD", 
                             logFilename=f"{os.path.splitext(os.path.basename(sys.argv[0]))[0]}.log",
                             debugLevel=logging.INFO,
                             quiet=False, 
-                            dryRun=False)
+                            dryRun=False,
+                            workers=1,
+                            bulk=False,
+                            parser=PL_REFLEXIVO,
+                            streaming=False,
+                            ventanaDias=1,
+                            descargasParalelas=1,
+                            marcasLectura=False,
+                            poolSftp=False,
+                            timeoutConexion=ConexionRemota.timeoutConexion,
+                            timeoutLectura=ConexionRemota.timeoutLectura,
+                            circuitBreaker=False,
+                            circuitBreakerEspera=48,
+                            keepaliveFtp=None,
+                            sftpVentana=None,
+                            sftpPedido=None,
+                            sftpRangos=1,
+                            metricas=False,
+                            logAsincronico=False,
+                            debugMuestreo=None,
+                            daemon=False,
+                            intervalo=24 * 60,
+                            intervalosEmpresa=[],
+                            jitter=10,
+                            recargaConfiguracion=60,
+                            poolDb=None,
+                            poolDbOverflow=10,
+                            poolDbReciclar=None,
+                            poolOracle=False,
+                            cacheSentencias=None,
+                            arraysize=None,
+                            prefetchrows=None)
         # Process arguments
         args = parser.parse_args()
 
@@ -144,11 +599,53 @@ def main(argv=None): # IGNORE:C0111
         debugLevel = getattr(logging, args.debugLevel.upper())
         quiet = args.quiet
         dryRun = args.dryRun
+        workers = args.workers
+        if (workers < 1):
+            raise CLIError(f"La cantidad de workers debe ser mayor o igual a 1 (workers={workers})")
+        if (args.ventanaDias < 1):
+            raise CLIError(f"La ventana de días debe ser mayor o igual a 1 (ventana-dias={args.ventanaDias})")
+        if (args.descargasParalelas < 1):
+            raise CLIError(f"La cantidad de descargas paralelas debe ser mayor o igual a 1 (descargas-paralelas={args.descargasParalelas})")
+        if (args.timeoutConexion < 1) or (args.timeoutLectura < 1):
+            raise CLIError(f"Los timeouts deben ser mayores o iguales a 1 (timeout-conexion={args.timeoutConexion}, timeout-lectura={args.timeoutLectura})")
+        if (args.circuitBreakerEspera <= 0):
+            raise CLIError(f"La espera del circuit breaker debe ser mayor a 0 (circuit-breaker-espera={args.circuitBreakerEspera})")
+        if (args.keepaliveFtp is not None) and (args.keepaliveFtp < 1):
+            raise CLIError(f"El intervalo de keepalive FTP debe ser mayor o igual a 1 (keepalive-ftp={args.keepaliveFtp})")
+        if ((args.sftpVentana is not None) and (args.sftpVentana < 1)) or ((args.sftpPedido is not None) and (args.sftpPedido < 1)):
+            raise CLIError(f"Los tamaños SFTP deben ser mayores o iguales a 1 (sftp-ventana={args.sftpVentana}, sftp-pedido={args.sftpPedido})")
+        if (args.debugMuestreo is not None) and (args.debugMuestreo < 1):
+            raise CLIError(f"El muestreo del debug debe ser mayor o igual a 1 mensaje por segundo (debug-muestreo={args.debugMuestreo})")
+        if (args.sftpRangos < 1):
+            raise CLIError(f"La cantidad de rangos SFTP debe ser mayor o igual a 1 (sftp-rangos={args.sftpRangos})")
+        if (args.intervalo < 1) or (args.recargaConfiguracion < 1):
+            raise CLIError(f"Los intervalos deben ser mayores o iguales a 1 minuto (intervalo={args.intervalo}, recarga-configuracion={args.recargaConfiguracion})")
+        if ((args.poolDb is not None) and (args.poolDb < 1)) or (args.poolDbOverflow < 0):
+            raise CLIError(f"El pool de la base debe tener al menos 1 conexión y un overflow no negativo (pool-db={args.poolDb}, pool-db-overflow={args.poolDbOverflow})")
+        if any((valor is not None) and (valor < 1) for valor in (args.poolDbReciclar, args.cacheSentencias, args.arraysize, args.prefetchrows)):
+            raise CLIError(f"Los parámetros de las conexiones Oracle deben ser mayores o iguales a 1 (pool-db-reciclar={args.poolDbReciclar}, "
+                           f"cache-sentencias={args.cacheSentencias}, arraysize={args.arraysize}, prefetchrows={args.prefetchrows})")
+        if not (0 <= args.jitter < 100):
+            raise CLIError(f"El jitter debe estar entre 0 y 99 (jitter={args.jitter})")
+        #Intervalo propio de cada empresa en segundos, los de la línea de comandos reemplazan a los de la configuración
+        intervalos = {empresaId: minutos * 60 for empresaId, minutos in getattr(config, 'INTERVALOS_EMPRESAS', {}).items()}
+        for intervaloEmpresa in args.intervalosEmpresa:
+            try:
+                empresaId, minutos = (int(valor) for valor in intervaloEmpresa.split('='))
+            except ValueError:
+                raise CLIError(f"El intervalo de la empresa debe tener el formato EMPRESA=MINUTOS (intervalo-empresa={intervaloEmpresa})")
+            intervalos[empresaId] = minutos * 60
+        if any(segundos < 60 for segundos in intervalos.values()):
+            raise CLIError(f"Los intervalos de las empresas deben ser mayores o iguales a 1 minuto ({intervalos})")
 
         initLogging(logFilename, debugLevel)
         
         if not quiet:
             consoleLogging(debugLevel)
+        if (args.logAsincronico):
+            loggingAsincronico()
+        if (args.debugMuestreo is not None):
+            logLecturas.addFilter(FiltroMuestreo(args.debugMuestreo))
          
         logging.info("Proceso de lecturas del Sistema de Telemedición")
 
@@ -167,7 +664,40 @@ def main(argv=None): # IGNORE:C0111
             raise Exception(f"No se encontró la definición de la conexión {db}")
 
         
-        base.initSQLAlchemy(urlSQLAlchemy, connect_args=argsConexion)
+        #Una conexión por worker más la del hilo principal, para que los workers no abran y cierren conexiones de overflow
+        poolSize = args.poolDb if args.poolDb is not None else max(5, workers + 1)
+        poolOracle = None
+        if (args.poolOracle):
+            poolOracle = base.crearPoolOracle(dbConfig['user'], dbConfig['pass'], dbConfig['host'], dbConfig['port'], dbConfig['sid'],
+                                              maximo=poolSize, **argsConexion)
+        #En el modo daemon se verifican las conexiones del pool antes de utilizarlas, pueden haberse cortado mientras 
+        #estaban inactivas
+        base.initSQLAlchemy(urlSQLAlchemy, poolSize=poolSize, maxOverflow=args.poolDbOverflow, prePing=args.daemon, 
+                            reciclar=args.poolDbReciclar, cacheSentencias=args.cacheSentencias, arraysize=args.arraysize, 
+                            prefetchrows=args.prefetchrows, pool=poolOracle, connect_args=argsConexion)
+
+        if (args.poolSftp):
+            ConexionSFTP.poolTransports = PoolTransportsSFTP()
+        ConexionRemota.timeoutConexion = args.timeoutConexion
+        ConexionRemota.timeoutLectura = args.timeoutLectura
+        ConexionFTP.intervaloKeepalive = args.keepaliveFtp
+        if (args.sftpVentana is not None):
+            ConexionSFTP.tamanioVentana = args.sftpVentana * 1024
+        if (args.sftpPedido is not None):
+            ConexionSFTP.tamanioMaximoPedido = args.sftpPedido * 1024
+        ConexionSFTP.rangosParalelos = args.sftpRangos
+        if (args.circuitBreaker):
+            ConexionRemota.circuitBreaker = CircuitBreakerHosts(config.ARCHIVO_ESTADO_HOSTS, 
+                                                                espera=timedelta(hours=args.circuitBreakerEspera))
+        if (args.metricas) or (args.metricasJson) or (args.metricasPrometheus):
+            metricas.activar()
+
+        if (args.daemon):
+            ejecutarDaemon(args, intervalos)
+            if (ConexionSFTP.poolTransports is not None):
+                ConexionSFTP.poolTransports.cerrar()
+            base.cerrarSQLAlchemy()
+            return 0
 
         #Procesar sólo las empresas que tienen medidores
         #FIXME: ¿Que hago con las empresas que tienen medidores pero no tienen configurada una conexión?
@@ -176,54 +706,37 @@ def main(argv=None): # IGNORE:C0111
         cantArchivos = MedidorFiscal.getCantidadArchivosAProcesar(base.session)
         logging.info(f"Cantidad de archivos a procesar : {cantArchivos} del dia")
         
-        for empresa in base.session.query(Empresa).filter(Empresa.medidores!=None, Empresa.conexion != None).order_by(Empresa.nombre):
-            logging.info("------------------------------------------------------------------------------------------")
-            logging.info(f"Procesando Empresa {empresa.id}-{empresa.nombre}")
-            if (empresa.conexion):
-                logging.debug(f"Empresa con conexion")
-                try:
-                    
-                    if (empresa.conexion.protocolo in ('FTPES','FTPS')):
-                        logging.debug(f"Se descarta ya que el protocolo es: {empresa.conexion.protocolo}")
-                        continue
-                    if (empresa.id == 29):
-                        logging.debug('skipping')
-                        continue
-                    empresa.conexion.connectServer()
+        empresas = consultaEmpresasAProcesar(base.session).all()
+        #Última lectura de todos los ramales de todos los medidores, con una única consulta
+        ultimasLecturas = MedidorFiscal.getUltimasLecturasRamales(base.session, 
+                                                                  [medidor for empresa in empresas for medidor in empresa.medidores],
+                                                                  args.marcasLectura)
+        if (workers > 1):
+            #Cada empresa se procesa en su propio worker, con su propia sesión y conexión remota
+            idsEmpresas = [empresa.id for empresa in empresas]
+            base.session.remove()
+            resultados = []
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='empresa') as executor:
+                futuros = {executor.submit(procesarEmpresaEnWorker, idEmpresa, args, ultimasLecturas): idEmpresa for idEmpresa in idsEmpresas}
+                for futuro in as_completed(futuros):
                     try:
-                        if empresa.conexion.connectedServer():
-                            logging.info("Conectado al servidor de la empresa")
-                            #Procesar cada medidor
-                            for medidor in empresa.medidores:
-                                try:
-                                    if(not medidor.envia_telemetria):
-                                        logging.debug(f"Medidor no envia telemetria: {medidor.descripcion}")
-                                        continue
-                                    
-                                    if(medidor.fecha_baja != None):
-                                        logging.debug(f"Medidor se ha dado de baja: {medidor.descripcion} - {medidor.fecha_baja}")
-                                        continue
-                                    
-                                    logging.info(f"Procesando medidor: {medidor.codigo} - {medidor.descripcion}")
-                                    medidor.dirDescargas = config.DIR_DESCARGAS
-                                    #Setear los formatos de fecha, hora, etc que están definidos en la conexión
-#                                     medidor.setFormatosFromDict(empresa.conexion.filtros2Dict())
-                                    medidor.cargarNuevasLecturas()
-                                except Exception as e:
-                                    logging.error(f"Error al procesar el medidor (error={e})")
-#                                    Es necesario continuar con la conexion activa hasta que termine el bucle completo
-#                                    if (DEBUG or TESTRUN):
-#                                        raise(e)
-                    finally:
-                        empresa.conexion.disconnectServer()            
-                except Exception as e:
-                    #El mensaje de la excepción ya viene formateado "msg (error=e)"
-                    logging.error(e)
-                    if (DEBUG or TESTRUN):
-                        raise(e)
-            else:
-                logging.warning("No existe conexión definida")
-                    
+                        resultados.append(futuro.result())
+                    except Exception as e:
+                        resultado = ResultadoEmpresa(futuros[futuro], '')
+                        resultado.errores.append(str(e))
+                        resultados.append(resultado)
+        else:
+            resultados = []
+            base.sesionIngesta(base.session())
+            for empresa in empresas:
+                resultados.append(procesarEmpresa(empresa, args, ultimasLecturas, relanzarErrores=(DEBUG or TESTRUN)))
+
+        logResumen(resultados)
+        if (metricas.registro is not None):
+            logMetricas(args)
+        if (ConexionSFTP.poolTransports is not None):
+            ConexionSFTP.poolTransports.cerrar()
+        base.cerrarSQLAlchemy()
         return 0
     
     except Exception as e:
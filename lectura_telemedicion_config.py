@@ -8,6 +8,8 @@ from pathlib import Path
             
 DIR_BASE = '/home/dbattezzati/eclipse-workspace/lectura_telemedicion_sqlalchemy/data'
 DIR_DESCARGAS = Path(DIR_BASE, 'descargas')
+#Estado de los hosts remotos que fallaron (opción --circuit-breaker)
+ARCHIVO_ESTADO_HOSTS = Path(DIR_BASE, 'estado_hosts.json')
 
 #Usuario que debe ejecutar el sistema 
 RUN_USER = 'oirraza'
@@ -34,3 +36,7 @@ DB_CONFIG = {'TAXWEB':   {'dialect': 'oracle+cx_oracle',
                           'pass': 'manejoint',
                           'encode': 'ISO-8859-15'}
             }
+
+#Minutos entre lecturas de las empresas que no utilizan el intervalo por defecto en el modo daemon (opción --daemon), 
+#ej: cada hora para las empresas que actualizan los archivos en forma horaria {empresaId: minutos}
+INTERVALOS_EMPRESAS = {}
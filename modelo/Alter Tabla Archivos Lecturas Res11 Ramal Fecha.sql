@@ -0,0 +1,72 @@
+
+
+-- Ramal y fecha de las lecturas de cada archivo, obtenidos de su nombre:
+--    {prefijo}_{instalación}_{ramal}_{ddmmyyyy}_res11_dir_regalias.txt
+-- El proceso de lecturas los completa al dar de alta cada archivo, para los archivos existentes
+-- se deben completar con la actualización de este script antes de utilizar la nueva versión
+
+ALTER TABLE REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB ADD (
+  ALC_RAMAL                       NUMBER(3),
+  ALC_FECHA_ARCHIVO               DATE
+);
+
+COMMENT ON COLUMN REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB.ALC_RAMAL IS 'Ramal del medidor, obtenido del nombre del archivo';
+
+COMMENT ON COLUMN REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB.ALC_FECHA_ARCHIVO IS 'Fecha de las lecturas del archivo, obtenida de su nombre';
+
+
+
+
+-- Completar los archivos existentes (se ejecuta en lotes para no generar una única transacción muy grande).
+-- Igual que el proceso de lecturas, si la fecha del nombre no es válida (ej: 32062021) el archivo queda con el ramal
+-- y sin fecha, y si el ramal no es válido queda sin ramal, sin detener la actualización del resto de los archivos
+DECLARE
+   TYPE tIds IS TABLE OF REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB.ALC_ID%TYPE;
+   TYPE tNombres IS TABLE OF REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB.ALC_NOMBRE%TYPE;
+   cFormato   CONSTANT VARCHAR2(100) := '(.+_)([0-9]+)_([0-9]{8})(_res11_dir_regalias.txt)';
+   vIds       tIds;
+   vNombres   tNombres;
+   vUltimoId  REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB.ALC_ID%TYPE := 0;
+   vRamal     REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB.ALC_RAMAL%TYPE;
+   vFecha     DATE;
+BEGIN
+   LOOP
+      SELECT ALC_ID, ALC_NOMBRE BULK COLLECT INTO vIds, vNombres
+        FROM (SELECT ALC_ID, ALC_NOMBRE
+                FROM REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB
+               WHERE ALC_ID > vUltimoId
+                 AND ALC_RAMAL IS NULL
+                 AND REGEXP_LIKE(ALC_NOMBRE, cFormato, 'i')
+               ORDER BY ALC_ID)
+       WHERE ROWNUM <= 10000;
+      EXIT WHEN vIds.COUNT = 0;
+      FOR i IN 1 .. vIds.COUNT LOOP
+         BEGIN
+            vRamal := TO_NUMBER(REGEXP_SUBSTR(vNombres(i), cFormato, 1, 1, 'i', 2));
+         EXCEPTION
+            WHEN VALUE_ERROR THEN
+               vRamal := NULL;
+         END;
+         BEGIN
+            vFecha := TO_DATE(REGEXP_SUBSTR(vNombres(i), cFormato, 1, 1, 'i', 3), 'DDMMYYYY');
+         EXCEPTION
+            WHEN OTHERS THEN
+               vFecha := NULL;
+         END;
+         UPDATE REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB
+            SET ALC_RAMAL = vRamal,
+                ALC_FECHA_ARCHIVO = vFecha
+          WHERE ALC_ID = vIds(i);
+      END LOOP;
+      vUltimoId := vIds(vIds.COUNT);
+      COMMIT;
+   END LOOP;
+   COMMIT;
+END;
+/
+
+
+
+
+CREATE INDEX REGALIAS.NU_ALC_MDS_RAMAL_FECHA ON REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB
+(ALC_MDS_ID, ALC_RAMAL, ALC_FECHA_ARCHIVO);
@@ -0,0 +1,58 @@
+
+
+CREATE TABLE REGALIAS.TLM_ULTIMAS_LECTURAS_RES11
+(
+  ULR_MDS_ID                      NUMBER(9)     NOT NULL,
+  ULR_RAMAL                       NUMBER(3)     NOT NULL,
+  ULR_FECHA_HORA                  DATE          NOT NULL
+);
+
+COMMENT ON TABLE REGALIAS.TLM_ULTIMAS_LECTURAS_RES11 IS 'Fecha y hora de la última lectura cargada de cada ramal de cada medidor (se mantiene con la opción --marcas-lectura)';
+
+COMMENT ON COLUMN REGALIAS.TLM_ULTIMAS_LECTURAS_RES11.ULR_MDS_ID IS 'ID del medidor';
+
+COMMENT ON COLUMN REGALIAS.TLM_ULTIMAS_LECTURAS_RES11.ULR_RAMAL IS 'Ramal del medidor';
+
+COMMENT ON COLUMN REGALIAS.TLM_ULTIMAS_LECTURAS_RES11.ULR_FECHA_HORA IS 'Fecha y hora de la última lectura cargada';
+
+
+
+
+CREATE UNIQUE INDEX REGALIAS.TLM_ULTIMAS_LECTURAS_RES11_PK ON REGALIAS.TLM_ULTIMAS_LECTURAS_RES11
+(ULR_MDS_ID, ULR_RAMAL);
+
+
+
+
+ALTER TABLE REGALIAS.TLM_ULTIMAS_LECTURAS_RES11 ADD (
+  CONSTRAINT TLM_ULTIMAS_LECTURAS_RES11_PK
+ PRIMARY KEY
+ (ULR_MDS_ID, ULR_RAMAL));
+
+ALTER TABLE REGALIAS.TLM_ULTIMAS_LECTURAS_RES11 ADD (
+  CONSTRAINT FK_ULR_MDS
+ FOREIGN KEY (ULR_MDS_ID)
+ REFERENCES REGALIAS.TREMEDFISCAL (REMEDFISID));
+
+
+
+
+-- Carga inicial a partir de las lecturas existentes (opcional, si no se carga la marca de cada ramal
+-- se calcula sobre la tabla de lecturas hasta que se importe su próximo archivo)
+INSERT INTO REGALIAS.TLM_ULTIMAS_LECTURAS_RES11 (ULR_MDS_ID, ULR_RAMAL, ULR_FECHA_HORA)
+SELECT ALC_MDS_ID,
+       TO_NUMBER(REGEXP_SUBSTR(ALC_NOMBRE, '(.+_)([0-9]+)(_[0-9]{8}_res11_dir_regalias.txt)', 1, 1, 'i', 2)),
+       MAX(ALD_FECHA_HORA)
+  FROM REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_DET
+  JOIN REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB ON ALC_ID = ALD_ALC_ID
+ WHERE ALC_FECHA_BAJA IS NULL
+   AND ALD_FECHA_BAJA IS NULL
+   -- Los archivos cuyo nombre no tiene el formato esperado no tienen ramal (su marca se calcula sobre las lecturas)
+   AND REGEXP_LIKE(ALC_NOMBRE, '(.+_)([0-9]+)(_[0-9]{8}_res11_dir_regalias.txt)', 'i')
+ GROUP BY ALC_MDS_ID, TO_NUMBER(REGEXP_SUBSTR(ALC_NOMBRE, '(.+_)([0-9]+)(_[0-9]{8}_res11_dir_regalias.txt)', 1, 1, 'i', 2));
+
+COMMIT;
+
+
+-- Otorgar DELETE, INSERT, SELECT y UPDATE sobre la tabla al usuario con el que se conecta el proceso de lecturas
+-- (el mismo que tiene esos permisos sobre REGALIAS.TLM_ARCHIVOS_LECTURA_RES11_CAB)
@@ -4,20 +4,62 @@ Created on May 30, 2020
 @author: oirraza
 '''
 
-from sqlalchemy import create_engine
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event, func, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import NullPool
 
 #Definir variables globales de SQLAlchemy
 engine = None
-session = None
+Session = None   #Fábrica de sesiones, cada unidad de trabajo (ej: worker) debe utilizar su propia sesión
+session = None   #Sesión propia de cada hilo (scoped_session), para el código que no recibe una sesión
+poolOracle = None   #Pool de sesiones de cx_Oracle, si el engine obtiene las conexiones de él
 
 Base = declarative_base()
 
  
-def initSQLAlchemy(engineURL, **Kwargs):
+def initSQLAlchemy(engineURL, poolSize=None, maxOverflow=None, prePing=False, reciclar=None, 
+                   cacheSentencias=None, arraysize=None, prefetchrows=None, pool=None, **Kwargs):
+    """Crea el engine y las fábricas de sesiones
+    poolSize, maxOverflow y reciclar (segundos de vida de cada conexión) configuran el pool de conexiones del engine, 
+    si son None se utilizan los valores por defecto de SQLAlchemy (con SQLite sólo se aplica reciclar). prePing verifica cada conexión antes de utilizarla.
+    cacheSentencias (cache de sentencias de cada conexión), arraysize y prefetchrows (filas por viaje a la base en las 
+    consultas) sólo se aplican con cx_Oracle.
+    Si se indica pool (ver crearPoolOracle) las conexiones se toman del pool de sesiones de Oracle en lugar del 
+    pool de SQLAlchemy
+    El resto de los parámetros se pasan a create_engine
+    """
     global engine
+    global Session
     global session
+    global poolOracle
+    
+    backend = make_url(engineURL).get_backend_name()
+    oracle = backend == 'oracle'
+    if (not oracle) and any(valor is not None for valor in (cacheSentencias, arraysize, prefetchrows, pool)):
+        logging.warning("Los parámetros cacheSentencias, arraysize, prefetchrows y pool sólo se aplican con Oracle")
+    if (pool is not None) and (oracle):
+        #El pool de Oracle administra las conexiones, al cerrarlas SQLAlchemy las devuelve a ese pool
+        poolOracle = pool
+        Kwargs.update(creator=pool.acquire, poolclass=NullPool)
+    else:
+        parametrosPool = [('pool_recycle', reciclar)]
+        #SQLite (ej: desarrollo) no utiliza un pool de tamaño fijo
+        if (backend != 'sqlite'):
+            parametrosPool += [('pool_size', poolSize), ('max_overflow', maxOverflow)]
+        for parametro, valor in parametrosPool:
+            if (valor is not None):
+                Kwargs[parametro] = valor
+        if (prePing):
+            Kwargs['pool_pre_ping'] = True
+    if (oracle) and (arraysize is not None):
+        Kwargs['arraysize'] = arraysize
     
     engine = create_engine(engineURL, **Kwargs) 
 #                            connect_args={
@@ -25,7 +67,137 @@ def initSQLAlchemy(engineURL, **Kwargs):
 #                                "nencoding": "ISO-8859-15"
 #                            })
 
+    if (oracle) and (cacheSentencias is not None):
+        @event.listens_for(engine, 'connect')
+        def _cacheSentencias(conexionDBAPI, registro):
+            conexionDBAPI.stmtcachesize = cacheSentencias
+
+    if (oracle) and (prefetchrows is not None):
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _prefetchrows(conexion, cursor, sentencia, parametros, contexto, executemany):
+            if (not executemany):
+                cursor.prefetchrows = prefetchrows
+
+    #La fábrica de sesiones queda disponible para los procesos que necesiten su propia sesión (ej: workers)
     Session = sessionmaker(bind=engine, autoflush=False)
+    session = scoped_session(Session)
+
+
+def crearPoolOracle(usuario, password, host, port, sid, minimo=1, maximo=4, incremento=1, **Kwargs):
+    """Crea un pool de sesiones de cx_Oracle (SessionPool) para pasarlo a initSQLAlchemy.
+    Las sesiones se crean a demanda entre minimo y maximo y se comparten entre los hilos, evitando abrir y cerrar
+    conexiones con cada unidad de trabajo. El resto de los parámetros (ej: encoding) se pasan a SessionPool
+    """
+    import cx_Oracle
+    return cx_Oracle.SessionPool(user=usuario, password=password, dsn=cx_Oracle.makedsn(host, port, sid=sid), 
+                                 min=minimo, max=maximo, increment=incremento, 
+                                 threaded=True, getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT, **Kwargs)
+
+
+@contextmanager
+def unidadDeTrabajo(expirarEnCommit=True):
+    """Sesión propia para una unidad de trabajo (ej: una empresa en un worker): al terminar sin errores se hace commit,
+    ante un error rollback, y siempre se cierra devolviendo la conexión al pool.
+    Si expirarEnCommit es falso los objetos no se expiran en cada commit (ver sesionIngesta)
+    
+    with base.unidadDeTrabajo() as session:
+        ...
+    """
     session = Session()
+    if (not expirarEnCommit):
+        sesionIngesta(session)
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def sesionIngesta(session):
+    """Configura la sesión del ciclo de importación de lecturas, que hace un commit por cada archivo importado: 
+    los objetos no se expiran en cada commit para no volver a consultar la configuración (empresas, conexiones, 
+    medidores y tipos) después de cada archivo. Un rollback (archivo con error) expira igual todos los objetos de 
+    la sesión, que se vuelven a leer de la DB al utilizarlos
+    El resto de las sesiones mantienen el comportamiento por defecto de SQLAlchemy
+    """
+    session.expire_on_commit = False
+    return session
+
+
+def cerrarSQLAlchemy():
+    """Cierra la sesión del hilo actual y todas las conexiones del engine y del pool de Oracle"""
+    global poolOracle
+    if (session is not None):
+        session.remove()
+    if (engine is not None):
+        engine.dispose()
+    if (poolOracle is not None):
+        poolOracle.close(force=True)
+        poolOracle = None
+
+
+
+#Último valor reservado de cada columna sin secuencia, por engine (ver ReservaSecuencia._reservarBloque)
+_reservasSinSecuencia = weakref.WeakKeyDictionary()
+_lockReservasSinSecuencia = threading.Lock()
+
+
+class ReservaSecuencia():
+    '''
+    Reserva bloques de valores de la secuencia asociada a una columna para asignar los ids
+    en memoria, sin consultar la secuencia fila por fila.
+    En Oracle se obtiene el bloque con un único SELECT sobre la secuencia, en el resto de los
+    dialectos (sólo para desarrollo y pruebas, ej: SQLite) se continúa a partir del máximo id de la tabla.
+    Utilizar deSesion para compartir la reserva (y los valores sobrantes de cada bloque) entre los archivos de una sesión
+    '''
+
+    def __init__(self, session, columnaId, tamanioBloque=1000):
+        self._session = session
+        self._columnaId = columnaId
+        self._secuencia = columnaId.default
+        self._tamanioBloque = tamanioBloque
+        self._valores = []
+
+    @classmethod
+    def deSesion(cls, session, columnaId, tamanioBloque=1000):
+        '''Retorna la reserva de la columna compartida por todas las inserciones de la sesión, para que los valores
+        sobrantes de cada bloque se utilicen en las siguientes en lugar de descartarse'''
+        reservas = session.info.setdefault('reservasSecuencias', {})
+        clave = f"{columnaId.table.fullname}.{columnaId.name}"
+        reserva = reservas.get(clave)
+        if (reserva is None):
+            reserva = reservas[clave] = cls(session, columnaId, tamanioBloque)
+        return reserva
 
+    def _reservarBloque(self, cantidad):
+        dialecto = self._session.get_bind().dialect
+        if (dialecto.name == 'oracle'):
+            cantidad = max(cantidad, self._tamanioBloque)
+            nombreSecuencia = self._secuencia.name
+            if (self._secuencia.schema):
+                nombreSecuencia = f"{self._secuencia.schema}.{nombreSecuencia}"
+            valores = self._session.execute(text(f"SELECT {nombreSecuencia}.NEXTVAL FROM dual CONNECT BY LEVEL <= :cantidad"),
+                                            {'cantidad': cantidad}).scalars().all()
+        else:
+            #Sin secuencia (sólo para desarrollo y pruebas, ej: SQLite) los valores continúan a partir del máximo id 
+            #de la tabla y del último valor reservado por las sesiones del proceso, por lo que no se reservan sobrantes.
+            #El lock evita que dos sesiones del proceso reserven los mismos valores antes de insertarlos, pero no 
+            #protege de otros procesos que inserten en la misma tabla
+            with _lockReservasSinSecuencia:
+                reservados = _reservasSinSecuencia.setdefault(self._session.get_bind().engine, {})
+                clave = f"{self._columnaId.table.fullname}.{self._columnaId.name}"
+                ultimoValor = max(self._session.query(func.max(self._columnaId)).scalar() or 0, reservados.get(clave, 0))
+                reservados[clave] = ultimoValor + cantidad
+            valores = list(range(ultimoValor + 1, ultimoValor + cantidad + 1))
+        self._valores.extend(valores)
 
+    def reservar(self, cantidad):
+        '''Retorna una lista con los siguientes "cantidad" valores reservados'''
+        if (len(self._valores) < cantidad):
+            self._reservarBloque(cantidad - len(self._valores))
+        reservados = self._valores[:cantidad]
+        del self._valores[:cantidad]
+        return reservados
@@ -5,11 +5,22 @@ Created on May 23, 2020
 '''
 
 from abc import ABC, abstractmethod
+from collections import namedtuple
+from datetime import datetime, timezone, timedelta
 from enum import Enum
+from pathlib import Path
+import json
 import logging
-from ftplib import FTP, FTP_TLS
+import socket
+import time
+from ftplib import FTP, FTP_TLS, error_perm, error_temp
+import stat
 from ssl import SSLSocket
 import paramiko
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metricas
 
 
 
@@ -39,7 +50,27 @@ class ReusedSSLSocket(SSLSocket):
 
 
 
-class ImplicitFTP_TLS(FTP_TLS):
+class ReusedSessionFTP_TLS(FTP_TLS):
+    """
+    Subclase de FTP_TLS que reutiliza en las conexiones de datos la sesión TLS de la conexión de control.
+    Muchos servidores exigen la reutilización de la sesión (ej: vsftpd con require_ssl_reuse) y además evita
+    un handshake TLS completo por cada transferencia
+    """
+
+    def ntransfercmd(self, cmd, rest=None):
+        """ Sobreescribir ntransfercmd reutilizando la sesión TLS sin cerrar el socket SSL cuando termina la transferencia """
+        conn, size = FTP.ntransfercmd(self, cmd, rest)
+        if self._prot_p:
+            conn = self.context.wrap_socket(conn,
+                                            server_hostname=self.host,
+                                            session=self.sock.session)  # Reutilizar la sesión TLS            
+            conn.__class__ = ReusedSSLSocket  # No cerrar el socket SSL cuando termina la transferencia del archivo
+        return conn, size
+
+
+
+
+class ImplicitFTP_TLS(ReusedSessionFTP_TLS):
     """
     Subclase de FTP_TLS que automáticamente envuelve (wrapea) el socket en SSL para soportar FTPS implícito
     Nota: este método de conexión ya casi no se utiliza, en su lugar se utiliza FTPES (FTPS explícito)
@@ -62,19 +93,131 @@ class ImplicitFTP_TLS(FTP_TLS):
             value = self.context.wrap_socket(value)
         self._sock = value
 
-    def ntransfercmd(self, cmd, rest=None):
-        """ Sobreescribir ntransfercmd reutilizando la sesión TLS sin cerrar el socket SSL cuando termina la transferencia """
-        conn, size = FTP.ntransfercmd(self, cmd, rest)
-        if self._prot_p:
-            conn = self.context.wrap_socket(conn,
-                                            server_hostname=self.host,
-                                            session=self.sock.session)  # Reutilizar la sesión TLS            
-            conn.__class__ = ReusedSSLSocket  # No cerrar el socket SSL cuando termina la transferencia del archivo
-        return conn, size
 
 
 
 
+#Datos de un archivo del listado de un directorio remoto, tamanio y fechaModificacion pueden ser None si
+#el servidor no los informa
+InfoArchivoRemoto = namedtuple('InfoArchivoRemoto', ['nombre', 'tamanio', 'fechaModificacion'])
+
+#Timeouts por defecto de las conexiones (en segundos)
+DEFAULT_TIMEOUT_CONEXION = 15
+DEFAULT_TIMEOUT_LECTURA = 60
+
+#Tamaño de los bloques leídos de la conexión de datos en las descargas FTP
+TAMANIO_BLOQUE_FTP = 256 * 1024
+
+#Tamaño de los bloques en que se divide cada rango de las descargas SFTP por rangos
+TAMANIO_BLOQUE_RANGO_SFTP = 1024 * 1024
+
+
+
+
+class ProgresoDescarga():
+    '''
+    Lleva la cantidad de bytes descargados de un archivo (se puede actualizar desde varios hilos) e informa en el 
+    log el progreso, para los archivos de al menos tamanioMinimoInforme bytes, y la velocidad de la descarga
+    '''
+    PORCENTAJE_INFORME = 25
+    tamanioMinimoInforme = 1024 * 1024
+
+    def __init__(self, nombre, total):
+        self.nombre = nombre
+        self.total = total
+        self.transferidos = 0
+        self._inicio = time.monotonic()
+        self._proximoInforme = self.PORCENTAJE_INFORME
+        self._lock = threading.Lock()
+
+    def actualizar(self, cantidad):
+        with self._lock:
+            self.transferidos += cantidad
+            if (not self.total) or (self.total < self.tamanioMinimoInforme):
+                return
+            porcentaje = self.transferidos * 100 // self.total
+            if (porcentaje < self._proximoInforme) or (porcentaje >= 100):
+                return
+            self._proximoInforme = (porcentaje // self.PORCENTAJE_INFORME + 1) * self.PORCENTAJE_INFORME
+        logging.debug(f"Descargando {self.nombre}: {porcentaje}% ({self.transferidos} de {self.total} bytes)")
+
+    def finalizar(self):
+        segundos = time.monotonic() - self._inicio
+        velocidad = self.transferidos / segundos / (1024 * 1024) if segundos > 0 else 0
+        logging.debug(f"Archivo {self.nombre} descargado: {self.transferidos} bytes en {segundos:.2f} s ({velocidad:.2f} MB/s)")
+
+
+
+
+class CircuitBreakerHosts():
+    '''
+    Recuerda los hosts a los que falló la conexión recientemente, persistiéndolos en un archivo JSON para que se 
+    tengan en cuenta en las próximas ejecuciones. Antes de intentar conectarse a un host que falló hace menos de 
+    "espera", se verifica con una conexión TCP (sin handshake ni login) que el puerto responda, si no responde 
+    se falla inmediatamente en lugar de esperar los timeouts de la conexión completa.
+    La espera debe ser mayor al intervalo entre ejecuciones (ej: el del cron diario), sino la sonda nunca se utiliza.
+    Un host sólo se olvida cuando se conecta con éxito
+    '''
+
+    def __init__(self, archivo, espera=timedelta(hours=48), timeoutSonda=3):
+        self._archivo = Path(archivo)
+        self.espera = espera
+        self.timeoutSonda = timeoutSonda
+        self._lock = threading.Lock()
+        self._fallos = self._cargar()
+
+    def _cargar(self):
+        try:
+            with open(self._archivo, 'r') as f:
+                return {clave: (datos['fallos'], datetime.fromisoformat(datos['ultimoFallo'])) 
+                        for clave, datos in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"No se pudo leer el estado de los hosts {self._archivo} (error: {e})")
+            return {}
+
+    def _guardar(self):
+        try:
+            temporal = self._archivo.with_suffix('.tmp')
+            with open(temporal, 'w') as f:
+                json.dump({clave: {'fallos': fallos, 'ultimoFallo': ultimoFallo.isoformat()} 
+                           for clave, (fallos, ultimoFallo) in self._fallos.items()}, f, indent=2)
+            temporal.replace(self._archivo)
+        except Exception as e:
+            logging.warning(f"No se pudo guardar el estado de los hosts {self._archivo} (error: {e})")
+
+    def permitirConexion(self, host, port) -> bool:
+        """Retorna False si el host falló recientemente y tampoco responde la sonda TCP"""
+        clave = f"{host}:{port}"
+        with self._lock:
+            fallo = self._fallos.get(clave)
+        if (fallo is None) or (datetime.now() - fallo[1] >= self.espera):
+            return True
+        try:
+            with socket.create_connection((host, port), timeout=self.timeoutSonda):
+                pass
+        except OSError as e:
+            logging.debug(f"El host {clave} falló {fallo[0]} veces y no responde la sonda TCP (error: {e})")
+            self.registrarFallo(host, port)
+            return False
+        return True
+
+    def registrarFallo(self, host, port):
+        clave = f"{host}:{port}"
+        with self._lock:
+            fallos, _ = self._fallos.get(clave, (0, None))
+            self._fallos[clave] = (fallos + 1, datetime.now())
+            self._guardar()
+
+    def registrarExito(self, host, port):
+        clave = f"{host}:{port}"
+        with self._lock:
+            if (self._fallos.pop(clave, None) is not None):
+                self._guardar()
+
+
+
 
 class ConexionRemota(ABC):
     '''
@@ -85,12 +228,18 @@ class ConexionRemota(ABC):
     #Eventos
     __onBeforeGetFile = None
     __onAfterGetFile = None
+    #Timeouts en segundos, se pueden cambiar para todas las conexiones (en la clase) o para una en particular
+    timeoutConexion = DEFAULT_TIMEOUT_CONEXION   #Conexión TCP, banner y autenticación
+    timeoutLectura = DEFAULT_TIMEOUT_LECTURA   #Espera de cada respuesta o bloque de datos del servidor
+    #Circuit breaker compartido por todas las conexiones, si es None no se verifica el estado de los hosts
+    circuitBreaker = None
 
 
     def __init__(self, host, port):
         '''Constructor'''
         self.host = host
         self.port = port
+        self._listado = None
     
     @property
     def host(self):
@@ -143,16 +292,64 @@ class ConexionRemota(ABC):
     @abstractmethod
     def disconnect(self):
         pass
+
+    def conectar(self, user, password):
+        """Establece la conexión (connect) teniendo en cuenta el circuit breaker, si hay uno configurado"""
+        circuitBreaker = self.circuitBreaker
+        if (circuitBreaker is not None) and (not circuitBreaker.permitirConexion(self.host, self.port)):
+            raise ConnectionError(f"El host {self.host}:{self.port} falló recientemente y sigue sin responder")
+        try:
+            with metricas.medir('conexion'):
+                self.connect(user, password)
+        except Exception:
+            if (circuitBreaker is not None):
+                circuitBreaker.registrarFallo(self.host, self.port)
+            raise
+        if (circuitBreaker is not None):
+            circuitBreaker.registrarExito(self.host, self.port)
     
     @abstractmethod
     def changeDir(self, directory):
         logging.debug(f"Cambiando al directorio {directory}")
         self.checkConnected()
+        self._invalidarListado()
+
+    @abstractmethod
+    def _doListDir(self):
+        """Retorna un iterable de InfoArchivoRemoto con los archivos (no directorios) del directorio actual"""
+        pass
+
+    def _invalidarListado(self):
+        self._listado = None
+
+    def listDir(self):
+        """Retorna los archivos del directorio actual como un diccionario {nombre: InfoArchivoRemoto}.
+        El listado se solicita al servidor una única vez por conexión y directorio
+        """
+        if (self._listado is None):
+            logging.debug("Listando el directorio remoto")
+            self.checkConnected()
+            with metricas.medir('listado'):
+                self._listado = {archivo.nombre: archivo for archivo in self._doListDir()}
+            logging.debug(f"Directorio remoto listado ({len(self._listado)} archivos)")
+        return self._listado
 
     @abstractmethod
     def _doGetFile(self, remoteFilename, localFilename):
         pass
 
+    @abstractmethod
+    def _doOpenFile(self, remoteFilename):
+        pass
+
+    def openFile(self, remoteFilename):
+        """Abre el archivo remoto para leerlo como un stream de bytes, sin descargarlo a disco.
+        El objeto retornado se debe cerrar (se puede utilizar con with)
+        """
+        logging.debug(f"Abriendo archivo remoto {remoteFilename}")
+        self.checkConnected()
+        return self._doOpenFile(remoteFilename)
+
     def getFile(self, remoteFilename, localFilename):
         logging.debug(f"Descargando archivo {remoteFilename} en {localFilename}")
         self.checkConnected()
@@ -161,12 +358,129 @@ class ConexionRemota(ABC):
             logging.debug("Ejecutando handler evento BeforeGetFile")
             self.__onBeforeGetFile(self, remoteFilename, localFilename)
         #Descargar el archivo 
-        self._doGetFile(remoteFilename, localFilename)
+        with metricas.medir('descarga'):
+            self._doGetFile(remoteFilename, localFilename)
         #Lanzar el evento OnBeforeGetFile
         if (self.__onAfterGetFile is not None):
             logging.debug("Ejecutando handler evento AfterGetFile")
             self.__onAfterGetFile(self, remoteFilename, localFilename) 
 
+    @property
+    def soportaDescargasParalelas(self):
+        """Indica si la conexión puede descargar varios archivos a la vez"""
+        return False
+
+    def _iniciarHiloDescarga(self):
+        """Se ejecuta al iniciar cada hilo de descargas paralelas (ej: para abrir un canal propio)"""
+        pass
+
+    def _finalizarDescargasParalelas(self):
+        """Se ejecuta al terminar las descargas paralelas (ej: para cerrar los canales abiertos)"""
+        pass
+
+    def getFiles(self, archivos, maxParalelas=1):
+        """Descarga la lista de archivos [(remoteFilename, localFilename)].
+        Retorna un iterador que entrega cada par, en el mismo orden de la lista, cuando termina su descarga. 
+        Si la conexión lo soporta, hasta maxParalelas archivos se descargan a la vez por delante del que se está 
+        entregando. Si una descarga falla el iterador genera la excepción y se cancelan las descargas pendientes
+        """
+        if (maxParalelas <= 1) or (not self.soportaDescargasParalelas) or (len(archivos) <= 1):
+            for remoteFilename, localFilename in archivos:
+                self.getFile(remoteFilename, localFilename)
+                yield remoteFilename, localFilename
+            return
+        self.checkConnected()
+        executor = ThreadPoolExecutor(max_workers=maxParalelas, thread_name_prefix='descarga', 
+                                      initializer=self._iniciarHiloDescarga)
+        try:
+            #Las descargas se miden con las etiquetas (empresa, medidor, ramal) del hilo que las solicita
+            etiquetas = metricas.etiquetasActuales()
+            futuros = [(executor.submit(metricas.enEtiquetas, dict(etiquetas, archivo=remoteFilename), 
+                                        self.getFile, remoteFilename, localFilename), remoteFilename, localFilename) 
+                       for remoteFilename, localFilename in archivos]
+            for futuro, remoteFilename, localFilename in futuros:
+                futuro.result()
+                yield remoteFilename, localFilename
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self._finalizarDescargasParalelas()
+
+
+
+
+class ArchivoRemotoFTP():
+    '''
+    Stream de lectura de un archivo remoto FTP, leído directamente desde la conexión de datos.
+    Al cerrarlo se cierra la conexión de datos y, si el archivo se leyó completo, se verifica la respuesta del 
+    servidor a la transferencia. Si no se leyó completo (ej: error al procesar el archivo) se cancela la transferencia
+    '''
+
+    def __init__(self, conexion, conn):
+        self._conexion = conexion
+        self._ftp = conexion._ftp
+        self._conn = conn
+        self._file = conn.makefile('rb')
+        self._completo = False
+        self.closed = False
+
+    def read(self, size=-1):
+        datos = self._file.read(size)
+        #El stream retorna menos bytes que los pedidos sólo al final del archivo
+        if (size is None) or (size < 0) or (len(datos) < size):
+            self._completo = True
+        return datos
+
+    def readline(self, size=-1):
+        linea = self._file.readline(size)
+        if (not linea.endswith(b'\n')) and ((size is None) or (size < 0) or (len(linea) < size)):
+            self._completo = True
+        return linea
+
+    def __iter__(self):
+        for linea in self._file:
+            #Una línea sin salto de línea es la última del archivo, aunque no se siga iterando
+            if not linea.endswith(b'\n'):
+                self._completo = True
+            yield linea
+        self._completo = True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if not self._completo:
+            self._cancelar()
+            return
+        self._file.close()
+        #Igual que FTP.retrbinary, cerrar ordenadamente la sesión TLS de la conexión de datos
+        if isinstance(self._conn, SSLSocket):
+            self._conn.unwrap()
+        self._conn.close()
+        self._ftp.voidresp()
+
+    def _cancelar(self):
+        """Cierra la conexión de datos sin esperar el cierre de la sesión TLS y cancela la transferencia (ABOR).
+        El servidor responde a la transferencia (426, o 226 si ya la había terminado) y al ABOR, los errores se 
+        ignoran para no ocultar el error por el cual no se terminó de leer el archivo. Si la conexión de control no 
+        responde se considera desconectada
+        """
+        self._file.close()
+        self._conn.close()
+        for comando in (self._ftp.abort, self._ftp.voidresp):
+            try:
+                comando()
+            except Exception as e:
+                logging.debug(f"Error al cancelar la transferencia {self._conexion._labelProtocol} (error: {e})")
+                self._conexion._registrarError(e)
+                if isinstance(e, (OSError, EOFError)):
+                    break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 
 
 
@@ -176,10 +490,20 @@ class ConexionFTP(ConexionRemota):
     '''
     _ftp = None
     _labelProtocol = ''
+    #Cantidad de veces que se reanuda (REST) una descarga interrumpida, reconectando al servidor
+    reintentosDescarga = 2
+    #Segundos de inactividad a partir de los cuales connected verifica la conexión con un NOOP,
+    #si es None el estado de la conexión solo se lleva localmente
+    intervaloKeepalive = None
 
 
     def __init__(self, host, port=21):
         super().__init__(host, port)
+        self._usuario = None
+        self._password = None
+        self._directorio = None
+        self._conectado = False
+        self._ultimaActividad = None
         self._initFTP()
         
     def _initFTP(self):
@@ -188,22 +512,49 @@ class ConexionFTP(ConexionRemota):
         
     @property
     def connected(self):
-        try:
-            self._ftp.voidcmd("NOOP")
-            return True
-        except:
-            return False    
+        """El estado de la conexión se lleva localmente (se activa en el login y se desactiva al desconectar o ante
+        un error de la conexión), solo se envía un NOOP si pasaron intervaloKeepalive segundos sin actividad
+        """
+        if (not self._conectado) or (self._ftp.sock is None):
+            return False
+        if (self.intervaloKeepalive is not None) and (time.monotonic() - self._ultimaActividad >= self.intervaloKeepalive):
+            try:
+                self._ftp.voidcmd("NOOP")
+                self._registrarActividad()
+            except Exception as e:
+                logging.debug(f"La conexión {self._labelProtocol} no respondió el NOOP (error: {e})")
+                self._conectado = False
+        return self._conectado
+
+    def _registrarActividad(self):
+        self._ultimaActividad = time.monotonic()
+
+    def _registrarError(self, e):
+        """Ante un error de la conexión (no de un comando rechazado por el servidor) se considera desconectada"""
+        if isinstance(e, (OSError, EOFError)):
+            self._conectado = False
     
     def connect(self, user, password):
 #         try:
-            self._ftp.connect(self.host, self.port)
+            self._invalidarListado()
+            self._usuario = user
+            self._password = password
+            self._directorio = None
+            self._ftp.connect(self.host, self.port, timeout=self.timeoutConexion)
             logging.debug(f"Estableciendo conexión {self._labelProtocol} (host:{self.host}, port:{self.port}, user:{user}, pass:********)")
             self._ftp.login(user, password)
+            #A partir de aquí el timeout se aplica a cada respuesta (incluyendo las conexiones de datos)
+            self._ftp.timeout = self.timeoutLectura
+            self._ftp.sock.settimeout(self.timeoutLectura)
+            self._conectado = True
+            self._registrarActividad()
             logging.debug(f"Conexión {self._labelProtocol} establecida")
 #         except Exception as e:
 #             raise ConnectionError(f"Error al establecer la conexión {self._labelProtocol} (error: {e})")
         
     def disconnect(self):
+        self._invalidarListado()
+        self._conectado = False
         #Primero intentar una desconexión cortés, si no funciona se 
         #genera una excepción, entonces forzar la desconexión
         try:
@@ -217,14 +568,93 @@ class ConexionFTP(ConexionRemota):
     def changeDir(self, directory):
         super().changeDir(directory)
         try:
-            self._ftp.chdir(directory)
+            self._ftp.cwd(directory)
+            self._directorio = directory
+            self._registrarActividad()
         except Exception as e:
+            self._registrarError(e)
             raise Exception(f"Error al cambiar al directorio {directory} (error: {e})")
 
+    def _doListDir(self):
+        try:
+            try:
+                #MLSD informa tamaño y fecha de modificación de todos los archivos en una sola transferencia
+                listado = [(nombre, datos) for nombre, datos in self._ftp.mlsd(facts=['type', 'size', 'modify'])
+                           if datos.get('type', 'file') == 'file']
+            except error_perm:
+                #El servidor no soporta MLSD, solo se pueden obtener los nombres
+                logging.debug("El servidor no soporta MLSD, listando con NLST")
+                listado = [(nombre, {}) for nombre in self._ftp.nlst()]
+            self._registrarActividad()
+        except Exception as e:
+            self._registrarError(e)
+            raise Exception(f"Error al listar el directorio remoto (error: {e})")
+        return [InfoArchivoRemoto(nombre, 
+                                  int(datos['size']) if 'size' in datos else None,
+                                  _fechaMLSD(datos['modify']) if 'modify' in datos else None)
+                for nombre, datos in listado]
+
+    def _reconectar(self):
+        """Vuelve a establecer la conexión (ej: después de una descarga interrumpida), en el mismo directorio 
+        y conservando el listado del directorio
+        """
+        logging.debug(f"Reconectando {self._labelProtocol} (host:{self.host}, port:{self.port})")
+        listado = self._listado
+        directorio = self._directorio
+        try:
+            self._ftp.close()
+        except Exception:
+            pass
+        self._initFTP()
+        self.connect(self._usuario, self._password)
+        if (directorio is not None):
+            self._ftp.cwd(directorio)
+            self._directorio = directorio
+        self._listado = listado
+
     def _doGetFile(self, remoteFilename, localFilename):
         super()._doGetFile(remoteFilename, localFilename)
-        #TODO: implementar getFile con FTP
-        raise NotImplementedError("Error: Método aún no implementado")
+        intentos = 0
+        with open(localFilename, 'wb') as archivo:
+            while True:
+                #Si es una reanudación se pide el archivo a partir de los bytes ya descargados
+                descargado = archivo.tell()
+                try:
+                    #retrbinary configura el modo binario (TYPE I) antes de la transferencia
+                    self._ftp.retrbinary(f"RETR {remoteFilename}", archivo.write, 
+                                         blocksize=TAMANIO_BLOQUE_FTP, rest=(descargado or None))
+                    self._registrarActividad()
+                    return
+                except error_perm as e:
+                    #Error permanente (ej: archivo inexistente), o el servidor no soporta REST
+                    if (descargado == 0):
+                        raise Exception(f"Error al descargar el archivo {remoteFilename} (error: {e})")
+                    logging.debug(f"El servidor no permitió reanudar la descarga de {remoteFilename} (error: {e}), descargándolo completo")
+                    archivo.seek(0)
+                    archivo.truncate()
+                except (OSError, EOFError, error_temp) as e:
+                    #Conexión interrumpida o timeout: el estado de la conexión de control es incierto, reconectar
+                    if (intentos >= self.reintentosDescarga):
+                        self._registrarError(e)
+                        raise Exception(f"Error al descargar el archivo {remoteFilename} (error: {e})")
+                    intentos += 1
+                    archivo.flush()
+                    logging.debug(f"Descarga de {remoteFilename} interrumpida en {archivo.tell()} bytes (error: {e}), reanudando (intento {intentos})")
+                    try:
+                        self._reconectar()
+                    except Exception as eConexion:
+                        self._conectado = False
+                        raise Exception(f"Error al descargar el archivo {remoteFilename}, no se pudo reconectar (error: {eConexion})")
+
+    def _doOpenFile(self, remoteFilename):
+        try:
+            self._ftp.voidcmd('TYPE I')
+            conn = self._ftp.transfercmd(f"RETR {remoteFilename}")
+            self._registrarActividad()
+        except Exception as e:
+            self._registrarError(e)
+            raise Exception(f"Error al abrir el archivo {remoteFilename} (error: {e})")
+        return ArchivoRemotoFTP(self, conn)
     
     def setMode(self, mode):
         '''Configura el modo de transferencia ASCII (ASC) o Binario (BIN)'''
@@ -239,7 +669,9 @@ class ConexionFTP(ConexionRemota):
         #Activar el modo de transferencia
         try:
             self._ftp.sendcmd(cmdMode)
+            self._registrarActividad()
         except Exception as e:
+            self._registrarError(e)
             raise Exception(f"Error al configurar el modo de transferencia {mode} (error: {e})")
     
     
@@ -275,7 +707,7 @@ class ConexionFTPES(ConexionFTP):
     '''
  
     def _initFTP(self):
-        self._ftp = FTP_TLS()
+        self._ftp = ReusedSessionFTP_TLS()
         self._labelProtocol = 'FTPES'
 
     def connect(self, user, password):
@@ -289,37 +721,133 @@ class ConexionFTPES(ConexionFTP):
     
     
     
+class PoolTransportsSFTP():
+    '''
+    Pool de transports SSH autenticados por (host, port, usuario). 
+    Permite que las conexiones SFTP de distintas ejecuciones (ej: cada ciclo del modo daemon) reutilicen el transport, 
+    pagando el handshake y la autenticación una única vez. Los transports se mantienen vivos con keepalives y cada
+    ConexionSFTP abre sus propios canales SFTP sobre el transport compartido
+    '''
+
+    def __init__(self, keepalive=30):
+        self.keepalive = keepalive   #Segundos entre keepalives, 0 para deshabilitarlos
+        self._transports = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, host, port, user, password, crearTransport):
+        """Retorna un transport autenticado para (host, port, user), si no hay uno activo en el pool lo crea con la 
+        función crearTransport() y lo agrega"""
+        clave = (host, port, user)
+        with self._lock:
+            transport = self._transports.get(clave)
+            if (transport is not None) and (transport.is_active()) and (transport.is_authenticated()):
+                logging.debug(f"Reutilizando el transport SSH (host:{host}, port:{port}, user:{user})")
+                return transport
+            self._transports.pop(clave, None)
+        if (transport is not None):
+            transport.close()
+        transport = crearTransport()
+        if (self.keepalive):
+            transport.set_keepalive(self.keepalive)
+        with self._lock:
+            #Si otro hilo agregó un transport para la misma clave mientras se conectaba, utilizar ese
+            existente = self._transports.setdefault(clave, transport)
+        if (existente is not transport):
+            transport.close()
+        return existente
+
+    def descartar(self, transport):
+        """Quita el transport del pool y lo cierra (ej: después de un error de la conexión)"""
+        with self._lock:
+            for clave, actual in list(self._transports.items()):
+                if (actual is transport):
+                    del self._transports[clave]
+        transport.close()
+
+    def cerrar(self):
+        """Cierra todos los transports del pool"""
+        with self._lock:
+            transports = list(self._transports.values())
+            self._transports.clear()
+        for transport in transports:
+            transport.close()
+
+
+
+
 class ConexionSFTP(ConexionRemota):  
     '''
     Subclase de ConexionRemota que implementa una conexión SFTP
     '''
     _sftp = None
     _transport = None
+    #Pool de transports compartido por todas las conexiones SFTP, si es None cada conexión crea y cierra el suyo
+    poolTransports = None
+    #Parámetros de lectura anticipada (prefetch), si son None se utilizan los valores por defecto de paramiko
+    tamanioVentana = None   #Ventana de cada canal SFTP en bytes (datos en vuelo sin confirmar)
+    tamanioMaximoPedido = None   #Bytes de cada pedido de lectura, no debe superar el máximo que acepta el servidor
+    maxPedidosConcurrentes = None   #Pedidos de lectura pendientes por archivo
+    #Descarga por rangos: los archivos de al menos tamanioMinimoRangos bytes se dividen en rangosParalelos 
+    #rangos que se descargan a la vez, cada uno en su propio canal
+    rangosParalelos = 1
+    tamanioMinimoRangos = 8 * 1024 * 1024
 
 
     def __init__(self, host, port=22):
         '''Constructor ConexionSFTP, configura el puerto por defecto en 22 
         ''' 
         super().__init__(host, port)
+        #Canales SFTP adicionales (sobre el mismo transport) utilizados por los hilos de descargas paralelas
+        self._canales = threading.local()
+        self._canalesAbiertos = []
+        self._lockCanales = threading.Lock()
     
     @property
     def connected(self):
         try:
-            return self._transport.is_authenticated()
+            return self._transport.is_active() and self._transport.is_authenticated()
         except:
             return False    
+
+    def _crearTransport(self, user, password):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeoutConexion)
+        transport = paramiko.Transport(sock)
+        transport.banner_timeout = self.timeoutConexion
+        transport.handshake_timeout = self.timeoutConexion
+        transport.auth_timeout = self.timeoutConexion
+        try:
+            transport.connect(username=user, password=password)
+        except Exception:
+            transport.close()
+            raise
+        return transport
             
     def connect(self, user, password):
         try:
             logging.debug(f"Estableciendo conexión SFTP (host:{self.host}, port:{self.port}, user:{user}, pass:********)")
-            self._transport = paramiko.Transport(self.host, self.port)
-            self._transport.connect(None, user, password, None)
-            self._sftp = paramiko.SFTPClient.from_transport(self._transport)
+            self._invalidarListado()
+            pool = self.poolTransports
+            if (pool is not None):
+                self._transport = pool.obtener(self.host, self.port, user, password, 
+                                               lambda: self._crearTransport(user, password))
+            else:
+                self._transport = self._crearTransport(user, password)
+            try:
+                self._sftp = self._abrirCanal()
+            except Exception:
+                #El transport del pool puede haberse cortado sin que se detecte, descartarlo y reintentar una vez
+                if (pool is None):
+                    raise
+                pool.descartar(self._transport)
+                self._transport = pool.obtener(self.host, self.port, user, password, 
+                                               lambda: self._crearTransport(user, password))
+                self._sftp = self._abrirCanal()
             logging.debug(f"Conexión SFTP establecida")
         except Exception as e:
             raise ConnectionError(f"Error al establecer la conexión SFTP (error: {e})")
 
     def disconnect(self):
+        self._invalidarListado()
         if self._sftp is not None:
             try:
                 self._sftp.close()
@@ -327,7 +855,17 @@ class ConexionSFTP(ConexionRemota):
             except Exception as e:
                 logging.debug(f"Error al intentar cerrar la conexión SFTP (error: {e})")
         if self._transport is not None:
-            self._transport.close()
+            #Si el transport pertenece al pool queda abierto para la próxima conexión
+            if (self.poolTransports is None):
+                self._transport.close()
+            elif (not self._transport.is_active()):
+                self.poolTransports.descartar(self._transport)
+
+    def _verificarTransport(self):
+        """Después de un error, si el transport se cortó se descarta del pool para que la próxima conexión cree uno nuevo"""
+        if (self.poolTransports is not None) and (self._transport is not None) and (not self._transport.is_active()):
+            logging.debug("El transport SSH se cortó, descartándolo del pool")
+            self.poolTransports.descartar(self._transport)
 
     def changeDir(self, directory):
         super().changeDir(directory)
@@ -336,17 +874,140 @@ class ConexionSFTP(ConexionRemota):
         except IOError as e:
             raise Exception(f"Error al cambiar al directorio {directory} (error: {e})")
 
+    def _doListDir(self):
+        try:
+            listado = self._sftp.listdir_attr()
+        except IOError as e:
+            self._verificarTransport()
+            raise Exception(f"Error al listar el directorio remoto (error: {e})")
+        return [InfoArchivoRemoto(atributos.filename, 
+                                  atributos.st_size,
+                                  datetime.fromtimestamp(atributos.st_mtime) if atributos.st_mtime is not None else None)
+                for atributos in listado 
+                if (atributos.st_mode is None) or (not stat.S_ISDIR(atributos.st_mode))]
+
+    @property
+    def soportaDescargasParalelas(self):
+        return True
+
+    def _abrirCanal(self, directorio=None):
+        """Abre un canal SFTP sobre el transport de la conexión, posicionado en el directorio indicado"""
+        canal = paramiko.SFTPClient.from_transport(self._transport, window_size=self.tamanioVentana)
+        canal.get_channel().settimeout(self.timeoutLectura)
+        if directorio is not None:
+            canal.chdir(directorio)
+        return canal
+
+    def _abrirArchivoRemoto(self, canal, remoteFilename):
+        archivoRemoto = canal.open(remoteFilename, 'rb')
+        if (self.tamanioMaximoPedido is not None):
+            archivoRemoto.MAX_REQUEST_SIZE = self.tamanioMaximoPedido
+        return archivoRemoto
+
+    @property
+    def _sftpHilo(self):
+        """Retorna el canal SFTP del hilo actual, los hilos de descargas paralelas tienen su propio canal"""
+        return getattr(self._canales, 'sftp', None) or self._sftp
+
+    def _iniciarHiloDescarga(self):
+        #El directorio actual es propio de cada canal
+        canal = self._abrirCanal(self._sftp.getcwd())
+        self._canales.sftp = canal
+        with self._lockCanales:
+            self._canalesAbiertos.append(canal)
+        logging.debug("Canal SFTP adicional abierto")
+
+    def _finalizarDescargasParalelas(self):
+        with self._lockCanales:
+            canales = self._canalesAbiertos
+            self._canalesAbiertos = []
+        for canal in canales:
+            try:
+                canal.close()
+            except Exception as e:
+                logging.debug(f"Error al intentar cerrar el canal SFTP (error: {e})")
+
     def _doGetFile(self, remoteFilename, localFilename):
         super()._doGetFile(remoteFilename, localFilename)
         try:
-            self._sftp.get(remoteFilename, localFilename)
-            #TODO: calcular un hash para ver si se descargo correctamente
+            with self._abrirArchivoRemoto(self._sftpHilo, remoteFilename) as archivoRemoto:
+                tamanio = archivoRemoto.stat().st_size
+                progreso = ProgresoDescarga(remoteFilename, tamanio)
+                if (self.rangosParalelos > 1) and (tamanio >= self.tamanioMinimoRangos):
+                    self._descargarRangos(remoteFilename, localFilename, tamanio, progreso)
+                    #El archivo pudo crecer desde que se consultó su tamaño, descargar el resto
+                    archivoRemoto.seek(tamanio)
+                    with open(localFilename, 'ab') as archivoLocal:
+                        self._copiar(archivoRemoto, archivoLocal, progreso)
+                else:
+                    archivoRemoto.prefetch(tamanio, self.maxPedidosConcurrentes)
+                    with open(localFilename, 'wb') as archivoLocal:
+                        self._copiar(archivoRemoto, archivoLocal, progreso)
+                progreso.finalizar()
         except Exception as e:
+            self._verificarTransport()
             raise Exception(f"Error al descargar el archivo {remoteFilename} (error: {e})")
+
+    @staticmethod
+    def _copiar(archivoRemoto, archivoLocal, progreso):
+        """Copia el archivo remoto, desde su posición actual hasta el final, en el archivo local"""
+        while True:
+            datos = archivoRemoto.read(TAMANIO_BLOQUE_RANGO_SFTP)
+            if not datos:
+                break
+            archivoLocal.write(datos)
+            progreso.actualizar(len(datos))
+
+    def _descargarRangos(self, remoteFilename, localFilename, tamanio, progreso):
+        """Descarga los primeros tamanio bytes del archivo dividiéndolos en rangos que se descargan a la vez, cada 
+        uno con su propio canal, y se escriben en su posición del archivo local
+        """
+        tamanioRango = -(-tamanio // self.rangosParalelos)
+        directorio = self._sftp.getcwd()
+        with open(localFilename, 'wb') as archivoLocal:
+            archivoLocal.truncate(tamanio)
+
+        def descargarRango(inicio, fin):
+            canal = self._abrirCanal(directorio)
+            try:
+                with self._abrirArchivoRemoto(canal, remoteFilename) as archivoRemoto, open(localFilename, 'r+b') as archivoLocal:
+                    archivoLocal.seek(inicio)
+                    bloques = [(posicion, min(TAMANIO_BLOQUE_RANGO_SFTP, fin - posicion)) 
+                               for posicion in range(inicio, fin, TAMANIO_BLOQUE_RANGO_SFTP)]
+                    for datos in archivoRemoto.readv(bloques, self.maxPedidosConcurrentes):
+                        archivoLocal.write(datos)
+                        progreso.actualizar(len(datos))
+            finally:
+                canal.close()
+
+        logging.debug(f"Descargando {remoteFilename} ({tamanio} bytes) en rangos de {tamanioRango} bytes")
+        with ThreadPoolExecutor(max_workers=self.rangosParalelos, thread_name_prefix='rango') as executor:
+            futuros = [executor.submit(descargarRango, inicio, min(inicio + tamanioRango, tamanio)) 
+                       for inicio in range(0, tamanio, tamanioRango)]
+            for futuro in futuros:
+                futuro.result()
+
+    def _doOpenFile(self, remoteFilename):
+        try:
+            archivoRemoto = self._abrirArchivoRemoto(self._sftp, remoteFilename)
+            #Solicitar por adelantado todos los bloques del archivo para no esperar cada lectura
+            archivoRemoto.prefetch(max_concurrent_requests=self.maxPedidosConcurrentes)
+        except Exception as e:
+            self._verificarTransport()
+            raise Exception(f"Error al abrir el archivo {remoteFilename} (error: {e})")
+        return archivoRemoto
     
 
 
 
+def _fechaMLSD(texto):
+    """Convierte la fecha de modificación de MLSD (YYYYMMDDHHMMSS[.sss] en UTC) a la hora local"""
+    fecha = datetime.strptime(texto[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+    return fecha.astimezone().replace(tzinfo=None)
+
+
+
+
 class ConexionRemotaFactory():
     
     @staticmethod    
@@ -16,6 +16,18 @@ from .conexionremota import ConexionRemotaFactory, Protocolos
 from .base import Base
 
 import json
+import re
+from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
+
+
+#Constantes de filtros de la conexión
+FM_FORMATO_FECHA = "formatoFecha"
+FM_FORMATO_HORA = "formatoHora"
+
+DEFAULT_FORMATO_FECHA = "%d/%m/%Y"
+DEFAULT_FORMATO_HORA = "%H:%M:%S"
 
 class Empresa(Base):
     '''
@@ -50,6 +62,102 @@ class Empresa(Base):
 
 
 
+class ParserFechaHora():
+    '''
+    Parser de fecha y hora para un formato dado. 
+    Si el formato sólo contiene directivas numéricas de ancho fijo (%d, %m, %Y, %H, %M, %S) y separadores, 
+    los valores se obtienen recortando el texto en posiciones precalculadas. Si el texto no respeta 
+    exactamente esas posiciones (ej: "1/6/2021") o el formato tiene otras directivas, se utiliza datetime.strptime
+    '''
+    #Directiva: (ancho, orden del argumento en datetime(año, mes, día, hora, minuto, segundo))
+    _DIRECTIVAS_FIJAS = {'%Y': (4, 0), '%m': (2, 1), '%d': (2, 2), '%H': (2, 3), '%M': (2, 4), '%S': (2, 5)}
+
+    def __init__(self, formato: str) -> None:
+        self.formato = formato
+        self._largo = None
+        self._getCampos = None
+        self._getSeparadores = None
+        self._separadores = None
+        self.recortes = None   #Posiciones de año, mes, día, hora, minuto y segundo (los presentes en el formato)
+        self.separadoresFijos = None   #Tuplas (posición, separador)
+        self._compilar()
+
+    def _compilar(self):
+        campos = {}
+        posicionesSeparadores = []
+        separadores = []
+        posicion = 0
+        for token in re.findall(r"%.|[^%]", self.formato):
+            if token in self._DIRECTIVAS_FIJAS:
+                ancho, orden = self._DIRECTIVAS_FIJAS[token]
+                if orden in campos:
+                    return
+                campos[orden] = slice(posicion, posicion + ancho)
+                posicion += ancho
+            elif token.startswith('%'):
+                #Directiva de ancho variable, no se puede recortar
+                return
+            else:
+                posicionesSeparadores.append(slice(posicion, posicion + 1))
+                separadores.append(token)
+                posicion += 1
+        #Los campos presentes deben ser consecutivos a partir del año (ej: sin hora, o sin segundos)
+        if (sorted(campos) != list(range(len(campos)))) or (len(campos) < 3):
+            return
+        self._largo = posicion
+        self.recortes = tuple(campos[orden] for orden in sorted(campos))
+        self.separadoresFijos = tuple((recorte.start, separador) for recorte, separador in zip(posicionesSeparadores, separadores))
+        self._getCampos = itemgetter(*[campos[orden] for orden in sorted(campos)])
+        #itemgetter con un único argumento no retorna una tupla, por eso se agregan dos recortes vacíos
+        self._getSeparadores = itemgetter(*posicionesSeparadores, slice(0, 0), slice(0, 0))
+        self._separadores = (*separadores, '', '')
+
+    @property
+    def rapido(self) -> bool:
+        """Retorna True si el formato se puede parsear recortando posiciones fijas"""
+        return self._largo is not None
+
+    @property
+    def largo(self):
+        """Largo del texto en los formatos de posiciones fijas, None si el formato no es rápido"""
+        return self._largo
+
+    def parsear(self, texto: str) -> datetime:
+        if (len(texto) == self._largo) and texto.isascii() and (self._getSeparadores(texto) == self._separadores):
+            campos = self._getCampos(texto)
+            if ''.join(campos).isdigit():
+                return datetime(*map(int, campos))
+        return datetime.strptime(texto, self.formato)
+
+
+
+
+class FiltrosConexion():
+    '''
+    Filtros de la conexión de la empresa (campo cem_filtros) ya parseados, con los formatos de fecha y hora 
+    resueltos y el parser de fecha y hora de las lecturas compilado
+    '''
+
+    def __init__(self, dictFiltros: dict) -> None:
+        dictFiltros = dictFiltros or {}
+        self.formatoFecha = dictFiltros.get(FM_FORMATO_FECHA) or DEFAULT_FORMATO_FECHA
+        self.formatoHora = dictFiltros.get(FM_FORMATO_HORA) or DEFAULT_FORMATO_HORA
+        self.parserFechaHora = ParserFechaHora(f"{self.formatoFecha} {self.formatoHora}")
+
+
+@lru_cache(maxsize=None)
+def _getFiltrosConexion(filtros: str) -> FiltrosConexion:
+    dict_filtros = None
+    if (filtros) and (filtros != ""):
+        try:
+            dict_filtros = json.loads(filtros)
+        except:
+            raise Exception(f"El filtro no tiene un formato JSON válido (filtro: {filtros})")
+    return FiltrosConexion(dict_filtros)
+
+
+
+
 class Conexion_Empresa(Base):
     __tablename__ = 'tlm_conexiones_empresas'
     __table_args__ = {'schema': 'regalias'}
@@ -175,6 +283,11 @@ class Conexion_Empresa(Base):
                 raise Exception(f"El filtro no tiene un formato JSON válido (filtro: {filtros})")    
         return dict_filtros
 
+    @property
+    def filtrosConexion(self) -> FiltrosConexion:
+        """Retorna los filtros parseados, se parsean una única vez por cada valor distinto de cem_filtros"""
+        return _getFiltrosConexion(self._filtros)
+
     
     @property   
     def conexionRemota(self):
@@ -183,7 +296,7 @@ class Conexion_Empresa(Base):
         return self.__conexionRemota
 
     def connectServer(self):
-        self.conexionRemota.connect(self.usuario, self._password)
+        self.conexionRemota.conectar(self.usuario, self._password)
         #Si los archivos no se encuentran en el directorio home del usuario,
         #cambiar al directorio indicado
         if (self.directorio_remoto is not None) and (self.directorio_remoto != '/') and (self.directorio_remoto != ''):
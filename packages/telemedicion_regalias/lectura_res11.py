@@ -2,34 +2,82 @@
 import logging
 
 from typing import Optional, Any
+from types import MappingProxyType
+from functools import lru_cache
+from contextlib import contextmanager
+from pathlib import PurePath
+from itertools import chain, repeat
+from collections import Counter
+import hashlib
+import mmap
+import os
+import json
+from jsonschema import validate
 
 from sqlalchemy import Column, DateTime, ForeignKey, Index, text, inspect, func, Integer, Boolean, Sequence, FetchedValue
 from sqlalchemy.dialects.oracle import NUMBER, VARCHAR
 from sqlalchemy.orm import relationship
 
-from .base import Base
+from .base import Base, ReservaSecuencia
+from . import metricas
 from sqlalchemy.ext.hybrid import hybrid_property
 
 from datetime import datetime
 import re
-from csv import DictReader
+import time
+from csv import reader
+
+try:
+    import numpy as np
+except ImportError:
+    #El parser columnar (PL_COLUMNAR) requiere numpy, sin él se utiliza el parser compilado
+    np = None
 
 #from abc import abstractstaticmethod
 #from telemedicion_regalias.medidor_back import TipoFluido
 
 
+#-------------------------------------------------------------------------------
+# Constantes de parsers de lecturas
+#-------------------------------------------------------------------------------
+
+PL_REFLEXIVO = "reflexivo"
+PL_COMPILADO = "compilado"
+PL_COLUMNAR = "columnar"
+PL_AUTOMATICO = "automatico"   #Columnar para los archivos de al menos MINIMO_LINEAS_COLUMNAR líneas, compilado para el resto
+
+MINIMO_LINEAS_COLUMNAR = 1000
+#Ancho máximo de un campo para separarlo de los bytes del archivo con una única operación (ver _columnaBytes)
+ANCHO_MAXIMO_CAMPO_BYTES = 64
+
+#Codificación de los archivos de lecturas (la misma que la de la DB)
+ENCODING_ARCHIVOS = "ISO-8859-15"
+#Los archivos locales a partir de este tamaño se mapean en memoria para el parser columnar (ver _LineasMapeadas)
+TAMANIO_MINIMO_MMAP = 1024 * 1024
+
+#Formato del nombre de los archivos de lecturas: {prefijo}_{instalación}_{ramal}_{ddmmyyyy}_res11_dir_regalias.txt
+RE_NOMBRE_ARCHIVO = re.compile(r"(.+_)([0-9]+)_([0-9]{8})(_res11_dir_regalias.txt)", re.IGNORECASE)
+
+#Canal de diagnóstico de cada línea y campo de los archivos (se puede muestrear, ver FiltroMuestreo en lectura_telemedicion).
+#Los mensajes utilizan formato % para que sólo se armen si el nivel DEBUG está activo
+logLecturas = logging.getLogger('telemedicion_regalias.lecturas')
+
+
 
 
 class ArchivoLecturaRes11(Base):
     __tablename__ = 'tlm_archivos_lectura_res11_cab'
     __table_args__ = (
         Index('un_nom_fec_baj', 'alc_nombre', 'alc_fecha_baja', unique=True),
+        Index('nu_alc_mds_ramal_fecha', 'alc_mds_id', 'alc_ramal', 'alc_fecha_archivo'),
         {'schema': 'regalias'}
     )
 
     id = Column('alc_id', Integer, Sequence('seq_tlm_archivos_cab', schema='regalias'), primary_key=True)
     medidor_id = Column('alc_mds_id', ForeignKey('regalias.tremedfiscal.remedfisid'), comment='ID del medidor que genero el archivo')
     _nombre = Column('alc_nombre', VARCHAR(80), nullable=False, comment='Nombre del archivo')
+    _ramal = Column('alc_ramal', NUMBER(3, 0, False), comment='Ramal del medidor, obtenido del nombre del archivo')
+    fecha_archivo = Column('alc_fecha_archivo', DateTime, comment='Fecha de las lecturas del archivo, obtenida de su nombre')
     tamanio = Column('alc_tamanio', NUMBER(15, 2, True), server_default=text("0"), comment='Tamaño del archivo en bytes')
     fecha_creacion = Column('alc_fecha_creacion', DateTime, comment='Fecha de creación del archivo por el medidor')
     cantidad_registros = Column('alc_cantidad_registros', NUMBER(9, 0, False), server_default=text("0"), comment='Cantidad total de registros que contiene el archivo')
@@ -65,28 +113,23 @@ class ArchivoLecturaRes11(Base):
         if (value == ""):
             raise ValueError("El nombre del archivo no puede ser vacío")
         self._nombre = value
+        #El ramal y la fecha se guardan en sus propias columnas para poder buscar por índice
+        self._ramal, self.fecha_archivo = parsearNombreArchivo(value)
 
    
     @hybrid_property   
     def ramal(self) -> Optional[int]:
-        """Retorna el ramal al que pertenece el archivo obteniéndolo de su nombre, para operaciones a nivel de instancia"""
-        ramal = None
-        if (self._nombre):
-            #La expresión regular parte el nombre en tres grupos, el segundo es el ramal
-            matchRamal = re.match(r"(.+_)([0-9]+)(_[0-9]{8}_res11_dir_regalias.txt)", self.nombre, re.IGNORECASE)
-            if (matchRamal):
-                ramal = matchRamal.group(2)
-        return ramal
+        """Retorna el ramal al que pertenece el archivo, obtenido de su nombre al asignarlo"""
+        return self._ramal
         
     @ramal.expression
     def ramal(cls) -> Optional[int]:  # @NoSelf
-        """Retorna el ramal al que pertenece el archivo obteniéndolo de su nombre, para operaciones a nivel de clase"""
-        return func.regexp_substr(cls.nombre, '(.+_)([0-9]+)(_[0-9]{8}_res11_dir_regalias.txt)', 1, 1, 'i', 2)
+        """Retorna la columna del ramal al que pertenece el archivo, para operaciones a nivel de clase"""
+        return cls._ramal
         
     @property
     def estructuraCampos(self):
-        self.medidor.tipoMedidor.validateCamposLectura()
-        return self.medidor.tipoMedidor.campos_lectura
+        return self.medidor.tipoMedidor.estructuraCampos.campos
 
     def getUltimaLectura(self) -> Optional[datetime]:
         """Retorna la fecha y hora de la mayor lectura para de este archivo, si no hay ninguna devuelve None"""
@@ -99,52 +142,185 @@ class ArchivoLecturaRes11(Base):
         return ultimaLectura
 
 
-    def importarLecturas(self, archivo) -> None:
-        """Carga en la DB las nuevas lecturas desde el archivo indicado"""
+    def importarLecturas(self, archivo, bulk: bool = False, parser: str = PL_REFLEXIVO) -> None:
+        """Carga en la DB las nuevas lecturas desde el archivo indicado
+        El archivo puede ser un path local o cualquier iterable de líneas (str o bytes), por ejemplo 
+        el stream retornado por ConexionRemota.openFile
+        Si bulk es verdadero las lecturas y sus errores no se agregan a la sesión como objetos ORM, sino que se
+        insertan al final del archivo con un único executemany por tabla (ver _insertarLecturasBulk)
+        El parámetro parser indica cómo se parsean las líneas: PL_REFLEXIVO (LecturaMedidorRes11.rellenarCamposFromLineaArchivo),
+        PL_COMPILADO (ParserLecturaRes11, sin reflexión por campo), PL_COLUMNAR (ParserColumnarLecturaRes11, todas las 
+        líneas a la vez con numpy) o PL_AUTOMATICO (columnar si el archivo tiene al menos MINIMO_LINEAS_COLUMNAR líneas).
+        Si numpy no está instalado PL_COLUMNAR y PL_AUTOMATICO utilizan el parser compilado. Con el parser columnar los 
+        archivos locales de al menos TAMANIO_MINIMO_MMAP bytes se mapean en memoria y se parsean sobre los bytes, 
+        decodificando (con ENCODING_ARCHIVOS) sólo los campos de texto
+        Al finalizar se guardan en tamanio y hash la cantidad de bytes leídos y su hash MD5 (hasta la última línea completa).
+        Si el archivo ya fue importado y sus primeros tamanio bytes tienen el mismo hash, el archivo sólo creció y se 
+        retoma el parseo a partir de esa posición (si no creció no se parsea nada)
+        Retorna la fecha y hora de la última lectura cargada del archivo (None si el archivo no tiene lecturas)
+        """
         session = inspect(self).session   
         fechaHoraUltimaLectura = self.getUltimaLectura()
+        lecturasBulk = []
+        parserColumnar = None
+        if (parser in (PL_COMPILADO, PL_COLUMNAR, PL_AUTOMATICO)):
+            parserCompilado = getParserLecturas(self.medidor.tipoMedidor.estructuraCampos)
+            if (parser != PL_COMPILADO):
+                parserColumnar = getParserColumnar(self.medidor.tipoMedidor.estructuraCampos)
+                if (parserColumnar is None) and (parser == PL_COLUMNAR):
+                    logging.warning("El parser columnar requiere numpy, se utiliza el parser compilado")
+        elif (parser == PL_REFLEXIVO):
+            parserCompilado = None
+        else:
+            raise ValueError(f"Parser de lecturas inválido (parser={parser})")
+        parserFechaHora = self.medidor.parserFechaHora
+        nombresCampos = self.medidor.tipoMedidor.estructuraCampos.nombresCampos
+        cantCampos = len(nombresCampos)
+        indiceFecha = nombresCampos.index('fecha')
+        indiceHora = nombresCampos.index('hora')
+        cantCamposFechaHora = max(indiceFecha, indiceHora) + 1
+        #Las mediciones se deciden una única vez por archivo para no agregar costo por línea si están desactivadas
+        registroMetricas = metricas.registro
+        inicioArchivo = time.perf_counter()
+        segundosValidacion = 0.0
+        cantLineas = 0
+        cantRegistros = self.cantidad_registros
+        cantRegistrosErr = self.cantidad_registros_err
+        #Cantidad de valores con error de cada campo, para el resumen del archivo
+        erroresCampos = Counter()
+        #El diagnóstico por línea se decide una única vez por archivo
+        debugLineas = logLecturas.isEnabledFor(logging.DEBUG)
 #       with open(localFilename, mode='r', encoding='iso-8859-1') as f:
-        with archivo.open(mode='r', errors='replace') as csvFile:
-            #Saltear la cabecera
-            next(csvFile)
-            #Inicializar el parser
-            lecturasReader = DictReader(csvFile, fieldnames=list(self.estructuraCampos.keys()), 
-                                        restval='', delimiter=';')
+        with _abrirLineas(archivo, mapear=parserColumnar is not None) as lineasArchivo:
+            nroLinea = 1
+            #Si el archivo ya fue importado, verificar si su contenido anterior no cambió
+            prefijo = _leerPrefijo(lineasArchivo, self.tamanio) if (self.hash) and (self.tamanio) else []
+            if (prefijo) and (lineasArchivo.posicion == self.tamanio) and (lineasArchivo.hash == self.hash):
+                #Retomar a continuación de lo ya importado, sin volver a parsear ni la cabecera ni las líneas anteriores
+                nroLinea += sum(1 for linea in prefijo[1:] if linea.rstrip(b'\r\n'))
+                logging.debug(f"Retomando el archivo a partir del byte {int(self.tamanio)} (línea {nroLinea})")
+                inicio = lineasArchivo.posicion
+                csvFile = lineasArchivo.texto()
+            else:
+                inicio = lineasArchivo.finPrimeraLinea() if lineasArchivo.mapeado else None
+                csvFile = lineasArchivo.texto(prefijo)
+                #Saltear la cabecera
+                next(csvFile, None)
+            if (parserColumnar is not None) and (lineasArchivo.mapeado):
+                #Archivo mapeado en memoria: el parser columnar separa las líneas y los campos sobre los bytes, sin 
+                #decodificar el archivo. Se estima la cantidad de líneas por los saltos de línea
+                datos = lineasArchivo.datos(inicio)
+                if (parser == PL_AUTOMATICO) and (np.count_nonzero(datos == 10) < MINIMO_LINEAS_COLUMNAR):
+                    csvFile = lineasArchivo.texto(datos.tobytes().split(b'\n'))
+                    parserColumnar = None
+                else:
+                    csvFile = datos
+                del datos
+            elif (parserColumnar is not None):
+                #El parser columnar necesita todas las líneas, las líneas vacías se ignoran sin contarlas
+                csvFile = [lineaArchivo for lineaArchivo in (lineaArchivo.rstrip('\r\n') for lineaArchivo in csvFile) if lineaArchivo]
+                if (parser == PL_AUTOMATICO) and (len(csvFile) < MINIMO_LINEAS_COLUMNAR):
+                    parserColumnar = None
+            if (parserColumnar is not None):
+                if registroMetricas is not None:
+                    inicioValidacion = time.perf_counter()
+                lecturas = parserColumnar.parsearLineas(csvFile, nroLinea, fechaHoraUltimaLectura, parserFechaHora, 
+                                                        lineasArchivo.encoding)
+                if bulk:
+                    #Los valores se arman por columnas, listos para la inserción
+                    lecturasBulk.extend(lecturas.valoresInsert())
+                    self.cantidad_registros += len(lecturas)
+                    self.cantidad_registros_err += lecturas.cantidadErrores
+                    self.cantidad_registros_ok += len(lecturas) - lecturas.cantidadErrores
+                if registroMetricas is not None:
+                    segundosValidacion += time.perf_counter() - inicioValidacion
+                erroresCampos.update(lecturas.cantidadErroresCampos())
+                if not bulk:
+                    for nroLineaLectura, valores, errores in lecturas.lecturas():
+                        self._agregarValoresLectura(session, nroLineaLectura, valores, errores, None)
+                if len(lecturas):
+                    fechaHoraUltimaLectura = lecturas.valores['fecha_hora'][-1]
+                nroLinea += lecturas.cantidadLineas
+                cantLineas += lecturas.cantidadLineas
+                #Todas las líneas ya se procesaron, no queda nada para el parseo línea por línea
+                csvFile = ()
             #La variable siguenMayores indica que a partir de que se encontró un valor posterior, todo lo que sigue debería ser posterior
             siguenMayores = False
-            nroLinea = 1
             #Procesar el archivo línea x línea
-            for lineaLectura in lecturasReader:
+            for lineaArchivo in csvFile:
+                lineaArchivo = lineaArchivo.rstrip('\r\n')
+                #Las líneas vacías se ignoran sin contarlas (igual que csv.DictReader)
+                if not lineaArchivo:
+                    continue
                 try:
-                    fechaHoraLineaLectura = datetime.strptime(f"{lineaLectura['fecha']} {lineaLectura['hora']}", 
-                                                              f"{self.medidor.formatoFecha} {self.medidor.formatoHora}")
+                    #Sólo se separan los campos necesarios para obtener la fecha y hora, el resto de la línea 
+                    #se parsea únicamente si la lectura es posterior a la última lectura cargada
+                    if ('"' in lineaArchivo):
+                        campos = next(reader((lineaArchivo,), delimiter=';'))
+                    else:
+                        campos = lineaArchivo.split(';', cantCamposFechaHora)
+                    if (len(campos) < cantCamposFechaHora):
+                        campos.extend([''] * (cantCamposFechaHora - len(campos)))
+                    fechaHoraLineaLectura = parserFechaHora.parsear(f"{campos[indiceFecha]} {campos[indiceHora]}")
                     #Si no existe ultimaLectura (None) para este archivo significa que es la primera y debe ser insertada.
                     #O si la fecha y hora de la línea que se esta procesando es posterior a la de la última lectura, 
                     #también debe ser insertada  
                     if (not fechaHoraUltimaLectura) or (fechaHoraLineaLectura > fechaHoraUltimaLectura):
                         #A parir de ahora todas las lecturas deberían ser posteriores a la última lectura
                         siguenMayores = True
-                        logging.debug(f"Parseando lectura {lineaLectura}...")
-                        #Instanciar la clase LecturaMedidor según el tipo de medidor y fluido
-#                         nuevaLecturaRes11 = LecturaFactory.getLectura(self.medidor.tipoMedidor.descripcion, 
-#                                                                       self.medidor.tipoFluido.descripcion)
-                        nuevaLecturaRes11 = LecturaMedidorRes11(self, nroLinea)
-                        nuevaLecturaRes11.rellenarCamposFromLineaArchivo(lineaLectura)
-                        #Actualizar la cantidad de registros del archivo
-                        if nuevaLecturaRes11.tiene_errores:
-                            self.cantidad_registros_err += 1
+                        if ('"' in lineaArchivo):
+                            lineaLectura = next(reader((lineaArchivo,), delimiter=';'))
+                        else:
+                            lineaLectura = lineaArchivo.split(';')
+                        #Completar los campos faltantes con '' (igual que csv.DictReader)
+                        if (len(lineaLectura) < cantCampos):
+                            lineaLectura.extend([''] * (cantCampos - len(lineaLectura)))
+                        if not parserCompilado:
+                            lineaLectura = dict(zip(nombresCampos, lineaLectura))
+                        if debugLineas:
+                            logLecturas.debug("Parseando lectura %s...", lineaLectura)
+                        if registroMetricas is not None:
+                            inicioValidacion = time.perf_counter()
+                        if parserCompilado:
+                            valores, errores = parserCompilado.parsear(lineaLectura, fechaHoraLineaLectura)
+                            if errores:
+                                erroresCampos.update(errores.keys())
                         else:
-                            self.cantidad_registros_ok += 1
-                        self.cantidad_registros += 1
-                        #Insertar en la DB        
-                        logging.debug(f"Insertando lectura en la DB...")
-                        session.add(nuevaLecturaRes11)
-                        #FIXME: la inserción del error no debe eir aqui, esto debe ir dentro de la clase lectura
-                        if nuevaLecturaRes11._error:
-                            session.add(nuevaLecturaRes11._error)
+                            #Instanciar la clase LecturaMedidor según el tipo de medidor y fluido
+#                             nuevaLecturaRes11 = LecturaFactory.getLectura(self.medidor.tipoMedidor.descripcion, 
+#                                                                           self.medidor.tipoFluido.descripcion)
+                            nuevaLecturaRes11 = LecturaMedidorRes11(self, nroLinea, vincularArchivo=not bulk)
+                            nuevaLecturaRes11.rellenarCamposFromLineaArchivo(lineaLectura, fechaHoraLineaLectura)
+                            tieneErrores = nuevaLecturaRes11.tiene_errores
+                            if tieneErrores:
+                                erroresCampos.update(nuevaLecturaRes11.camposConError)
+                        if registroMetricas is not None:
+                            segundosValidacion += time.perf_counter() - inicioValidacion
+                        if parserCompilado:
+                            self._agregarValoresLectura(session, nroLinea, valores, errores, lecturasBulk if bulk else None)
+                        else:
+                            #Actualizar la cantidad de registros del archivo
+                            if tieneErrores:
+                                self.cantidad_registros_err += 1
+                            else:
+                                self.cantidad_registros_ok += 1
+                            self.cantidad_registros += 1
+                            if bulk:
+                                #Guardar sólo los valores, la inserción se hace al final del archivo
+                                errorLectura = nuevaLecturaRes11._error
+                                valoresLectura = _valoresInsertObjeto(LecturaMedidorRes11, nuevaLecturaRes11)
+                                valoresLectura['ald_nro_linea'] = nroLinea
+                                lecturasBulk.append((valoresLectura, 
+                                                     _valoresInsertObjeto(ErrorLecturaRes11, errorLectura) if errorLectura else None))
+                            else:
+                                #Insertar en la DB        
+                                session.add(nuevaLecturaRes11)
+                                #FIXME: la inserción del error no debe eir aqui, esto debe ir dentro de la clase lectura
+                                if nuevaLecturaRes11._error:
+                                    session.add(nuevaLecturaRes11._error)
                         #FIXME: sacar este commit
                         #session.commit()
-                        fechaHoraUltimaLectura = nuevaLecturaRes11.fecha_hora
+                        fechaHoraUltimaLectura = fechaHoraLineaLectura
                     else:
                         #TODO: Que se debe hacer en este caso
                         #El manejo de este error hay que hacerlo dentro de nuevaLecturaRes11.error
@@ -156,9 +332,256 @@ class ArchivoLecturaRes11(Base):
                     #TODO: Grabar la línea en la tabla de errores
                 finally:
                     nroLinea += 1
-                    
-                    
-                    
+                    cantLineas += 1
+            self.tamanio = lineasArchivo.posicion
+            self.hash = lineasArchivo.hash
+        #Una línea de resumen por archivo, el detalle de cada campo con error está en el canal de diagnóstico
+        logging.info("Archivo %s: %d líneas leídas, %d lecturas nuevas (%d con errores)", 
+                     self.nombre, cantLineas, self.cantidad_registros - cantRegistros, self.cantidad_registros_err - cantRegistrosErr)
+        if erroresCampos:
+            logging.warning("Archivo %s: %d lecturas con valores erróneos, cantidad de valores erróneos por campo: %s", 
+                            self.nombre, self.cantidad_registros_err - cantRegistrosErr, 
+                            ', '.join(f"{campo}={cantidad}" for campo, cantidad in erroresCampos.most_common()))
+        if registroMetricas is not None:
+            #El parseo incluye la lectura del archivo (en streaming, también su descarga)
+            registroMetricas.registrar('parseo', time.perf_counter() - inicioArchivo - segundosValidacion, cantLineas)
+            registroMetricas.registrar('validacion', segundosValidacion, self.cantidad_registros - cantRegistros)
+        if bulk:
+            #Cantidad de lecturas insertadas, el flush de la sesión se mide por archivo en MedidorFiscal
+            with metricas.medir('insercion', len(lecturasBulk)):
+                self._insertarLecturasBulk(lecturasBulk)
+        return fechaHoraUltimaLectura
+
+
+    def _agregarValoresLectura(self, session, nroLinea: int, valores: dict, errores: Optional[dict], lecturasBulk: Optional[list]) -> None:
+        """Agrega la lectura obtenida por los parsers compilado o columnar (valores y errores por atributo) y actualiza 
+        la cantidad de registros del archivo. Si lecturasBulk no es None sólo se guardan los valores para insertarlos
+        al final del archivo, sino la lectura (y su error) se agrega a la sesión
+        """
+        if lecturasBulk is not None:
+            valoresLectura = _valoresInsert(LecturaMedidorRes11, valores)
+            valoresLectura['ald_nro_linea'] = nroLinea
+            lecturasBulk.append((valoresLectura, _valoresInsert(ErrorLecturaRes11, errores) if errores else None))
+        else:
+            nuevaLecturaRes11 = LecturaMedidorRes11.desdeValores(self, nroLinea, valores, errores)
+            session.add(nuevaLecturaRes11)
+            if nuevaLecturaRes11._error:
+                session.add(nuevaLecturaRes11._error)
+        #La cantidad de registros se actualiza una vez agregada la lectura
+        if valores['tiene_errores']:
+            self.cantidad_registros_err += 1
+        else:
+            self.cantidad_registros_ok += 1
+        self.cantidad_registros += 1
+
+
+    def _insertarLecturasBulk(self, lecturas) -> None:
+        """Inserta las lecturas (y sus errores) con un único executemany por tabla.
+        Los ids se asignan en memoria a partir de bloques reservados de las secuencias (compartidos por los archivos de
+        la sesión), para poder relacionar los errores con sus lecturas sin consultar la DB fila por fila
+        """
+        if not lecturas:
+            return
+        session = inspect(self).session
+        #El archivo debe tener su id antes de insertar las lecturas
+        session.flush()
+        tablaLecturas = LecturaMedidorRes11.__table__
+        tablaErrores = ErrorLecturaRes11.__table__
+        idsLecturas = ReservaSecuencia.deSesion(session, tablaLecturas.c.ald_id).reservar(len(lecturas))
+        errores = []
+        for (valoresLectura, valoresError), idLectura in zip(lecturas, idsLecturas):
+            valoresLectura['ald_id'] = idLectura
+            valoresLectura['ald_alc_id'] = self.id
+            if valoresError:
+                valoresError['ale_ald_id'] = idLectura
+                errores.append(valoresError)
+        logging.debug(f"Insertando {len(lecturas)} lecturas en la DB...")
+        session.execute(tablaLecturas.insert(), [valoresLectura for valoresLectura, _ in lecturas])
+        if errores:
+            idsErrores = ReservaSecuencia.deSesion(session, tablaErrores.c.ale_id).reservar(len(errores))
+            for valoresError, idError in zip(errores, idsErrores):
+                valoresError['ale_id'] = idError
+            logging.debug(f"Insertando {len(errores)} errores de lecturas en la DB...")
+            session.execute(tablaErrores.insert(), errores)
+
+
+
+#-------------------------------------------------------------------------------
+# Funciones auxiliares para la lectura de los archivos
+#-------------------------------------------------------------------------------
+
+def parsearNombreArchivo(nombre: str):
+    """Retorna el ramal y la fecha de las lecturas a partir del nombre del archivo, (None, None) si no tiene el formato esperado"""
+    matchNombre = RE_NOMBRE_ARCHIVO.match(nombre)
+    if (not matchNombre):
+        return None, None
+    try:
+        fecha = datetime.strptime(matchNombre.group(3), '%d%m%Y')
+    except ValueError:
+        fecha = None
+    return int(matchNombre.group(2)), fecha
+
+
+class _LineasArchivo():
+    """Iterador de las líneas (bytes) de un archivo que lleva la posición y el hash MD5 de lo leído hasta la última 
+    línea completa. Una última línea sin salto de línea (ej: el archivo se está escribiendo) no se retorna ni se 
+    parsea, se lee completa cuando se retome el archivo
+    """
+    mapeado = False
+
+    def __init__(self, lineas, encoding: str) -> None:
+        self._lineas = iter(lineas)
+        self._encoding = encoding
+        self._md5 = hashlib.md5()
+        self.posicion = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        linea = next(self._lineas)
+        if isinstance(linea, str):
+            linea = linea.encode(self._encoding, errors='replace')
+        if not linea.endswith(b'\n'):
+            #Sólo la última línea puede no tener salto de línea
+            raise StopIteration
+        self._md5.update(linea)
+        self.posicion += len(linea)
+        return linea
+
+    @property
+    def hash(self) -> str:
+        return self._md5.hexdigest()
+
+    @property
+    def encoding(self) -> str:
+        return self._encoding
+
+    def texto(self, lineasLeidas=()):
+        """Retorna un iterador de las líneas decodificadas, comenzando por las lineasLeidas (bytes) que ya se consumieron"""
+        encoding = self._encoding
+        return (linea.decode(encoding, errors='replace') for linea in chain(lineasLeidas, self))
+
+
+class _LineasMapeadas(_LineasArchivo):
+    """Líneas de un archivo local mapeado en memoria (mmap). Además de iterarse por líneas como _LineasArchivo, 
+    el parser columnar puede tomar todos los bytes restantes sin copiarlos (ver datos), separar las líneas y los 
+    campos sobre los bytes y decodificar sólo los campos de texto
+    """
+    mapeado = True
+
+    def __init__(self, mapa, encoding: str) -> None:
+        super().__init__((), encoding)
+        self._mapa = mapa
+        self._siguiente = 0   #Posición de la próxima línea a retornar
+        self._fin = mapa.rfind(b'\n') + 1   #Fin de la última línea completa, lo que sigue no se retorna
+
+    def __next__(self) -> bytes:
+        inicio = self._siguiente
+        if (inicio >= self._fin):
+            raise StopIteration
+        fin = self._mapa.find(b'\n', inicio) + 1
+        self._siguiente = fin
+        linea = self._mapa[inicio:fin]
+        self._md5.update(linea)
+        self.posicion = fin
+        return linea
+
+    def finPrimeraLinea(self) -> int:
+        """Retorna la posición siguiente a la primera línea (la cabecera)"""
+        return self._mapa.find(b'\n') + 1 or len(self._mapa)
+
+    def datos(self, inicio: int):
+        """Retorna los bytes de las líneas completas a partir de inicio como un arreglo numpy de uint8, sin copiarlos. 
+        El resto del archivo se da por leído (posición y hash hasta la última línea completa)
+        """
+        if (self._fin > self.posicion):
+            with memoryview(self._mapa) as vista:
+                self._md5.update(vista[self.posicion:self._fin])
+            self.posicion = self._fin
+        self._siguiente = self._fin
+        inicio = min(inicio, self._fin)
+        return np.frombuffer(self._mapa, dtype=np.uint8, offset=inicio, count=self._fin - inicio)
+
+
+@contextmanager
+def _abrirLineas(archivo, mapear: bool = False):
+    """Retorna un _LineasArchivo con las líneas del archivo. 
+    El archivo puede ser un path o un iterable de líneas bytes (ej: un stream remoto) o str, las líneas se 
+    decodifican con ENCODING_ARCHIVOS. 
+    Si mapear es verdadero y el archivo es local y tiene al menos TAMANIO_MINIMO_MMAP bytes se mapea en memoria 
+    (ver _LineasMapeadas)
+    """
+    encoding = ENCODING_ARCHIVOS
+    if isinstance(archivo, (str, PurePath)):
+        with open(archivo, mode='rb') as f:
+            if (mapear) and (os.fstat(f.fileno()).st_size >= TAMANIO_MINIMO_MMAP):
+                mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    yield _LineasMapeadas(mapa, encoding)
+                finally:
+                    try:
+                        mapa.close()
+                    except BufferError:
+                        #Todavía existe algún arreglo sobre los bytes del mapa, se libera al liberarse el arreglo
+                        pass
+            else:
+                yield _LineasArchivo(f, encoding)
+    else:
+        yield _LineasArchivo(archivo, encoding)
+
+
+def _leerPrefijo(lineas: _LineasArchivo, tamanio) -> list:
+    """Lee líneas hasta alcanzar tamanio bytes (o el final del archivo) y las retorna"""
+    leidas = []
+    for linea in lineas:
+        leidas.append(linea)
+        if lineas.posicion >= tamanio:
+            break
+    return leidas
+
+
+
+#-------------------------------------------------------------------------------
+# Funciones auxiliares para la inserción masiva (bulk)
+#-------------------------------------------------------------------------------
+
+_cacheColumnasInsert = {}
+
+def _columnasInsert(claseMapeada):
+    """Retorna las tuplas (atributo, columna, valor por defecto) de la clase mapeada que se deben informar
+    en un insert, excluyendo las columnas que completa la DB (triggers de auditoría)
+    """
+    columnas = _cacheColumnasInsert.get(claseMapeada)
+    if columnas is None:
+        columnas = []
+        for atributo in inspect(claseMapeada).column_attrs:
+            columna = atributo.columns[0]
+            if columna.server_default is not None:
+                continue
+            valorDefault = columna.default.arg if getattr(columna.default, "is_scalar", False) else None
+            columnas.append((atributo.key, columna.key, valorDefault))
+        _cacheColumnasInsert[claseMapeada] = columnas
+    return columnas
+
+
+def _valoresInsert(claseMapeada, valoresAtributos: dict) -> dict:
+    """Retorna un diccionario {columna: valor} a partir de los valores {atributo: valor}, listo para un executemany"""
+    valores = {}
+    for atributo, columna, valorDefault in _columnasInsert(claseMapeada):
+        valor = valoresAtributos.get(atributo)
+        valores[columna] = valorDefault if valor is None else valor
+    return valores
+
+
+def _valoresInsertObjeto(claseMapeada, objeto) -> dict:
+    """Igual que _valoresInsert, tomando los valores de los atributos mapeados del objeto"""
+    valores = {}
+    for atributo, columna, valorDefault in _columnasInsert(claseMapeada):
+        valor = getattr(objeto, atributo)
+        valores[columna] = valorDefault if valor is None else valor
+    return valores
+
 
 #-------------------------------------------------------------------------------
 # Excepciones definidas para las lecturas
@@ -173,6 +596,7 @@ class CampoLecturaRes11Exception(Exception):
     """
     
     def __init__(self, campo: str, mensaje: str) -> None:
+        super().__init__(mensaje)
         self.campo = campo
         self.message = mensaje
 
@@ -233,6 +657,35 @@ SCHEMA_LECTURA_MEDIDOR_RES11 = {
 }
 
 
+class EstructuraCamposLecturaRes11():
+    """Estructura de los campos de lectura de un tipo de medidor, ya validada contra SCHEMA_LECTURA_MEDIDOR_RES11.
+    Es inmutable, por lo que se comparte entre todos los archivos y lecturas de los medidores del mismo tipo.
+    """
+
+    def __init__(self, textoCampos: str) -> None:
+        campos = json.loads(textoCampos)
+        validate(instance = campos, schema = SCHEMA_LECTURA_MEDIDOR_RES11)
+        self._campos = MappingProxyType(campos)
+        self._nombresCampos = tuple(campos.keys())
+
+    @property
+    def campos(self):
+        """Diccionario (de sólo lectura) {campo: obligatoriedad} en el orden de las columnas del archivo"""
+        return self._campos
+
+    @property
+    def nombresCampos(self):
+        return self._nombresCampos
+
+
+@lru_cache(maxsize=None)
+def getEstructuraCampos(textoCampos: str) -> EstructuraCamposLecturaRes11:
+    """Retorna la estructura de campos compilada para el JSON indicado. 
+    Al estar indexada por el texto del JSON, si el tipo de medidor modifica sus campos se compila una nueva estructura
+    """
+    return EstructuraCamposLecturaRes11(textoCampos)
+
+
 
 class LecturaMedidorRes11(Base):
     """Clase base para las lectura de todos los medidores"""
@@ -288,13 +741,31 @@ class LecturaMedidorRes11(Base):
     archivo = relationship('ArchivoLecturaRes11', back_populates='Lecturas')
     error = relationship('ErrorLecturaRes11', enable_typechecks=False, uselist=False, back_populates='lectura')
 
-    def __init__(self, archivo, nroLinea: int, **kwargs) -> None:
+    def __init__(self, archivo, nroLinea: int, vincularArchivo: bool = True, **kwargs) -> None:
+        """Si vincularArchivo es falso la lectura no se relaciona con el archivo (y por lo tanto no se agrega 
+        a su sesión), se utiliza en la importación bulk donde sólo interesan los valores parseados
+        """
         super().__init__(**kwargs)
-        self.archivo = archivo
+        self._archivo = archivo
+        if vincularArchivo:
+            self.archivo = archivo
         self.nro_linea = nroLinea
-        self._setEstructuraCampos(self.archivo.estructuraCampos)
+        self._setEstructuraCampos(self._archivo.estructuraCampos)
         self._error = None
+        self.camposConError = ()   #Campos con valores erróneos (incluidos los que no tienen columna en la tabla de errores)
         self.onError = None
+
+    @classmethod
+    def desdeValores(cls, archivo, nroLinea: int, valores: dict, errores: Optional[dict]) -> 'LecturaMedidorRes11':
+        """Crea la lectura (y su error si corresponde) a partir de los valores obtenidos por ParserLecturaRes11"""
+        lectura = cls(archivo, nroLinea, **valores)
+        if errores:
+            lectura._error = ErrorLecturaRes11(lectura)
+            for campo, valorEnArchivo in errores.items():
+                #Los campos sin columna en la tabla de errores (ej: instalacion, medidor) no se guardan
+                if hasattr(ErrorLecturaRes11, campo):
+                    setattr(lectura._error, campo, valorEnArchivo)
+        return lectura
         
 
     def _setEstructuraCampos(self, estructuraCampos) -> None:
@@ -304,12 +775,15 @@ class LecturaMedidorRes11(Base):
         self._estructuraCampos = estructuraCampos
         
                 
-    def rellenarCamposFromLineaArchivo(self, dicLinea) -> None:
+    def rellenarCamposFromLineaArchivo(self, dicLinea, fechaHora: Optional[datetime] = None) -> None:
+        """Asigna los campos de la lectura a partir de la línea del archivo. 
+        Si se indica fechaHora (ya parseada al leer la línea) no se vuelve a parsear
+        """
         for campo, obligatoriedad in self._estructuraCampos.items():
             if (campo == 'fecha'):
-                fecha_hora = datetime.strptime(f"{dicLinea['fecha']} {dicLinea['hora']}", 
-                                               f"{self.archivo.medidor.formatoFecha} {self.archivo.medidor.formatoHora}")
-                self._setValorCampo('fecha_hora', fecha_hora, obligatoriedad)
+                if fechaHora is None:
+                    fechaHora = self._archivo.medidor.parserFechaHora.parsear(f"{dicLinea['fecha']} {dicLinea['hora']}")
+                self._setValorCampo('fecha_hora', fechaHora, obligatoriedad)
             elif (campo == 'hora'):
                 #El campo hora se ignora ya que fue procesado junto con el campo fecha
                 continue
@@ -317,7 +791,8 @@ class LecturaMedidorRes11(Base):
                 self._setValorCampo(campo, dicLinea[campo], obligatoriedad)
                 
                     
-    def _str2Float(self, strNum: str) -> Optional[float]:
+    @staticmethod
+    def _str2Float(strNum: str) -> Optional[float]:
         """Convierte un string a float, haciendo trim y reemplazando ',' por '.'. 
         Si el string es None retorna None
         """
@@ -327,7 +802,8 @@ class LecturaMedidorRes11(Base):
             return None    
 
     
-    def _str2Integer(self, strNum: str) -> Optional[int]:
+    @staticmethod
+    def _str2Integer(strNum: str) -> Optional[int]:
         """Convierte un string a integer, haciendo trim y eliminando los decimales. 
         Si el string es None retorna None
         """
@@ -337,7 +813,8 @@ class LecturaMedidorRes11(Base):
             return None    
         
         
-    def _getColumnDataType(self, nombreCampo: str) -> Any:
+    @classmethod
+    def _getColumnDataType(cls, nombreCampo: str) -> Any:
         """Devuelve el tipo de dato del campo especificado. 
         Parámetros:
             nombreCampo: puede ser el nombre del campo de la tabla o su alias definido en el mapper
@@ -347,10 +824,10 @@ class LecturaMedidorRes11(Base):
         tipoColumna = None
         #Buscar primero el campo en las columnas de la tabla, sino en los alias del mapper,
         #sino generar una excepción
-        if (nombreCampo in self.__table__.columns):
-            tipoColumna = self.__table__.columns[nombreCampo].type
-        elif (nombreCampo in self.__mapper__._props):
-            tipoColumna = self.__mapper__._props[nombreCampo].columns[0].type
+        if (nombreCampo in cls.__table__.columns):
+            tipoColumna = cls.__table__.columns[nombreCampo].type
+        elif (nombreCampo in cls.__mapper__._props):
+            tipoColumna = cls.__mapper__._props[nombreCampo].columns[0].type
         else:
             raise Exception(f"Nombre de campo no válido (nombreCampo: {nombreCampo})")
         return tipoColumna
@@ -392,13 +869,13 @@ class LecturaMedidorRes11(Base):
         
         Generará una excepción AttributeError si el nombre del campo es erróneo (no existe en la tabla)
         """ 
-        logging.debug(f"{nombreCampo}: {valorEnArchivo}")
+        logLecturas.debug("%s: %s", nombreCampo, valorEnArchivo)
         try:
             #Verificar que exista el campo
             if hasattr(self, nombreCampo):
                 #Verificar que si el campo es obligatorio tenga un valor 
                 if ((valorEnArchivo == '') and obligatorio):
-                    raise CampoRequeridoException(f"El campo {nombreCampo} no tiene valor y es obligatorio")
+                    raise CampoRequeridoException(nombreCampo, f"El campo {nombreCampo} no tiene valor y es obligatorio")
                 #Convertir el valor al formato de la DB
                 valor = self._convert2DBType(nombreCampo, valorEnArchivo)
                 #Si hay un validador definido para el campo, ejecutarlo
@@ -414,13 +891,15 @@ class LecturaMedidorRes11(Base):
             #Si el error es que no existe el campo, pasarlo para arriba porque es un error de programación
             raise
         except Exception as e:
-            logging.error(e)
+            #El valor erróneo queda en la tabla de errores y el archivo informa la cantidad en su resumen
+            logLecturas.debug("%s", e)
             #Si tiene un error handler asignado, ejecutarlo 
             if self.onError:
                 #TODO: definir la interfaz del error handler de las lecturas
                 self.onError(e)
             #Marcar la lectura como que contiene errores
             self.tiene_errores = True
+            self.camposConError += (nombreCampo,)
             #Si no existe la instancia de error crearla
             if not self._error:
                 self._error = ErrorLecturaRes11(self)
@@ -431,6 +910,435 @@ class LecturaMedidorRes11(Base):
         
 
 
+class ParserLecturaRes11():
+    """Parser compilado de las líneas de un archivo de lecturas, para una estructura de campos y clase de lectura.
+    
+    Toda la reflexión que hace LecturaMedidorRes11._setValorCampo por cada campo de cada línea (existencia del 
+    atributo, tipo de columna, conversor y validador) se resuelve una única vez al compilar, en una lista de 
+    tuplas (índice de columna, atributo, conversor, validador, requerido). 
+    El resultado de parsear una línea es el mismo que el de rellenarCamposFromLineaArchivo.
+    """
+
+    def __init__(self, estructuraCampos: EstructuraCamposLecturaRes11, claseLectura) -> None:
+        self._campos = []
+        for indice, (campo, obligatorio) in enumerate(estructuraCampos.campos.items()):
+            if (campo in ('fecha', 'hora')):
+                #La fecha y hora se parsea al leer la línea
+                continue
+            if not hasattr(claseLectura, campo):
+                raise AttributeError(f"Nombre de campo inválido (campo={campo})")
+            tipoColumna = claseLectura._getColumnDataType(campo)
+            if isinstance(tipoColumna, NUMBER):
+                conversor = claseLectura._str2Integer if (tipoColumna.scale == 0) else claseLectura._str2Float
+            else:
+                conversor = None
+            validador = getattr(claseLectura, f"_validar_{campo}", None)
+            self._campos.append((indice, campo, conversor, validador, obligatorio))
+
+    def parsear(self, linea: list, fechaHora: datetime):
+        """Retorna una tupla (valores, errores) con los diccionarios {atributo: valor} de la lectura y 
+        de su error. Si la línea no tiene errores el diccionario de errores es None
+        La línea debe tener todos los campos de la estructura y la fecha y hora ya parseada
+        """
+        valores = {'fecha_hora': fechaHora, 'tiene_errores': False}
+        errores = None
+        for indice, campo, conversor, validador, obligatorio in self._campos:
+            valorEnArchivo = linea[indice]
+            try:
+                if ((valorEnArchivo == '') and obligatorio):
+                    raise CampoRequeridoException(campo, f"El campo {campo} no tiene valor y es obligatorio")
+                valor = conversor(valorEnArchivo) if conversor else valorEnArchivo
+                if validador:
+                    validador(valor)
+                valores[campo] = valor
+            except Exception as e:
+                logLecturas.debug("%s", e)
+                if errores is None:
+                    errores = {}
+                errores[campo] = valorEnArchivo
+        if errores is not None:
+            valores['tiene_errores'] = True
+        return valores, errores
+
+
+@lru_cache(maxsize=None)
+def getParserLecturas(estructuraCampos: EstructuraCamposLecturaRes11, claseLectura = None) -> ParserLecturaRes11:
+    """Retorna el parser compilado para la estructura de campos, se compila una única vez por estructura"""
+    return ParserLecturaRes11(estructuraCampos, claseLectura or LecturaMedidorRes11)
+
+
+
+
+class ParserColumnarLecturaRes11(ParserLecturaRes11):
+    """Parser de todas las líneas de un archivo a la vez, por columnas, con numpy.
+    
+    Las líneas se separan en columnas y cada columna numérica se convierte con una única operación sobre el arreglo 
+    (comas decimales, blancos a None), la fecha y hora se arma a partir de los dígitos de todas las líneas a la vez
+    (si el formato es de posiciones fijas, ver ParserFechaHora.rapido) y las lecturas posteriores a la última se 
+    seleccionan con una máscara. Los valores que numpy no puede convertir (ej: texto en un campo numérico) se 
+    vuelven a convertir uno por uno con los conversores de ParserLecturaRes11, por lo que el resultado es el mismo.
+    
+    Las líneas pueden ser textos o los bytes del archivo (ver _LineasMapeadas.datos), en cuyo caso las líneas y los 
+    campos se separan sobre los bytes, los campos numéricos se convierten sin pasar por str y sólo se decodifican 
+    los campos de texto y los valores con error.
+    
+    Además de los validadores por valor (_validar_<campo>), la clase de lectura puede definir validadores por columna:
+        _validarColumna_<campo>(valores: np.ndarray) -> np.ndarray
+    que reciben los valores convertidos de todas las lecturas (NaN para los vacíos) y retornan la máscara de los 
+    valores erróneos. Si el campo tiene un validador por columna no se ejecuta el validador por valor
+    """
+
+    def __init__(self, estructuraCampos: EstructuraCamposLecturaRes11, claseLectura) -> None:
+        super().__init__(estructuraCampos, claseLectura)
+        self._conversorEntero = claseLectura._str2Integer
+        nombresCampos = estructuraCampos.nombresCampos
+        self._cantCampos = len(nombresCampos)
+        self._indiceFecha = nombresCampos.index('fecha')
+        self._indiceHora = nombresCampos.index('hora')
+        self._validadoresColumna = {campo: getattr(claseLectura, f"_validarColumna_{campo}", None) 
+                                    for _, campo, _, _, _ in self._campos}
+
+    def parsearLineas(self, lineas, nroLineaInicial: int, fechaHoraUltimaLectura: Optional[datetime], 
+                      parserFechaHora, encoding: str = ENCODING_ARCHIVOS) -> 'LecturasColumnares':
+        """Retorna las lecturas posteriores a fechaHoraUltimaLectura, con el mismo resultado que parsear cada línea 
+        con ParserLecturaRes11.parsear. 
+        Las líneas pueden ser una lista de textos, sin la cabecera ni líneas vacías, o un arreglo numpy con los bytes 
+        de las líneas (las líneas vacías se ignoran) que se decodifican con encoding. 
+        Los errores de fecha y hora y las lecturas fuera de orden se registran en el log como en la importación línea 
+        por línea
+        """
+        lecturas = LecturasColumnares()
+        if isinstance(lineas, np.ndarray):
+            columnas, lecturas.cantidadLineas = self._separarColumnasBytes(lineas, encoding)
+        else:
+            lecturas.cantidadLineas = len(lineas)
+            columnas = self._separarColumnas(lineas) if lineas else None
+        if not lecturas.cantidadLineas:
+            return lecturas
+        fechasHoras, validas = self._parsearFechasHoras(columnas[self._indiceFecha], columnas[self._indiceHora], 
+                                                        parserFechaHora, encoding)
+        #Una lectura se carga si es posterior a la última lectura y a todas las anteriores del archivo
+        claves = fechasHoras.view(np.int64).copy()
+        claves[~validas] = np.iinfo(np.int64).min
+        anteriores = np.empty_like(claves)
+        anteriores[0] = np.datetime64(fechaHoraUltimaLectura, 'us').view(np.int64) if fechaHoraUltimaLectura else np.iinfo(np.int64).min
+        np.maximum.accumulate(claves[:-1], out=anteriores[1:])
+        np.maximum(anteriores[1:], anteriores[0], out=anteriores[1:])
+        aceptadas = validas & (claves > anteriores)
+        indices = np.flatnonzero(aceptadas)
+        if not len(indices):
+            return lecturas
+        #A partir de la primera lectura cargada, las que no son posteriores son un error
+        for indice in (np.flatnonzero(validas[indices[0]:] & ~aceptadas[indices[0]:]) + indices[0]).tolist():
+            logging.error(f"La fecha y hora de la línea {nroLineaInicial + indice} debería ser posterior a las de la línea anterior")
+
+        todas = len(indices) == lecturas.cantidadLineas
+        lecturas.nroLineas = (indices + nroLineaInicial).tolist()
+        lecturas.valores['fecha_hora'] = fechasHoras[indices].tolist()
+        tieneErrores = np.zeros(len(indices), dtype=bool)
+        for indice, campo, conversor, validador, obligatorio in self._campos:
+            if todas:
+                originales = columnas[indice]
+            elif isinstance(columnas[indice], np.ndarray):
+                originales = columnas[indice][indices]
+            else:
+                originales = [columnas[indice][posicion] for posicion in indices.tolist()]
+            valores, errores = self._convertirColumna(campo, originales, conversor, validador, obligatorio, encoding)
+            lecturas.valores[campo] = valores
+            if errores.any():
+                if isinstance(originales, np.ndarray):
+                    originales = _decodificar(originales, encoding)
+                lecturas.errores[campo] = (errores, originales)
+                tieneErrores |= errores
+        lecturas.valores['tiene_errores'] = tieneErrores.tolist()
+        lecturas.cantidadErrores = int(tieneErrores.sum())
+        return lecturas
+
+    def _separarColumnas(self, lineas: list) -> list:
+        """Retorna la lista de columnas (listas de textos) de las líneas, completando los campos faltantes con ''"""
+        cantCampos = self._cantCampos
+        texto = ';'.join(lineas)
+        if ('"' not in texto) and all(cantidad == cantCampos - 1 for cantidad in map(str.count, lineas, repeat(';'))):
+            #Todas las líneas tienen exactamente los campos de la estructura, se separan con un único split
+            campos = texto.split(';')
+            return [campos[indice::cantCampos] for indice in range(cantCampos)]
+        filas = [next(reader((linea,), delimiter=';')) if ('"' in linea) else linea.split(';') for linea in lineas]
+        for fila in filas:
+            if (len(fila) < cantCampos):
+                fila.extend([''] * (cantCampos - len(fila)))
+        return list(zip(*filas))[:cantCampos]
+
+    def _separarColumnasBytes(self, datos, encoding: str):
+        """Retorna las columnas (arreglos de bytes) de las líneas no vacías de datos y la cantidad de líneas. 
+        Las líneas y los campos se separan sobre los bytes, salvo que alguna línea tenga comillas o una cantidad de 
+        campos distinta a la de la estructura: en ese caso las líneas se decodifican y se separan con _separarColumnas
+        """
+        saltos = np.flatnonzero(datos == ord('\n'))
+        inicios = np.concatenate(([0], saltos + 1))
+        fines = np.concatenate((saltos, [len(datos)]))
+        #Quitar los '\r' del final de las líneas (igual que rstrip('\r\n'))
+        conRetorno = fines > inicios
+        while conRetorno.any():
+            conRetorno[conRetorno] = datos[fines[conRetorno] - 1] == ord('\r')
+            fines[conRetorno] -= 1
+            conRetorno &= fines > inicios
+        noVacias = fines > inicios
+        inicios = inicios[noVacias]
+        fines = fines[noVacias]
+        cantidad = len(inicios)
+        cantCampos = self._cantCampos
+        separadores = np.flatnonzero(datos == ord(';'))
+        #Los bytes nulos también se decodifican porque los arreglos de bytes de numpy los descartan al final del valor
+        if (not (datos == ord('"')).any()) and (not (datos == 0).any()) and \
+           (np.searchsorted(separadores, fines) - np.searchsorted(separadores, inicios) == cantCampos - 1).all():
+            #Todas las líneas tienen exactamente los campos de la estructura
+            separadores = separadores.reshape(cantidad, cantCampos - 1)
+            iniciosCampos = np.column_stack((inicios, separadores + 1))
+            finesCampos = np.column_stack((separadores, fines))
+            return [_columnaBytes(datos, iniciosCampos[:, indice], finesCampos[:, indice]) 
+                    for indice in range(cantCampos)], cantidad
+        lineas = [datos[inicio:fin].tobytes().decode(encoding, errors='replace') 
+                  for inicio, fin in zip(inicios.tolist(), fines.tolist())]
+        return (self._separarColumnas(lineas) if lineas else None), cantidad
+
+    def _parsearFechasHoras(self, fechas, horas, parserFechaHora, encoding: str = ENCODING_ARCHIVOS):
+        """Retorna el arreglo datetime64[us] de la fecha y hora de cada línea y la máscara de las válidas.
+        Con los formatos de posiciones fijas los valores se obtienen de los dígitos de todas las líneas a la vez, 
+        las que no respetan las posiciones (o tienen valores fuera de rango) se parsean con parserFechaHora
+        """
+        columnasBytes = isinstance(fechas, np.ndarray)
+        if columnasBytes:
+            textos = np.char.add(np.char.add(fechas, b' '), horas)
+        else:
+            textos = [f"{fecha} {hora}" for fecha, hora in zip(fechas, horas)]
+        cantidad = len(textos)
+        fechasHoras = np.full(cantidad, np.datetime64('NaT'), dtype='datetime64[us]')
+        validas = np.zeros(cantidad, dtype=bool)
+        if parserFechaHora.rapido:
+            largo = parserFechaHora.largo
+            #Cada caracter como su código (unicode o byte), en una matriz de una fila por línea
+            if columnasBytes:
+                largos = np.char.str_len(textos)
+                codigos = textos.astype(f"S{largo}").view(np.uint8).reshape(cantidad, largo).astype(np.int64)
+            else:
+                largos = np.fromiter(map(len, textos), dtype=np.int64, count=cantidad)
+                codigos = np.array(textos, dtype=f"U{largo}").view(np.uint32).reshape(cantidad, largo).astype(np.int64)
+            rapidas = largos == largo
+            for posicion, separador in parserFechaHora.separadoresFijos:
+                rapidas &= codigos[:, posicion] == ord(separador)
+            componentes = []
+            for recorte in parserFechaHora.recortes:
+                digitos = codigos[:, recorte] - ord('0')
+                rapidas &= ((digitos >= 0) & (digitos <= 9)).all(axis=1)
+                componentes.append(digitos @ (10 ** np.arange(recorte.stop - recorte.start - 1, -1, -1)))
+            componentes.extend([np.zeros(cantidad, dtype=np.int64)] * (6 - len(componentes)))
+            anio, mes, dia, hora, minuto, segundo = componentes
+            rapidas &= (anio >= 1) & (mes >= 1) & (mes <= 12) & (dia >= 1) & (hora < 24) & (minuto < 60) & (segundo < 60)
+            meses = np.where(rapidas, (anio - 1970) * 12 + mes - 1, 0).astype('datetime64[M]')
+            diasMes = ((meses + 1).astype('datetime64[D]') - meses.astype('datetime64[D]')).astype(np.int64)
+            rapidas &= dia <= diasMes
+            segundos = ((dia - 1) * 86400 + hora * 3600 + minuto * 60 + segundo) * 1000000
+            fechasHoras[rapidas] = (meses.astype('datetime64[us]') + segundos.astype('timedelta64[us]'))[rapidas]
+            validas |= rapidas
+        #Las líneas que no se pudieron resolver por posiciones se parsean una por una
+        for indice in np.flatnonzero(~validas).tolist():
+            texto = textos[indice].decode(encoding, errors='replace') if columnasBytes else textos[indice]
+            try:
+                fechasHoras[indice] = np.datetime64(parserFechaHora.parsear(texto), 'us')
+                validas[indice] = True
+            except Exception as e:
+                logging.error(e)
+        return fechasHoras, validas
+
+    def _convertirColumna(self, campo, originales, conversor, validador, obligatorio, encoding: str = ENCODING_ARCHIVOS):
+        """Retorna la lista de valores convertidos de la columna y la máscara de los valores con error.
+        Los valores originales pueden ser textos o un arreglo de bytes, que sólo se decodifica si el campo no es 
+        numérico o si numpy no puede convertir algún valor
+        """
+        cantidad = len(originales)
+        columnaBytes = isinstance(originales, np.ndarray)
+        vacio, cero = (b'', b'0') if columnaBytes else ('', '0')
+        textos = originales if columnaBytes else np.array(originales, dtype=str)
+        errores = (textos == vacio) if obligatorio else np.zeros(cantidad, dtype=bool)
+        if conversor is None:
+            valores = _decodificar(originales, encoding) if columnaBytes else list(originales)
+            if columnaBytes:
+                textos = np.array(valores, dtype=str)
+            numeros = None
+        else:
+            if columnaBytes:
+                textos = np.char.strip(np.char.replace(textos, b',', b'.'))
+            else:
+                textos = np.char.strip(np.char.replace(textos, ',', '.'))
+            vacios = textos == vacio
+            try:
+                numeros = np.where(vacios, cero, textos).astype(np.float64)
+            except ValueError:
+                #Algún valor no es un número para numpy, convertir la columna valor por valor
+                numeros = np.zeros(cantidad, dtype=np.float64)
+                for posicion, original in enumerate(_decodificar(originales, encoding) if columnaBytes else originales):
+                    try:
+                        valor = conversor(original)
+                        if valor is None:
+                            #Blancos que numpy no quita (ej: espacio duro)
+                            vacios[posicion] = True
+                        numeros[posicion] = 0 if valor is None else valor
+                    except Exception as e:
+                        logLecturas.debug("%s", e)
+                        errores[posicion] = True
+            if (conversor is self._conversorEntero):
+                #int(float(valor)) trunca y falla con los valores no finitos
+                finitos = np.isfinite(numeros)
+                errores |= ~finitos
+                enteros = np.trunc(np.where(finitos, numeros, 0))
+                if (np.abs(enteros) < 2 ** 62).all():
+                    valores = enteros.astype(np.int64).tolist()
+                else:
+                    valores = [int(valor) for valor in enteros.tolist()]
+            else:
+                valores = numeros.tolist()
+            if vacios.any():
+                for posicion in np.flatnonzero(vacios).tolist():
+                    valores[posicion] = None
+                numeros = np.where(vacios, np.nan, numeros)
+        validadorColumna = self._validadoresColumna.get(campo)
+        if validadorColumna:
+            errores |= np.asarray(validadorColumna(numeros if numeros is not None else textos), dtype=bool)
+        elif validador:
+            for posicion in np.flatnonzero(~errores).tolist():
+                try:
+                    validador(valores[posicion])
+                except Exception as e:
+                    logLecturas.debug("%s", e)
+                    errores[posicion] = True
+        return valores, errores
+
+
+
+
+class LecturasColumnares():
+    """Lecturas de un archivo obtenidas por ParserColumnarLecturaRes11, por columnas: 
+    valores {atributo: [valor de cada lectura]} y errores {atributo: (máscara de los valores con error, valores del archivo)}
+    """
+
+    def __init__(self):
+        self.cantidadLineas = 0   #Líneas parseadas, incluyendo las lecturas no cargadas
+        self.nroLineas = []
+        self.valores = {}
+        self.errores = {}
+        self.cantidadErrores = 0
+
+    def __len__(self):
+        return len(self.nroLineas)
+
+    def cantidadErroresCampos(self) -> dict:
+        """Retorna {atributo: cantidad de lecturas con el valor erróneo}"""
+        return {campo: int(np.count_nonzero(errores)) for campo, (errores, _) in self.errores.items()}
+
+    def _erroresLecturas(self) -> dict:
+        """Retorna {posición: {atributo: valor del archivo}} de las lecturas con errores"""
+        erroresLecturas = {}
+        for campo, (errores, originales) in self.errores.items():
+            for posicion in np.flatnonzero(errores).tolist():
+                erroresLecturas.setdefault(posicion, {})[campo] = originales[posicion]
+        return erroresLecturas
+
+    def lecturas(self):
+        """Retorna la lista [(nroLinea, valores, errores)] con los diccionarios por atributo de cada lectura, 
+        iguales a los de ParserLecturaRes11.parsear"""
+        atributos = list(self.valores)
+        lecturas = [(nroLinea, dict(zip(atributos, valores)), None) 
+                    for nroLinea, valores in zip(self.nroLineas, zip(*self.valores.values()))]
+        for posicion, errores in self._erroresLecturas().items():
+            nroLinea, valores, _ = lecturas[posicion]
+            for campo in errores:
+                del valores[campo]
+            lecturas[posicion] = (nroLinea, valores, errores)
+        return lecturas
+
+    def valoresInsert(self):
+        """Retorna la lista [(valoresLectura, valoresError)] con los diccionarios por columna para la inserción 
+        masiva (ver ArchivoLecturaRes11._insertarLecturasBulk), iguales a los que arma _valoresInsert
+        """
+        columnas = []
+        listas = []
+        for atributo, columna, valorDefault in _columnasInsert(LecturaMedidorRes11):
+            valores = self.valores.get(atributo)
+            if valores is None:
+                valores = repeat(valorDefault)
+            else:
+                if atributo in self.errores:
+                    valores = list(valores)
+                    for posicion in np.flatnonzero(self.errores[atributo][0]).tolist():
+                        valores[posicion] = None
+                if valorDefault is not None:
+                    valores = [valorDefault if valor is None else valor for valor in valores]
+            columnas.append(columna)
+            listas.append(valores)
+        #El número de línea reemplaza al del atributo nro_linea (vacío) por estar al final
+        columnas.append('ald_nro_linea')
+        listas.append(self.nroLineas)
+        valoresInsert = [(dict(zip(columnas, valores)), None) for valores in zip(*listas)]
+        if self.errores:
+            #Los errores también se arman por columnas, sólo para las lecturas con algún valor erróneo
+            conError = np.logical_or.reduce([errores for errores, _ in self.errores.values()])
+            posiciones = np.flatnonzero(conError).tolist()
+            columnas = []
+            listas = []
+            for atributo, columna, valorDefault in _columnasInsert(ErrorLecturaRes11):
+                if atributo in self.errores:
+                    errores, originales = self.errores[atributo]
+                    valores = np.where(errores, np.array(originales, dtype=object), None)[conError].tolist()
+                    if valorDefault is not None:
+                        valores = [valorDefault if valor is None else valor for valor in valores]
+                else:
+                    valores = repeat(valorDefault)
+                columnas.append(columna)
+                listas.append(valores)
+            for posicion, valores in zip(posiciones, zip(*listas)):
+                valoresInsert[posicion] = (valoresInsert[posicion][0], dict(zip(columnas, valores)))
+        return valoresInsert
+
+
+def _columnaBytes(datos, inicios, fines):
+    """Retorna el arreglo de bytes con los valores datos[inicio:fin] de un campo de todas las líneas"""
+    largos = fines - inicios
+    ancho = int(largos.max()) if len(largos) else 0
+    if (ancho == 0):
+        return np.zeros(len(largos), dtype='S1')
+    if (ancho > ANCHO_MAXIMO_CAMPO_BYTES):
+        #Evitar una matriz de líneas x ancho para un campo con algún valor muy largo
+        return np.array([datos[inicio:fin].tobytes() for inicio, fin in zip(inicios.tolist(), fines.tolist())], 
+                        dtype=f"S{ancho}")
+    posiciones = np.arange(ancho)
+    enCampo = posiciones < largos[:, None]
+    #Matriz de una fila por línea con los bytes del campo, completada con ceros (que numpy descarta al final del valor)
+    matriz = datos[np.where(enCampo, inicios[:, None] + posiciones, 0)]
+    matriz[~enCampo] = 0
+    return matriz.view(f"S{ancho}").ravel()
+
+
+def _decodificar(valores, encoding: str) -> list:
+    """Decodifica los valores de un arreglo de bytes con una única llamada (los valores no tienen bytes nulos)"""
+    if not len(valores):
+        return []
+    return b'\x00'.join(valores.tolist()).decode(encoding, errors='replace').split('\x00')
+
+
+def getParserColumnar(estructuraCampos: EstructuraCamposLecturaRes11, claseLectura = None):
+    """Retorna el parser columnar para la estructura de campos, None si numpy no está instalado"""
+    if np is None:
+        return None
+    return _getParserColumnar(estructuraCampos, claseLectura or LecturaMedidorRes11)
+
+
+@lru_cache(maxsize=None)
+def _getParserColumnar(estructuraCampos: EstructuraCamposLecturaRes11, claseLectura) -> ParserColumnarLecturaRes11:
+    return ParserColumnarLecturaRes11(estructuraCampos, claseLectura)
+
+
+
+
 class LecturaMedidorLiquido(LecturaMedidorRes11):
 #     temperatura = Column('ald_temperatura', NUMBER(9, 2, True))
 #     presion = Column('ald_presion', NUMBER(9, 2, True))
@@ -440,8 +1348,8 @@ class LecturaMedidorLiquido(LecturaMedidorRes11):
 #     factor_k_del_medidor = Column('ald_factor_k_del_medidor', NUMBER(9, 0, False))
 
 
-    def rellenarCamposFromLineaArchivo(self, dicLinea):
-        super().rellenarCamposFromLineaArchivo(dicLinea)
+    def rellenarCamposFromLineaArchivo(self, dicLinea, fechaHora=None):
+        super().rellenarCamposFromLineaArchivo(dicLinea, fechaHora)
 #         self._setValorCampo('temperatura', dicLinea['temperatura'], True)
 #         self._setValorCampo('presion', dicLinea['presion'], True) 
 #         self._setValorCampo('caudal_instantaneo_gross', dicLinea['caudal_instantaneo_gross'], True)
@@ -453,7 +1361,8 @@ class LecturaMedidorLiquido(LecturaMedidorRes11):
     """
     Definición de validadores de campos
     
-    def self._validar_<nombre_campo>(valor)
+    @staticmethod
+    def _validar_<nombre_campo>(valor)
     siendo:
         nombre_campo: el nombre del campo a validar, es sensible a mayúsculas 
                       y minúsculas
@@ -461,9 +1370,11 @@ class LecturaMedidorLiquido(LecturaMedidorRes11):
         
     La función retorna None (no devuelve resultado alguno) y si el valor es 
     inválido debe generar una excepción del tipo ValidacionCampoException con 
-    el mensaje indicando claramente el motivo del error en la validación
+    el mensaje indicando claramente el motivo del error en la validación.
+    Los validadores son estáticos para que ParserLecturaRes11 los pueda resolver al compilar
     """
-    def _validar_temperatura(self, valor: float) -> None:
+    @staticmethod
+    def _validar_temperatura(valor: float) -> None:
         """Validador del campo temperatura"""
         #FIXME: borrar esta rango de validacion de prueba
         if not (0 > valor >= 25):
@@ -479,8 +1390,8 @@ class LecturaMedidorTanque(LecturaMedidorRes11):
 #     acumulador_masa_no_reseteable = Column('ald_acumulador_masa_no_resete', NUMBER(9, 0, False))
 
 
-    def rellenarCamposFromLineaArchivo(self, dicLinea):
-        super().rellenarCamposFromLineaArchivo(dicLinea)
+    def rellenarCamposFromLineaArchivo(self, dicLinea, fechaHora=None):
+        super().rellenarCamposFromLineaArchivo(dicLinea, fechaHora)
 #         self._setValorCampo('altura_liquida', self._str2Float(dicLinea['altura_liquida']))
 #         self._setValorCampo('acumulador_masa_no_reseteable', self._str2Integer(dicLinea['acumulador_masa_no_reseteable']))
         
@@ -511,8 +1422,8 @@ class LecturaMedidorGas(LecturaMedidorRes11):
 #     poder_calorifico = Column('ald_poder_calorifico', NUMBER(9, 0, False))
 
 
-    def rellenarCamposFromLineaArchivo(self, dicLinea):
-        super().rellenarCamposFromLineaArchivo(dicLinea)
+    def rellenarCamposFromLineaArchivo(self, dicLinea, fechaHora=None):
+        super().rellenarCamposFromLineaArchivo(dicLinea, fechaHora)
 #         self._setValorCampo('volumen_acumulado_24_hs', self._str2Float(dicLinea['volumen_acumulado_24_hs']))
 #         self._setValorCampo('volumen_acumulado_hoy', self._str2Float(dicLinea['volumen_acumulado_hoy']))
 #         self._setValorCampo('sh2', self._str2Float(dicLinea['sh2']))
@@ -601,3 +1512,18 @@ class ErrorLecturaRes11(Base):
             super().__init__(**kwargs)
             self.lectura = lectura
 
+
+
+
+class UltimaLecturaRes11(Base):
+    '''
+    Marca con la fecha y hora de la última lectura cargada de cada ramal de cada medidor.
+    Se actualiza con cada archivo importado para que la planificación no tenga que calcular el máximo sobre la tabla
+    de lecturas. Si se dan de baja lecturas se debe eliminar la marca del ramal para que se vuelva a calcular
+    '''
+    __tablename__ = 'tlm_ultimas_lecturas_res11'
+    __table_args__ = {'schema': 'regalias'}
+
+    medidor_id = Column('ulr_mds_id', ForeignKey('regalias.tremedfiscal.remedfisid'), primary_key=True)
+    ramal = Column('ulr_ramal', NUMBER(3, 0, False), primary_key=True)
+    fecha_hora = Column('ulr_fecha_hora', DateTime, nullable=False, comment='Fecha y hora de la última lectura cargada')
@@ -9,19 +9,27 @@ import logging
 
 from datetime import datetime, date, timedelta
 from pathlib import Path
+from typing import Tuple
 import json
 from jsonschema import validate
 
 from sqlalchemy import Column, DateTime, ForeignKey, VARCHAR, func, inspect,BOOLEAN
 from sqlalchemy.dialects.oracle import NUMBER
 from sqlalchemy.orm import relationship
-# from sqlalchemy import orm
+from sqlalchemy import orm
 from sqlalchemy.ext.hybrid import hybrid_property
 
 from .base import Base
-from .lectura_res11 import ArchivoLecturaRes11, LecturaMedidorRes11, SCHEMA_LECTURA_MEDIDOR_RES11
+from . import metricas
+#Constantes de filtros de Medidor
+from .empresa import FM_FORMATO_FECHA, FM_FORMATO_HORA, DEFAULT_FORMATO_FECHA, DEFAULT_FORMATO_HORA  # @UnusedImport
+from .lectura_res11 import ArchivoLecturaRes11, LecturaMedidorRes11, UltimaLecturaRes11, SCHEMA_LECTURA_MEDIDOR_RES11, \
+                           EstructuraCamposLecturaRes11, getEstructuraCampos, PL_REFLEXIVO
 from sqlalchemy.orm.exc import NoResultFound
 
+#Cantidad máxima de valores de una condición IN (límite de Oracle)
+MAXIMO_ELEMENTOS_IN = 1000
+
 class TipoMedidorFiscal(Base):
     __tablename__ = 'tretiposistmed'
     __table_args__ = {'schema': 'regalias'}
@@ -56,12 +64,10 @@ class TipoMedidorFiscal(Base):
         self.id
         validate(instance = self.campos_lectura, schema = SCHEMA_LECTURA_MEDIDOR_RES11)
 
-#Constantes de filtros de Medidor
-FM_FORMATO_FECHA = "formatoFecha"
-FM_FORMATO_HORA = "formatoHora"
-
-DEFAULT_FORMATO_FECHA = "%d/%m/%Y"
-DEFAULT_FORMATO_HORA = "%H:%M:%S"
+    @property
+    def estructuraCampos(self) -> EstructuraCamposLecturaRes11:
+        """Estructura de campos validada, se compila una única vez por cada valor distinto de _campos_lectura"""
+        return getEstructuraCampos(self._campos_lectura)
 
 
 
@@ -96,15 +102,25 @@ class MedidorFiscal(Base):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self._inicializarOpciones()
+
+    @orm.reconstructor
+    def __init_on_load(self):
+        #Los medidores obtenidos de la DB no pasan por __init__, las opciones de importación deben existir igual
+        self._inicializarOpciones()
+
+    def _inicializarOpciones(self):
+        """Valores por defecto de las opciones de descarga e importación, que no se guardan en la DB"""
         self.dirDescargas = ''   #Directorio donde se descargarán los nuevos archivos. '' significa el directorio actual
+        self.importacionBulk = False   #Importar las lecturas con executemany en lugar de objetos ORM
+        self.parserLecturas = PL_REFLEXIVO   #Parser a utilizar para las líneas de los archivos de lecturas
+        self.descargaStreaming = False   #Parsear los archivos a medida que se leen del servidor, sin descargarlos a disco
+        self.maxDiasXEjecucion = 1   #Cantidad máxima de archivos diarios pendientes a procesar por ramal en cada ejecución
+        self.descargasParalelas = 1   #Cantidad de archivos que se pueden descargar a la vez (si la conexión lo soporta)
+        self.ultimasLecturas = None   #{ramal: fecha_hora} precargado con getUltimasLecturasRamales, None para consultarlo por ramal
+        self.usarMarcasLectura = False   #Mantener actualizada la tabla de marcas de últimas lecturas (UltimaLecturaRes11)
         self._formatoFecha = DEFAULT_FORMATO_FECHA
         self._formatoHora = DEFAULT_FORMATO_HORA
-    
-#     @orm.reconstructor
-#     def __init_on_load(self):
-#         self.dirDescargas = ''
-#         self._formatoFecha = DEFAULT_FORMATO_FECHA
-#         self._formatoHora = DEFAULT_FORMATO_HORA
 
     @hybrid_property
     def instalacion(self):
@@ -168,13 +184,7 @@ class MedidorFiscal(Base):
     @property
     def formatoFecha(self):
         """Recupera el formato de la fecha de la conexión asociada a la empresa del medidor"""
-        formatoFecha = DEFAULT_FORMATO_FECHA
-        dictFormatos = self.empresa.conexion.filtros2Dict()
-        if (dictFormatos):
-            formatoFecha = dictFormatos.get(FM_FORMATO_FECHA, DEFAULT_FORMATO_FECHA) 
-            if (formatoFecha == ''):
-                formatoFecha = DEFAULT_FORMATO_FECHA
-        return formatoFecha    
+        return self.empresa.conexion.filtrosConexion.formatoFecha
 #         return self._formatoFecha
         
 #     @formatoFecha.setter
@@ -188,13 +198,12 @@ class MedidorFiscal(Base):
     @property
     def formatoHora(self):
         """Recupera el formato de la hora de la conexión asociada a la empresa del medidor"""
-        formatoHora = DEFAULT_FORMATO_HORA
-        dictFormatos = self.empresa.conexion.filtros2Dict()
-        if (dictFormatos):
-            formatoHora = dictFormatos.get(FM_FORMATO_HORA, DEFAULT_FORMATO_HORA) 
-            if formatoHora == '':
-                formatoHora = DEFAULT_FORMATO_HORA
-        return formatoHora    
+        return self.empresa.conexion.filtrosConexion.formatoHora
+
+    @property
+    def parserFechaHora(self):
+        """Recupera el parser de fecha y hora de las lecturas, según los formatos de la conexión de la empresa"""
+        return self.empresa.conexion.filtrosConexion.parserFechaHora
 
     
 #     @formatoHora.setter
@@ -226,18 +235,11 @@ class MedidorFiscal(Base):
         Si no existe ningún archivo se tomará la fecha de alta del medidor
         """
         session = inspect(self).session
-        ultimaFechaCreacion, = session.query(func.max(ArchivoLecturaRes11.fecha_creacion)).filter(ArchivoLecturaRes11.medidor_id == self.id,
-                                                                                                  ArchivoLecturaRes11.ramal == ramal,
-                                                                                                  ArchivoLecturaRes11.fecha_baja == None
-                                            ).one_or_none()
-        if (ultimaFechaCreacion):
-            ultimoArchivo = session.query(ArchivoLecturaRes11).filter_by(medidor_id = self.id, 
-                                                                         ramal = ramal,
-                                                                         fecha_creacion = ultimaFechaCreacion, 
-                                                                         fecha_baja = None).one()
-        else:
-            ultimoArchivo = None
-        return ultimoArchivo
+        return session.query(ArchivoLecturaRes11).filter(ArchivoLecturaRes11.medidor_id == self.id,
+                                                         ArchivoLecturaRes11.ramal == ramal,
+                                                         ArchivoLecturaRes11.fecha_baja == None) \
+                                                 .order_by(ArchivoLecturaRes11.fecha_archivo.desc()) \
+                                                 .first()
     
     @staticmethod
     def getCantidadArchivosAProcesar(session):
@@ -246,16 +248,62 @@ class MedidorFiscal(Base):
         return session.query(func.sum(MedidorFiscal._cant_ramales)).filter(MedidorFiscal.fecha_baja == None).scalar()
 
 
+    @staticmethod
+    def getUltimasLecturasRamales(session, medidores, usarMarcas: bool = False) -> dict:
+        """Devuelve {medidor_id: {ramal: fecha_hora}} con la última lectura de cada ramal de los medidores indicados,
+        calculada con una única consulta agrupada en lugar de una consulta por ramal. 
+        Si usarMarcas es verdadero se toman de la tabla de marcas (UltimaLecturaRes11) y sólo se calculan sobre la 
+        tabla de lecturas las de los medidores con ramales sin marca
+        Los ramales sin lecturas no se incluyen
+        """
+        ultimasLecturas = {medidor.id: {} for medidor in medidores}
+        if usarMarcas:
+            for marca in session.query(UltimaLecturaRes11):
+                if marca.medidor_id in ultimasLecturas:
+                    ultimasLecturas[marca.medidor_id][int(marca.ramal)] = marca.fecha_hora
+            sinMarca = {medidor.id for medidor in medidores if len(ultimasLecturas[medidor.id]) < medidor.cant_ramales}
+        else:
+            sinMarca = set(ultimasLecturas)
+        #La consulta agrupada se restringe a los medidores sin marca, en grupos de a lo sumo MAXIMO_ELEMENTOS_IN ids
+        sinMarca = sorted(sinMarca)
+        for inicio in range(0, len(sinMarca), MAXIMO_ELEMENTOS_IN):
+            consulta = session.query(ArchivoLecturaRes11.medidor_id, ArchivoLecturaRes11.ramal, func.max(LecturaMedidorRes11.fecha_hora)) \
+                              .select_from(LecturaMedidorRes11).join(ArchivoLecturaRes11).join(MedidorFiscal) \
+                              .filter(ArchivoLecturaRes11.medidor_id.in_(sinMarca[inicio:inicio + MAXIMO_ELEMENTOS_IN]),
+                                      MedidorFiscal.fecha_baja == None,
+                                      ArchivoLecturaRes11.fecha_baja == None,
+                                      LecturaMedidorRes11.fecha_baja == None) \
+                              .group_by(ArchivoLecturaRes11.medidor_id, ArchivoLecturaRes11.ramal)
+            for medidorId, ramal, ultimaLectura in consulta:
+                if (ramal is not None):
+                    ultimasLecturas[medidorId].setdefault(int(ramal), ultimaLectura)
+        return ultimasLecturas
+
+
+    def _actualizarMarcaLectura(self, ramal: int, fechaHora: datetime) -> None:
+        """Actualiza la marca de la última lectura cargada del ramal, si la fecha y hora es posterior"""
+        session = inspect(self).session
+        marca = session.get(UltimaLecturaRes11, (self.id, ramal))
+        if (marca is None):
+            session.add(UltimaLecturaRes11(medidor_id=self.id, ramal=ramal, fecha_hora=fechaHora))
+        elif (fechaHora > marca.fecha_hora):
+            marca.fecha_hora = fechaHora
+
+
     def getFechaHoraUltimaLecturaRamal(self, ramal: int) -> datetime:
         #TODO: revisar getFechaHoraUltimaLecturaRamal() cuando haya datos en la tabla de lecturas
-        session = inspect(self).session
-        ultimaLecturaMedidor = session.query(func.max(LecturaMedidorRes11.fecha_hora)) \
-                                            .select_from(LecturaMedidorRes11).join(ArchivoLecturaRes11) \
-                                            .filter(ArchivoLecturaRes11.medidor_id == self.id,
-                                                    ArchivoLecturaRes11.ramal == ramal,
-                                                    ArchivoLecturaRes11.fecha_baja == None,
-                                                    LecturaMedidorRes11.fecha_baja == None) \
-                                            .scalar()
+        if (self.ultimasLecturas is not None):
+            #Precargada para todos los ramales con getUltimasLecturasRamales
+            ultimaLecturaMedidor = self.ultimasLecturas.get(ramal)
+        else:
+            session = inspect(self).session
+            ultimaLecturaMedidor = session.query(func.max(LecturaMedidorRes11.fecha_hora)) \
+                                                .select_from(LecturaMedidorRes11).join(ArchivoLecturaRes11) \
+                                                .filter(ArchivoLecturaRes11.medidor_id == self.id,
+                                                        ArchivoLecturaRes11.ramal == ramal,
+                                                        ArchivoLecturaRes11.fecha_baja == None,
+                                                        LecturaMedidorRes11.fecha_baja == None) \
+                                                .scalar()
         #Si no existe ninguna lectura válida significa que el medidor es nuevo o todo lo que se ha leído es erróneo. 
         #En ambos casos es necesario establecer una fecha de inicio a partir de la cual se harán las lecturas.
         #De acuerdo a lo conversado con Graciela decidimos tomar como fecha de inicio la fecha de alta del medidor.
@@ -272,66 +320,179 @@ class MedidorFiscal(Base):
         return ultimaLecturaMedidor
 
         
-    def cargarNuevasLecturas(self) -> None:
-        """Carga en la tabla de Lecturas las nuevas lecturas de todos los ramales"""
+    def cargarNuevasLecturas(self) -> Tuple[int, int]:
+        """Carga en la tabla de Lecturas las nuevas lecturas de todos los ramales
+        Retorna la cantidad de archivos procesados correctamente y con error
+        """
+        cantArchivosOk = 0
+        cantArchivosErr = 0
         for ramal in range(1, self.cant_ramales + 1):
             logging.info(f"Procesando Ramal #{ramal}")
-            self.cargarNuevasLecturasXRamal(ramal)
-
-
-    def cargarNuevasLecturasXRamal(self, ramal: int, dirDescargas:str = '') -> None:
-        """Carga en la tabla de Lecturas todas las nuevas lecturas del ramal indicado"""
+            metricas.etiquetar(ramal=ramal, archivo=None)
+            cantOk, cantErr = self.cargarNuevasLecturasXRamal(ramal)
+            cantArchivosOk += cantOk
+            cantArchivosErr += cantErr
+        return cantArchivosOk, cantArchivosErr
+
+
+    def _filtrarArchivosPendientes(self, nombresArchivos):
+        """Recibe la lista [(fecha, nombreArchivo)] ordenada por fecha y retorna los archivos que hay que procesar
+        según el listado del directorio remoto, como una lista [(fecha, nombreArchivo, InfoArchivoRemoto)]:
+            - Se corta en el primer archivo que no existe en el servidor (todavía no fue publicado)
+            - Se omiten los archivos ya importados que no cambiaron (ver _archivoSinCambios)
+        Si el servidor no permite listar el directorio se retornan todos los archivos (sin InfoArchivoRemoto)
+        """
+        try:
+            listado = self.empresa.conexion.conexionRemota.listDir()
+        except Exception as e:
+            logging.debug(f"No se pudo obtener el listado del directorio remoto, se descargarán todos los archivos (error: {e})")
+            return [(fecha, nombreArchivo, None) for fecha, nombreArchivo in nombresArchivos]
+        
+        session = inspect(self).session
+        importados = {nombre: (tamanio, fechaCreacion) 
+                      for nombre, tamanio, fechaCreacion in session.query(ArchivoLecturaRes11.nombre, 
+                                                                          ArchivoLecturaRes11.tamanio,
+                                                                          ArchivoLecturaRes11.fecha_creacion)
+                                                                   .filter(ArchivoLecturaRes11.medidor_id == self.id,
+                                                                           ArchivoLecturaRes11.nombre.in_([nombre for _, nombre in nombresArchivos]),
+                                                                           ArchivoLecturaRes11.fecha_baja == None)}
+        pendientes = []
+        for fecha, nombreArchivo in nombresArchivos:
+            infoArchivo = listado.get(nombreArchivo)
+            if (infoArchivo is None):
+                #No se puede saltear el día porque la última lectura es la marca a partir de la cual se retoma
+                logging.info(f"El archivo {nombreArchivo} no existe en el servidor, se procesará en la próxima ejecución")
+                break
+            if (nombreArchivo in importados) and (_archivoSinCambios(infoArchivo, *importados[nombreArchivo])):
+                logging.debug(f"El archivo {nombreArchivo} no cambió desde su última importación")
+                continue
+            pendientes.append((fecha, nombreArchivo, infoArchivo))
+        return pendientes
+
+
+    def cargarNuevasLecturasXRamal(self, ramal: int, dirDescargas:str = '') -> Tuple[int, int]:
+        """Carga en la tabla de Lecturas todas las nuevas lecturas del ramal indicado
+        Se procesan como máximo maxDiasXEjecucion archivos diarios, en orden de fecha, deteniéndose en el primero con error
+        Retorna la cantidad de archivos procesados correctamente y con error
+        """
         ultimaLectura = self.getFechaHoraUltimaLecturaRamal(ramal)
         #Obtener un array con todos los días entre la fecha de hoy y la de la ultima lectura,
         #el rango de fechas a descargar debe arrancar una hora después de la última lectura
         fechasParaDescargar = [date.fromordinal(i) for i in range((ultimaLectura + timedelta(hours=1)).toordinal(), 
                                                                   (date.today() + timedelta(days=1)).toordinal())]
         
+        #Acotar la ventana de días a procesar en esta ejecución, los días restantes se procesan en las siguientes
+        fechasParaDescargar = fechasParaDescargar[:max(self.maxDiasXEjecucion, 1)]
+        nombresArchivos = [(fecha, self.getNombreArchivoLecturasRes11(ramal, fecha)) for fecha in fechasParaDescargar]
+        
         session = inspect(self).session
-        for fecha in fechasParaDescargar:
-            nombreArchivo = self.getNombreArchivoLecturasRes11(ramal, fecha)
-            try:
-                huboError = False
-                #Si ya existe un archivo cargado para la fecha a procesar recuperarlo, sino crear uno nuevo
+        conexionRemota = self.empresa.conexion.conexionRemota
+        #Descartar los archivos que todavía no se publicaron y los que no cambiaron desde su última importación
+        nombresArchivos = self._filtrarArchivosPendientes(nombresArchivos)
+        cantArchivosOk = 0
+        cantArchivosErr = 0
+        if self.descargaStreaming:
+            descargas = None
+        else:
+            #Las descargas se adelantan en paralelo pero se entregan en orden de fecha
+            descargas = conexionRemota.getFiles([(nombreArchivo, Path(self.dirDescargas, nombreArchivo)) 
+                                                 for _, nombreArchivo, _ in nombresArchivos], 
+                                                self.descargasParalelas)
+        try:
+            for fecha, nombreArchivo, infoArchivo in nombresArchivos:
+                localFilename = None
+                metricas.etiquetar(archivo=nombreArchivo)
                 try:
-                    currArchivo = session.query(ArchivoLecturaRes11).filter_by(medidor_id = self.id, 
-                                                                               nombre = nombreArchivo, 
-                                                                               fecha_baja = None).one()
-                    logging.debug('El archivo ya existe en la DB')
-                except NoResultFound:
-                    #Crear un nuevo archivo
-                    medidor = session.query(MedidorFiscal).filter_by(id=self.id).one()
-                    currArchivo = ArchivoLecturaRes11(medidor_id = self.id,
-                                                      nombre = nombreArchivo,
-                                                      tamanio = 0,                
-                                                      fecha_creacion = fecha,         
-                                                      cantidad_registros = 0,    
-                                                      cantidad_registros_ok = 0, 
-                                                      cantidad_registros_err = 0,
-                                                      medidor=medidor,
-                                                      hash = None)               
-                    logging.debug('El archivo no existe en la DB, insertando un nuevo registro')
-                    session.add(currArchivo)  
-                remoteFilename = nombreArchivo
-                localFilename = Path(self.dirDescargas, remoteFilename)
-                #Descargar el archivo
-                self.empresa.conexion.conexionRemota.getFile(remoteFilename, localFilename)
-                #TODO: cuando se deben guardar tamaño, fecha_creacion y hash
-                
-                #Procesar el archivo descargado
-                logging.debug(f"Procesando el archivo {localFilename}")
-                currArchivo.importarLecturas(localFilename)
-                session.commit()
-            except Exception as e:
-                session.rollback()
-                huboError = True
-                logging.error(e)
-            finally:
-                #Borrar el archivo descargado
-                if (localFilename.exists() and localFilename.is_file()):
-                    #En el caso de que haya ocurrido un error no mostrar el mensaje Borrando.... porque ya se mostró el error
-                    if (not huboError):
-                        logging.debug(f"Borrando el archivo {localFilename}")
-                    #localFilename.unlink()
-            #FIXME: Borrar el siguiente break
-            break
\ No newline at end of file
+                    huboError = False
+                    #Si ya existe un archivo cargado para la fecha a procesar recuperarlo, sino crear uno nuevo
+                    try:
+                        currArchivo = session.query(ArchivoLecturaRes11).filter_by(medidor_id = self.id, 
+                                                                                   nombre = nombreArchivo, 
+                                                                                   fecha_baja = None).one()
+                        logging.debug('El archivo ya existe en la DB')
+                    except NoResultFound:
+                        #Crear un nuevo archivo
+                        currArchivo = ArchivoLecturaRes11(medidor_id = self.id,
+                                                          nombre = nombreArchivo,
+                                                          tamanio = 0,                
+                                                          fecha_creacion = fecha,         
+                                                          cantidad_registros = 0,    
+                                                          cantidad_registros_ok = 0, 
+                                                          cantidad_registros_err = 0,
+                                                          medidor=self,
+                                                          hash = None)               
+                        logging.debug('El archivo no existe en la DB, insertando un nuevo registro')
+                        session.add(currArchivo)  
+                    remoteFilename = nombreArchivo
+                    if descargas is None:
+                        #Procesar el archivo a medida que se lee del servidor
+                        logging.debug(f"Procesando el archivo remoto {remoteFilename}")
+                        with conexionRemota.openFile(remoteFilename) as archivoRemoto:
+                            ultimaLecturaArchivo = currArchivo.importarLecturas(archivoRemoto, bulk=self.importacionBulk, 
+                                                                                parser=self.parserLecturas)
+                    else:
+                        #Esperar la descarga del archivo
+                        _, localFilename = next(descargas)
+                        
+                        #Procesar el archivo descargado
+                        logging.debug(f"Procesando el archivo {localFilename}")
+                        ultimaLecturaArchivo = currArchivo.importarLecturas(localFilename, bulk=self.importacionBulk, 
+                                                                            parser=self.parserLecturas)
+                    if (infoArchivo is not None) and (infoArchivo.fechaModificacion is not None):
+                        #Fecha del listado, anterior a la descarga: si el archivo se vuelve a modificar cambia su fecha
+                        currArchivo.fecha_creacion = _truncarSegundos(infoArchivo.fechaModificacion)
+                    if (self.usarMarcasLectura) and (ultimaLecturaArchivo):
+                        self._actualizarMarcaLectura(ramal, ultimaLecturaArchivo)
+                    with metricas.medir('flush'):
+                        session.flush()
+                    with metricas.medir('commit'):
+                        session.commit()
+                    if (self.ultimasLecturas is not None) and (ultimaLecturaArchivo):
+                        self.ultimasLecturas[ramal] = max(ultimaLecturaArchivo, self.ultimasLecturas.get(ramal, ultimaLecturaArchivo))
+                    cantArchivosOk += 1
+                except Exception as e:
+                    #El rollback expira todos los objetos de la sesión (aunque la sesión de la importación no los 
+                    #expire en cada commit), la configuración y el archivo se vuelven a leer de la DB al utilizarlos
+                    session.rollback()
+                    huboError = True
+                    cantArchivosErr += 1
+                    logging.error(e)
+                finally:
+                    #Borrar el archivo descargado
+                    if (localFilename) and (localFilename.exists() and localFilename.is_file()):
+                        #En el caso de que haya ocurrido un error no mostrar el mensaje Borrando.... porque ya se mostró el error
+                        if (not huboError):
+                            logging.debug(f"Borrando el archivo {localFilename}")
+                        #localFilename.unlink()
+                #La última lectura del ramal es la marca a partir de la cual se retoma, por lo que no se puede procesar 
+                #un día posterior a uno que falló (ej: archivo del día todavía no publicado) sin dejar un hueco
+                if huboError:
+                    break
+        finally:
+            if descargas is not None:
+                #Cancelar las descargas adelantadas que no se llegaron a procesar
+                descargas.close()
+        return cantArchivosOk, cantArchivosErr
+
+
+
+#-------------------------------------------------------------------------------
+# Funciones auxiliares para el filtrado de los archivos a descargar
+#-------------------------------------------------------------------------------
+
+def _truncarSegundos(fecha: datetime) -> datetime:
+    """Elimina la fracción de segundo (las fechas de la DB y de algunos servidores no la tienen)"""
+    return fecha.replace(microsecond=0)
+
+
+def _archivoSinCambios(infoArchivo, tamanio, fechaModificacion) -> bool:
+    """Indica si el archivo remoto no cambió desde su última importación, en la que se guardaron los bytes importados 
+    (tamanio) y la fecha de modificación del listado (fecha_creacion).
+    El tamaño importado llega hasta la última línea completa, por lo que no coincide con el del servidor si el 
+    archivo termina en una línea incompleta: si el servidor informa la fecha de modificación se compara la fecha, 
+    y el tamaño sólo debe no ser menor al importado. Sino se compara únicamente el tamaño
+    """
+    if (infoArchivo.fechaModificacion is not None) and (fechaModificacion is not None):
+        return (_truncarSegundos(infoArchivo.fechaModificacion) == fechaModificacion) and \
+               ((infoArchivo.tamanio is None) or (infoArchivo.tamanio >= (tamanio or 0)))
+    return bool(infoArchivo.tamanio) and (tamanio == infoArchivo.tamanio)
@@ -0,0 +1,211 @@
+'''
+Registro del tiempo y la cantidad de cada etapa del proceso de lecturas (conexión, listado, descarga, parseo,
+validación, inserción masiva, flush y commit) por empresa, medidor, ramal y archivo.
+
+Las mediciones sólo se registran si se activó el registro (activar), mientras no está activo medir y etiquetar
+no hacen nada, por lo que se pueden dejar en el código sin afectar el rendimiento.
+
+Las etiquetas (empresa, medidor, ramal y archivo) son propias de cada hilo, cada nivel del proceso las completa
+con etiquetar y todas las mediciones del hilo las toman hasta que se cambien
+'''
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+ETAPAS = ('conexion', 'listado', 'descarga', 'parseo', 'validacion', 'insercion', 'flush', 'commit')
+ETIQUETAS = ('empresa', 'medidor', 'ramal', 'archivo')
+
+#Registro activo, None si las mediciones están desactivadas
+registro = None
+
+
+
+
+class RegistroMetricas():
+    '''
+    Acumula la cantidad y los segundos de cada etapa por cada combinación de etiquetas
+    '''
+
+    def __init__(self):
+        self.inicio = time.time()
+        self._lock = threading.Lock()
+        self._etiquetas = threading.local()
+        #(etapa, empresa, medidor, ramal, archivo) -> [cantidad, segundos]
+        self._mediciones = {}
+
+    def etiquetasActuales(self) -> dict:
+        etiquetas = getattr(self._etiquetas, 'valores', None)
+        if etiquetas is None:
+            etiquetas = self._etiquetas.valores = dict.fromkeys(ETIQUETAS)
+        return etiquetas
+
+    def registrar(self, etapa, segundos, cantidad=1):
+        etiquetas = self.etiquetasActuales()
+        clave = (etapa,) + tuple(etiquetas[etiqueta] for etiqueta in ETIQUETAS)
+        with self._lock:
+            medicion = self._mediciones.get(clave)
+            if medicion is None:
+                self._mediciones[clave] = [cantidad, segundos]
+            else:
+                medicion[0] += cantidad
+                medicion[1] += segundos
+
+    def mediciones(self):
+        """Retorna la lista de mediciones [{etapa, empresa, medidor, ramal, archivo, cantidad, segundos}]"""
+        with self._lock:
+            items = list(self._mediciones.items())
+        return [dict(zip(('etapa',) + ETIQUETAS, clave), cantidad=cantidad, segundos=segundos)
+                for clave, (cantidad, segundos) in items]
+
+    def resumen(self) -> dict:
+        """Retorna por cada etapa la cantidad, los segundos totales y los percentiles de los segundos por archivo
+        (o por la menor unidad etiquetada en la que se midió la etapa)
+        """
+        muestras = {}
+        for medicion in self.mediciones():
+            muestras.setdefault(medicion['etapa'], []).append(medicion)
+        resumen = {}
+        for etapa in sorted(muestras, key=lambda e: ETAPAS.index(e) if e in ETAPAS else len(ETAPAS)):
+            segundos = sorted(medicion['segundos'] for medicion in muestras[etapa])
+            resumen[etapa] = {'cantidad': sum(medicion['cantidad'] for medicion in muestras[etapa]),
+                              'segundos': sum(segundos),
+                              'muestras': len(segundos),
+                              'p50': _percentil(segundos, 50),
+                              'p90': _percentil(segundos, 90),
+                              'p99': _percentil(segundos, 99),
+                              'maximo': segundos[-1]}
+        return resumen
+
+    def logResumen(self):
+        logging.info("==========================================================================================")
+        logging.info(f"Tiempos por etapa (duración total de la ejecución: {time.time() - self.inicio:.2f} s)")
+        for etapa, datos in self.resumen().items():
+            logging.info(f"{etapa:<11} cantidad: {datos['cantidad']:>8} - total: {datos['segundos']:>9.2f} s - "
+                         f"p50: {datos['p50'] * 1000:.1f} ms - p90: {datos['p90'] * 1000:.1f} ms - "
+                         f"p99: {datos['p99'] * 1000:.1f} ms - máx: {datos['maximo'] * 1000:.1f} ms")
+
+    def guardarJSON(self, archivo):
+        """Guarda el resumen por etapa y todas las mediciones en formato JSON"""
+        with open(archivo, 'w') as f:
+            json.dump({'inicio': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.inicio)),
+                       'duracion': time.time() - self.inicio,
+                       'etapas': self.resumen(),
+                       'mediciones': self.mediciones()}, f, indent=2)
+
+    def guardarPrometheus(self, archivo):
+        """Guarda los totales por etapa y empresa en el formato de texto de Prometheus (ej: para el textfile
+        collector de node_exporter), sin las etiquetas de medidor, ramal y archivo para no multiplicar las series.
+        Como el archivo se reescribe en cada ejecución los valores son gauges de la última ejecución
+        """
+        totales = {}
+        for medicion in self.mediciones():
+            total = totales.setdefault((medicion['etapa'], medicion['empresa']), [0, 0.0])
+            total[0] += medicion['cantidad']
+            total[1] += medicion['segundos']
+        lineas = ["# HELP telemedicion_etapa_segundos Segundos de cada etapa en la última ejecución del proceso de lecturas",
+                  "# TYPE telemedicion_etapa_segundos gauge"]
+        lineas.extend(f"telemedicion_etapa_segundos{_etiquetasPrometheus(etapa, empresa)} {segundos:.6f}"
+                      for (etapa, empresa), (_, segundos) in sorted(totales.items(), key=str))
+        lineas.extend(["# HELP telemedicion_etapa_cantidad Cantidad procesada en cada etapa en la última ejecución del proceso de lecturas",
+                       "# TYPE telemedicion_etapa_cantidad gauge"])
+        lineas.extend(f"telemedicion_etapa_cantidad{_etiquetasPrometheus(etapa, empresa)} {cantidad}"
+                      for (etapa, empresa), (cantidad, _) in sorted(totales.items(), key=str))
+        lineas.extend(["# HELP telemedicion_ultima_ejecucion_segundos Duración de la última ejecución",
+                       "# TYPE telemedicion_ultima_ejecucion_segundos gauge",
+                       f"telemedicion_ultima_ejecucion_segundos {time.time() - self.inicio:.6f}"])
+        #Escribir en un temporal y renombrarlo para que el collector nunca lea un archivo a medio escribir
+        temporal = f"{archivo}.tmp"
+        with open(temporal, 'w') as f:
+            f.write('\n'.join(lineas) + '\n')
+        os.replace(temporal, archivo)
+
+
+
+
+class _Medicion():
+    '''Context manager que registra el tiempo transcurrido en la etapa'''
+    __slots__ = ('_registro', '_etapa', '_cantidad', '_inicio')
+
+    def __init__(self, registro, etapa, cantidad):
+        self._registro = registro
+        self._etapa = etapa
+        self._cantidad = cantidad
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._registro.registrar(self._etapa, time.perf_counter() - self._inicio, self._cantidad)
+
+
+class _SinMedicion():
+    '''Context manager que no hace nada, utilizado cuando las mediciones están desactivadas'''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_SIN_MEDICION = _SinMedicion()
+
+
+
+
+def activar() -> RegistroMetricas:
+    global registro
+    registro = RegistroMetricas()
+    return registro
+
+
+def desactivar():
+    global registro
+    registro = None
+
+
+def medir(etapa, cantidad=1):
+    """Retorna un context manager que registra la duración del bloque en la etapa indicada"""
+    if registro is None:
+        return _SIN_MEDICION
+    return _Medicion(registro, etapa, cantidad)
+
+
+def etiquetar(**etiquetas):
+    """Cambia las etiquetas del hilo actual (empresa, medidor, ramal, archivo) para las siguientes mediciones"""
+    if registro is not None:
+        registro.etiquetasActuales().update(etiquetas)
+
+
+def etiquetasActuales() -> dict:
+    """Retorna una copia de las etiquetas del hilo actual, para utilizarlas en otro hilo (ver enEtiquetas)"""
+    if registro is None:
+        return {}
+    return dict(registro.etiquetasActuales())
+
+
+def enEtiquetas(etiquetas, funcion, *args, **kwargs):
+    """Ejecuta la función con las etiquetas indicadas (ej: en los hilos de descargas paralelas)"""
+    etiquetar(**etiquetas)
+    return funcion(*args, **kwargs)
+
+
+def _percentil(valoresOrdenados, porcentaje):
+    return valoresOrdenados[min(len(valoresOrdenados) - 1, int(round(porcentaje / 100 * (len(valoresOrdenados) - 1))))]
+
+
+def _etiquetasPrometheus(etapa, empresa):
+    etiquetas = {'etapa': etapa}
+    if empresa is not None:
+        etiquetas['empresa'] = empresa
+    return '{' + ','.join(f'{nombre}="{_escaparPrometheus(valor)}"' for nombre, valor in etiquetas.items()) + '}'
+
+
+def _escaparPrometheus(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
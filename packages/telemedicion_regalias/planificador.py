@@ -0,0 +1,98 @@
+'''
+Planificación de las lecturas de cada empresa en el modo daemon: cada empresa tiene su propio intervalo entre
+lecturas (ej: cada hora para las que actualizan los archivos en forma horaria, diario para el resto), con una
+variación aleatoria (jitter) para no conectarse a todos los servidores en el mismo instante, y una espera
+creciente (backoff) para las empresas cuyas lecturas fallan
+
+Los instantes se manejan con time.monotonic(), por lo que no se ven afectados por los cambios de hora del sistema
+'''
+
+import heapq
+import random
+import time
+
+
+class PlanificadorEmpresas():
+    '''
+    Mantiene el próximo instante de lectura de cada empresa.
+    Las empresas pendientes se retiran con pendientes() y se vuelven a planificar con finalizar() al terminar su
+    lectura, por lo que una empresa nunca se procesa dos veces a la vez
+    '''
+
+    def __init__(self, intervalo, intervalos=None, jitter=0.1, esperaMaxima=6 * 3600):
+        self.intervalo = intervalo   #Segundos entre lecturas de las empresas sin intervalo propio
+        self.intervalos = dict(intervalos or {})   #{empresaId: segundos} intervalo propio de cada empresa
+        self.jitter = jitter   #Fracción del intervalo que se suma o resta al azar a cada espera
+        #Tope de la espera después de errores consecutivos, las empresas con un intervalo mayor mantienen su intervalo
+        self.esperaMaxima = esperaMaxima
+        self._empresas = set()   #Empresas a procesar, según la última actualización
+        self._proximas = []   #Heap de (instante, empresaId)
+        self._planificadas = {}   #{empresaId: instante}, las empresas en proceso no están planificadas
+        self._enProceso = set()
+        self._fallos = {}   #{empresaId: cantidad de errores consecutivos}
+
+    def intervaloEmpresa(self, empresaId) -> float:
+        return self.intervalos.get(empresaId, self.intervalo)
+
+    def actualizarEmpresas(self, idsEmpresas, ahora=None):
+        """Planifica para el instante actual las empresas nuevas y quita las que ya no se deben procesar"""
+        ahora = time.monotonic() if ahora is None else ahora
+        self._empresas = idsEmpresas = set(idsEmpresas)
+        for empresaId in list(self._planificadas):
+            if (empresaId not in idsEmpresas):
+                #La entrada del heap se descarta al retirarla
+                del self._planificadas[empresaId]
+                self._fallos.pop(empresaId, None)
+        for empresaId in sorted(idsEmpresas):
+            if (empresaId not in self._planificadas) and (empresaId not in self._enProceso):
+                self._planificar(empresaId, ahora)
+
+    def proximaEjecucion(self):
+        """Retorna el instante de la próxima lectura planificada, None si no hay empresas planificadas"""
+        while self._proximas:
+            instante, empresaId = self._proximas[0]
+            if (self._planificadas.get(empresaId) == instante):
+                return instante
+            heapq.heappop(self._proximas)
+        return None
+
+    def pendientes(self, ahora=None, limite=None) -> list:
+        """Retira y retorna las empresas cuya lectura ya está vencida (como máximo limite), en orden de vencimiento"""
+        ahora = time.monotonic() if ahora is None else ahora
+        empresas = []
+        while (limite is None) or (len(empresas) < limite):
+            instante = self.proximaEjecucion()
+            if (instante is None) or (instante > ahora):
+                break
+            _, empresaId = heapq.heappop(self._proximas)
+            del self._planificadas[empresaId]
+            self._enProceso.add(empresaId)
+            empresas.append(empresaId)
+        return empresas
+
+    def finalizar(self, empresaId, exito, ahora=None):
+        """Vuelve a planificar la empresa después de su lectura y retorna los segundos hasta la siguiente, None si 
+        la empresa se quitó mientras se procesaba.
+        Después de un error la espera se duplica por cada error consecutivo, hasta esperaMaxima"""
+        ahora = time.monotonic() if ahora is None else ahora
+        self._enProceso.discard(empresaId)
+        if (empresaId not in self._empresas):
+            self._fallos.pop(empresaId, None)
+            return None
+        intervalo = self.intervaloEmpresa(empresaId)
+        if (exito):
+            self._fallos.pop(empresaId, None)
+            espera = intervalo
+        else:
+            fallos = self._fallos[empresaId] = self._fallos.get(empresaId, 0) + 1
+            espera = min(intervalo * 2 ** fallos, max(intervalo, self.esperaMaxima))
+        espera *= 1 + random.uniform(-self.jitter, self.jitter)
+        self._planificar(empresaId, ahora + espera)
+        return espera
+
+    def fallosConsecutivos(self, empresaId) -> int:
+        return self._fallos.get(empresaId, 0)
+
+    def _planificar(self, empresaId, instante):
+        self._planificadas[empresaId] = instante
+        heapq.heappush(self._proximas, (instante, empresaId))
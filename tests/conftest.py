@@ -0,0 +1,94 @@
+'''
+Fixtures de las pruebas: base SQLite en memoria con el esquema del modelo y los servidores locales del benchmark
+(ver varios/benchmark_ingesta), y una empresa con un medidor de un ramal para importar archivos RES11
+'''
+
+import sys
+import json
+from datetime import datetime
+from pathlib import Path
+
+DIR_PROYECTO = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(DIR_PROYECTO / 'packages'), str(DIR_PROYECTO), str(DIR_PROYECTO / 'varios')]
+
+import pytest
+from sqlalchemy import text
+
+import benchmark_ingesta
+from telemedicion_regalias import base, metricas
+from telemedicion_regalias.empresa import Empresa, Conexion_Empresa
+from telemedicion_regalias.medidor_fiscal import MedidorFiscal, TipoMedidorFiscal
+from telemedicion_regalias.lectura_res11 import ArchivoLecturaRes11
+
+
+ENCABEZADO = benchmark_ingesta.ENCABEZADO_RES11
+NOMBRE_ARCHIVO = "EMP001_M001_1_01062021_RES11_DIR_REGALIAS.txt"
+
+
+@pytest.fixture
+def session():
+    benchmark_ingesta.initBaseSQLite()
+    session = base.session
+    ahora = datetime(2021, 1, 1)
+    usuario = benchmark_ingesta.USUARIO
+    session.add(TipoMedidorFiscal(id=1, nombre='PRUEBA', _descripcion='Medidor de prueba',
+                                  _campos_lectura=json.dumps(benchmark_ingesta.CAMPOS_LECTURA),
+                                  usuario_alta=usuario, fecha_alta=ahora, usuario_ult_mod=usuario, fecha_ult_mod=ahora))
+    session.add(Empresa(id=1, cuit='30000000001', codigo='EMP001', nombre='EMPRESA EMP001', fecha_alta=ahora, usuario_alta=usuario))
+    session.add(Conexion_Empresa(id=1, _empresa_id=1, _protocolo='SFTP', _host='127.0.0.1', _port=22,
+                                 _usuario=usuario, _password=benchmark_ingesta.PASSWORD, _prefijo_archivos='EMP001',
+                                 _directorio_remoto='/EMP001', usuario_alta=usuario, fecha_alta=ahora,
+                                 usuario_ult_mod=usuario, fecha_ult_mod=ahora))
+    session.add(MedidorFiscal(id=1, empresa_id=1, _tipo_medidor_id=1, codigo='M001', descripcion='Medidor 1',
+                              _cant_ramales=1, envia_telemetria=True, usuario_alta=usuario, fecha_alta=ahora,
+                              usuario_ult_mod=usuario, fecha_ult_mod=ahora))
+    session.commit()
+    yield session
+    metricas.desactivar()
+    base.cerrarSQLAlchemy()
+
+
+@pytest.fixture
+def medidor(session):
+    return session.get(MedidorFiscal, 1)
+
+
+@pytest.fixture
+def servidorSFTP(session, tmp_path):
+    """Servidor SFTP local con el directorio remoto de la empresa, la conexión de la empresa apunta a él.
+    Retorna el directorio remoto"""
+    dirEmpresa = tmp_path / 'remoto' / 'EMP001'
+    dirEmpresa.mkdir(parents=True)
+    session.get(Conexion_Empresa, 1)._port = benchmark_ingesta.iniciarServidorSFTP(dirEmpresa.parent)
+    session.commit()
+    return dirEmpresa
+
+
+def nuevoArchivo(session, medidor, nombre=NOMBRE_ARCHIVO):
+    archivo = ArchivoLecturaRes11(medidor_id=medidor.id, nombre=nombre, tamanio=0, fecha_creacion=datetime(2021, 6, 1),
+                                  cantidad_registros=0, cantidad_registros_ok=0, cantidad_registros_err=0, medidor=medidor)
+    session.add(archivo)
+    return archivo
+
+
+def escribirArchivo(ruta, lineas, finLinea='\n', encabezado=ENCABEZADO):
+    """Escribe el archivo RES11 con el encabezado y las líneas indicadas, cada una terminada en finLinea"""
+    Path(ruta).write_bytes(''.join(f"{linea}{finLinea}" for linea in [encabezado] + list(lineas)).encode('iso-8859-15'))
+    return ruta
+
+
+def volcarLecturas(session):
+    """Retorna las lecturas, los errores y los totales de los archivos cargados, para comparar importaciones"""
+    lecturas = session.execute(text(
+        "SELECT ald_nro_linea, ald_fecha_hora, ald_instalacion, ald_medidor, ald_tiene_errores, ald_temperatura, ald_presion, "
+        "ald_caudal_instantaneo_gross, ald_acumulador_gross_no_resete, ald_acumulador_pusos_brutos_no, ald_factor_k_del_medidor "
+        "FROM regalias.tlm_archivos_lectura_res11_det ORDER BY ald_nro_linea")).fetchall()
+    errores = session.execute(text(
+        "SELECT d.ald_nro_linea, e.ale_temperatura, e.ale_presion, e.ale_caudal_instantaneo_gross, "
+        "e.ale_acumulador_gross_no_resete, e.ale_acumulador_pusos_brutos_no, e.ale_factor_k_del_medidor "
+        "FROM regalias.tlm_archivos_lectura_res11_err e JOIN regalias.tlm_archivos_lectura_res11_det d ON d.ald_id = e.ale_ald_id "
+        "ORDER BY d.ald_nro_linea")).fetchall()
+    archivos = session.execute(text(
+        "SELECT alc_nombre, alc_cantidad_registros, alc_cantidad_registros_ok, alc_cantidad_registros_err, alc_tamanio, alc_hash "
+        "FROM regalias.tlm_archivos_lectura_res11_cab ORDER BY alc_nombre")).fetchall()
+    return [tuple(fila) for fila in lecturas], [tuple(fila) for fila in errores], [tuple(fila) for fila in archivos]
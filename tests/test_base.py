@@ -0,0 +1,95 @@
+'''
+Pruebas de las sesiones de SQLAlchemy (base)
+'''
+
+import logging
+import threading
+
+import pytest
+from sqlalchemy import inspect
+
+from conftest import nuevoArchivo
+from telemedicion_regalias import base
+from telemedicion_regalias.base import ReservaSecuencia
+from telemedicion_regalias.lectura_res11 import ArchivoLecturaRes11
+from telemedicion_regalias.medidor_fiscal import MedidorFiscal
+
+
+def test_lasSesionesExpiranLosObjetosEnCadaCommit(session):
+    with base.unidadDeTrabajo() as sesionTrabajo:
+        medidor = sesionTrabajo.get(MedidorFiscal, 1)
+        sesionTrabajo.commit()
+        assert 'codigo' in inspect(medidor).expired_attributes
+
+
+def test_sesionDeIngestaNoExpiraEnCommitPeroSiEnRollback(session):
+    with base.unidadDeTrabajo(expirarEnCommit=False) as sesionIngesta:
+        medidor = sesionIngesta.get(MedidorFiscal, 1)
+        medidor.importacionBulk = True
+        sesionIngesta.commit()
+        assert not inspect(medidor).expired_attributes
+        #Un archivo con error descarta sus cambios y expira la configuración, que se vuelve a leer de la DB
+        medidor.descripcion = 'Modificado'
+        sesionIngesta.rollback()
+        assert 'codigo' in inspect(medidor).expired_attributes
+        assert (medidor.codigo, medidor.descripcion) == ('M001', 'Medidor 1')
+        #Las opciones de la importación no son columnas, no se pierden
+        assert medidor.importacionBulk
+    #Las demás sesiones mantienen el comportamiento por defecto
+    assert base.Session().expire_on_commit
+
+
+
+def test_unidadDeTrabajoConfirmaODescarta(session):
+    with base.unidadDeTrabajo() as sesionTrabajo:
+        sesionTrabajo.get(MedidorFiscal, 1).descripcion = 'Confirmado'
+    with pytest.raises(ValueError):
+        with base.unidadDeTrabajo() as sesionTrabajo:
+            sesionTrabajo.get(MedidorFiscal, 1).descripcion = 'Descartado'
+            sesionTrabajo.flush()
+            raise ValueError('error de la unidad de trabajo')
+    session.expire_all()
+    assert session.get(MedidorFiscal, 1).descripcion == 'Confirmado'
+
+
+def test_sesionPropiaDeCadaHilo(session):
+    sesiones = []
+    hilo = threading.Thread(target=lambda: sesiones.append(base.session()) or base.session.remove())
+    hilo.start()
+    hilo.join()
+    assert sesiones[0] is not base.session()
+    assert base.session() is base.session()
+
+
+def test_parametrosDelPoolConSQLite(caplog):
+    with caplog.at_level(logging.WARNING):
+        base.initSQLAlchemy('sqlite://', poolSize=10, maxOverflow=5, reciclar=300, prePing=True, arraysize=500)
+    try:
+        #SQLite no utiliza un pool de tamaño fijo, sólo se aplican el reciclado y la verificación de las conexiones
+        assert (base.engine.pool._recycle, base.engine.pool._pre_ping) == (300, True)
+        assert [registro.getMessage() for registro in caplog.records] == [
+            "Los parámetros cacheSentencias, arraysize, prefetchrows y pool sólo se aplican con Oracle"]
+        assert base.session.bind is base.engine
+    finally:
+        base.cerrarSQLAlchemy()
+
+
+def test_reservaSinSecuenciaContinuaDelMaximoId(session, medidor):
+    archivo = nuevoArchivo(session, medidor)
+    archivo.id = 10
+    session.commit()
+    reserva = ReservaSecuencia.deSesion(session, ArchivoLecturaRes11.__table__.c.alc_id)
+    assert reserva.reservar(3) == [11, 12, 13]
+    assert reserva.reservar(2) == [14, 15]
+    #La reserva se comparte entre las inserciones de la sesión
+    assert ReservaSecuencia.deSesion(session, ArchivoLecturaRes11.__table__.c.alc_id) is reserva
+
+
+def test_reservasSinSecuenciaDeDistintasSesiones(session):
+    """Dos sesiones que reservan antes de insertar no obtienen los mismos valores"""
+    columna = ArchivoLecturaRes11.__table__.c.alc_id
+    with base.unidadDeTrabajo() as sesion1, base.unidadDeTrabajo() as sesion2:
+        valores1 = ReservaSecuencia.deSesion(sesion1, columna).reservar(5)
+        valores2 = ReservaSecuencia.deSesion(sesion2, columna).reservar(5)
+        valores1 += ReservaSecuencia.deSesion(sesion1, columna).reservar(5)
+    assert len(set(valores1) | set(valores2)) == 15
@@ -0,0 +1,234 @@
+'''
+Pruebas de las conexiones remotas, con los servidores locales del benchmark
+'''
+
+import json
+import socket
+from datetime import timedelta
+
+import pytest
+
+import benchmark_ingesta
+from telemedicion_regalias import conexionremota
+from telemedicion_regalias.conexionremota import ConexionFTP, ConexionFTPES, ConexionSFTP, PoolTransportsSFTP, CircuitBreakerHosts
+
+
+@pytest.fixture(params=['FTP', 'FTPES'])
+def conexionFTP(request, tmp_path):
+    pytest.importorskip('pyftpdlib')
+    tls = (request.param == 'FTPES')
+    if tls:
+        pytest.importorskip('OpenSSL')
+    dirRaiz = tmp_path / 'remoto'
+    dirRaiz.mkdir()
+    #Más grande que los buffers de los sockets, para que la transferencia no termine antes de cerrar el stream
+    (dirRaiz / 'grande.txt').write_bytes(b''.join(b'%08d;0123456789012345678901234567890123456789\n' % i for i in range(200000)))
+    (dirRaiz / 'chico.txt').write_bytes(b'linea 1\nlinea 2\nsin salto de linea')
+    conexion = (ConexionFTPES if tls else ConexionFTP)('127.0.0.1', benchmark_ingesta.iniciarServidorFTP(dirRaiz, tls))
+    conexion.timeoutLectura = 5
+    conexion.conectar(benchmark_ingesta.USUARIO, benchmark_ingesta.PASSWORD)
+    yield conexion
+    conexion.disconnect()
+
+
+def test_streamFTPLeidoCompleto(conexionFTP):
+    with conexionFTP.openFile('chico.txt') as archivo:
+        assert list(archivo) == [b'linea 1\n', b'linea 2\n', b'sin salto de linea']
+    with conexionFTP.openFile('chico.txt') as archivo:
+        assert archivo.read() == b'linea 1\nlinea 2\nsin salto de linea'
+    assert conexionFTP.connected
+
+
+def test_streamFTPCerradoSinLeerloCompleto(conexionFTP):
+    """Se cancela la transferencia sin fallar y la conexión de control sigue sincronizada con el servidor"""
+    with conexionFTP.openFile('grande.txt') as archivo:
+        assert archivo.readline() == b'00000000;0123456789012345678901234567890123456789\n'
+    assert conexionFTP.connected
+    with conexionFTP.openFile('chico.txt') as archivo:
+        assert archivo.read(7) == b'linea 1'
+    assert 'chico.txt' in conexionFTP.listDir()
+
+
+def test_streamFTPConErrorAlProcesarlo(conexionFTP):
+    """El error al procesar el archivo no queda oculto por la respuesta del servidor a la transferencia cancelada"""
+    with pytest.raises(ValueError, match='error de parseo'):
+        with conexionFTP.openFile('grande.txt') as archivo:
+            for linea in archivo:
+                raise ValueError('error de parseo')
+    with conexionFTP.openFile('chico.txt') as archivo:
+        assert archivo.read() == b'linea 1\nlinea 2\nsin salto de linea'
+
+
+
+def test_listadoUnaVezPorConexionYDirectorio(tmp_path, monkeypatch):
+    dirRaiz = tmp_path / 'remoto'
+    (dirRaiz / 'EMP001').mkdir(parents=True)
+    (dirRaiz / 'EMP001' / 'a.txt').write_bytes(b'12345')
+    (dirRaiz / 'EMP002').mkdir()
+    conexion = ConexionSFTP('127.0.0.1', benchmark_ingesta.iniciarServidorSFTP(dirRaiz))
+    listados = []
+    doListDir = conexion._doListDir
+    monkeypatch.setattr(conexion, '_doListDir', lambda: listados.append(1) or doListDir())
+    conexion.conectar(benchmark_ingesta.USUARIO, benchmark_ingesta.PASSWORD)
+    try:
+        conexion.changeDir('/EMP001')
+        listado = conexion.listDir()
+        assert (list(listado), listado['a.txt'].tamanio) == (['a.txt'], 5)
+        #El archivo agregado después de listar no se ve hasta cambiar de directorio
+        (dirRaiz / 'EMP001' / 'b.txt').write_bytes(b'')
+        assert conexion.listDir() is listado
+        assert len(listados) == 1
+        conexion.changeDir('/EMP002')
+        assert conexion.listDir() == {}
+        conexion.changeDir('/EMP001')
+        assert sorted(conexion.listDir()) == ['a.txt', 'b.txt']
+        assert len(listados) == 3
+    finally:
+        conexion.disconnect()
+
+
+
+
+def test_poolDeTransportsSFTP(tmp_path, monkeypatch):
+    """Las conexiones sucesivas al mismo host reutilizan el transport autenticado, y el que se cortó se reemplaza"""
+    (tmp_path / 'a.txt').write_bytes(b'12345')
+    port = benchmark_ingesta.iniciarServidorSFTP(tmp_path)
+    pool = PoolTransportsSFTP()
+    monkeypatch.setattr(ConexionSFTP, 'poolTransports', pool)
+
+    def conectar():
+        conexion = ConexionSFTP('127.0.0.1', port)
+        conexion.conectar(benchmark_ingesta.USUARIO, benchmark_ingesta.PASSWORD)
+        assert 'a.txt' in conexion.listDir()
+        conexion.disconnect()
+        return conexion._transport
+
+    transport = conectar()
+    assert transport.is_active()
+    assert conectar() is transport
+    transport.close()
+    otroTransport = conectar()
+    assert otroTransport is not transport
+    pool.cerrar()
+    assert not otroTransport.is_active()
+    #Sin pool cada conexión cierra su transport
+    monkeypatch.setattr(ConexionSFTP, 'poolTransports', None)
+    assert not conectar().is_active()
+
+
+
+@pytest.mark.parametrize('rangosParalelos', [1, 3])
+def test_descargaSFTPPorRangos(tmp_path, monkeypatch, rangosParalelos):
+    dirRaiz = tmp_path / 'remoto'
+    dirRaiz.mkdir()
+    contenidos = {'grande.txt': bytes(range(256)) * 4001, 'chico.txt': b'linea 1\n', 'vacio.txt': b''}
+    for nombre, contenido in contenidos.items():
+        (dirRaiz / nombre).write_bytes(contenido)
+    #Bloques y rangos chicos para que el archivo grande se divida en rangos con varios bloques y un resto
+    monkeypatch.setattr(conexionremota, 'TAMANIO_BLOQUE_RANGO_SFTP', 10000)
+    conexion = ConexionSFTP('127.0.0.1', benchmark_ingesta.iniciarServidorSFTP(dirRaiz))
+    conexion.rangosParalelos = rangosParalelos
+    conexion.tamanioMinimoRangos = 1000
+    conexion.tamanioMaximoPedido = 4096
+    porRangos = []
+    descargarRangos = conexion._descargarRangos
+    monkeypatch.setattr(conexion, '_descargarRangos', lambda nombre, *args: porRangos.append(nombre) or descargarRangos(nombre, *args))
+    conexion.conectar(benchmark_ingesta.USUARIO, benchmark_ingesta.PASSWORD)
+    try:
+        archivos = [(nombre, tmp_path / nombre) for nombre in contenidos]
+        assert list(conexion.getFiles(archivos, maxParalelas=2)) == archivos
+    finally:
+        conexion.disconnect()
+    for nombre, contenido in contenidos.items():
+        assert (tmp_path / nombre).read_bytes() == contenido, nombre
+    assert porRangos == (['grande.txt'] if rangosParalelos > 1 else [])
+
+
+def test_estadoDeLaConexionFTPSinNOOP(conexionFTP, monkeypatch):
+    comandos = []
+    voidcmd = conexionFTP._ftp.voidcmd
+    monkeypatch.setattr(conexionFTP._ftp, 'voidcmd', lambda comando: comandos.append(comando) or voidcmd(comando))
+    assert all(conexionFTP.connected for _ in range(10))
+    assert comandos == []
+    #Con keepalive se verifica la conexión después de intervaloKeepalive segundos sin actividad
+    conexionFTP.intervaloKeepalive = 0
+    assert conexionFTP.connected
+    assert comandos == ['NOOP']
+    conexionFTP.intervaloKeepalive = 3600
+    assert conexionFTP.connected
+    assert comandos == ['NOOP']
+
+
+def test_errorDeLaConexionFTPLaDesconecta(conexionFTP):
+    #Un comando rechazado por el servidor no afecta la conexión
+    with pytest.raises(Exception, match='inexistente'):
+        conexionFTP.changeDir('/inexistente')
+    assert conexionFTP.connected
+    conexionFTP._ftp.sock.shutdown(socket.SHUT_RDWR)
+    with pytest.raises(Exception, match='listar'):
+        conexionFTP.listDir()
+    assert not conexionFTP.connected
+
+
+@pytest.fixture
+def puertoCerrado():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def puertoAbierto():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        s.listen()
+        yield s.getsockname()[1]
+
+
+def _estado(archivo):
+    return {clave: datos['fallos'] for clave, datos in json.loads(archivo.read_text()).items()}
+
+
+def test_circuitBreakerSondaAlHostQueFallo(tmp_path, puertoCerrado, puertoAbierto):
+    archivo = tmp_path / 'hosts.json'
+    circuitBreaker = CircuitBreakerHosts(archivo)
+    #Sin fallos previos no se verifica el puerto
+    assert circuitBreaker.permitirConexion('127.0.0.1', puertoCerrado)
+    circuitBreaker.registrarFallo('127.0.0.1', puertoCerrado)
+    circuitBreaker.registrarFallo('127.0.0.1', puertoAbierto)
+    assert not circuitBreaker.permitirConexion('127.0.0.1', puertoCerrado)
+    assert circuitBreaker.permitirConexion('127.0.0.1', puertoAbierto)
+    #La sonda fallida cuenta como un fallo más, y el estado se conserva para la próxima ejecución
+    assert _estado(archivo) == {f"127.0.0.1:{puertoCerrado}": 2, f"127.0.0.1:{puertoAbierto}": 1}
+    assert not CircuitBreakerHosts(archivo).permitirConexion('127.0.0.1', puertoCerrado)
+    #Pasada la espera se vuelve a intentar la conexión completa
+    assert CircuitBreakerHosts(archivo, espera=timedelta(0)).permitirConexion('127.0.0.1', puertoCerrado)
+
+
+def test_circuitBreakerOlvidaElHostConectado(tmp_path, puertoCerrado):
+    archivo = tmp_path / 'hosts.json'
+    circuitBreaker = CircuitBreakerHosts(archivo)
+    circuitBreaker.registrarFallo('127.0.0.1', puertoCerrado)
+    circuitBreaker.registrarExito('127.0.0.1', puertoCerrado)
+    assert _estado(archivo) == {}
+    assert circuitBreaker.permitirConexion('127.0.0.1', puertoCerrado)
+
+
+def test_circuitBreakerConEstadoIlegible(tmp_path, puertoCerrado):
+    archivo = tmp_path / 'hosts.json'
+    archivo.write_text('{"127.0.0.1:21": ')
+    circuitBreaker = CircuitBreakerHosts(archivo)
+    assert circuitBreaker.permitirConexion('127.0.0.1', 21)
+    circuitBreaker.registrarFallo('127.0.0.1', puertoCerrado)
+    assert _estado(archivo) == {f"127.0.0.1:{puertoCerrado}": 1}
+
+
+def test_conectarConCircuitBreaker(tmp_path, puertoCerrado):
+    """La conexión que falla se registra, el siguiente intento falla sin intentar la conexión completa"""
+    conexion = ConexionFTP('127.0.0.1', puertoCerrado)
+    conexion.circuitBreaker = CircuitBreakerHosts(tmp_path / 'hosts.json')
+    with pytest.raises(ConnectionRefusedError):
+        conexion.conectar(benchmark_ingesta.USUARIO, benchmark_ingesta.PASSWORD)
+    with pytest.raises(ConnectionError, match='falló recientemente'):
+        conexion.conectar(benchmark_ingesta.USUARIO, benchmark_ingesta.PASSWORD)
+    assert _estado(tmp_path / 'hosts.json') == {f"127.0.0.1:{puertoCerrado}": 2}
@@ -0,0 +1,64 @@
+'''
+Pruebas de los filtros de la conexión de la empresa y del parser de fecha y hora de las lecturas
+'''
+
+from datetime import datetime
+
+import pytest
+
+from telemedicion_regalias.empresa import ParserFechaHora, Conexion_Empresa, DEFAULT_FORMATO_FECHA, DEFAULT_FORMATO_HORA
+
+
+def _strptime(texto, formato):
+    try:
+        return datetime.strptime(texto, formato)
+    except ValueError:
+        return ValueError
+
+
+def _parsear(parser, texto):
+    try:
+        return parser.parsear(texto)
+    except ValueError:
+        return ValueError
+
+
+@pytest.mark.parametrize('formato, textos', [
+    ('%d/%m/%Y %H:%M:%S', ['01/06/2021 10:20:30', '31/12/2021 23:59:59', '1/6/2021 10:20:30', '01/06/2021 1:02:03',
+                           '32/06/2021 10:20:30', '29/02/2021 10:20:30', '01/06/2021 24:00:00', '01-06-2021 10:20:30',
+                           '0a/06/2021 10:20:30', ' 1/06/2021 10:20:30', '+1/06/2021 10:20:30', '01/06/2021 10:20:3０',
+                           '01/06/2021 10:20', '', '01/06/2021 10:20:30 ']),
+    ('%Y-%m-%d %H:%M', ['2021-06-01 10:20', '2021-6-1 10:20', '2021-06-01 10:60', '2021/06/01 10:20']),
+    ('%d%m%Y %H%M%S', ['01062021 102030', '1062021 102030']),
+    ('%d/%m/%y %H:%M:%S', ['01/06/21 10:20:30']),
+    ('%d/%b/%Y %H:%M:%S', ['01/Jun/2021 10:20:30', '01/06/2021 10:20:30']),
+])
+def test_parserFechaHoraIgualAStrptime(formato, textos):
+    parser = ParserFechaHora(formato)
+    for texto in textos:
+        assert _parsear(parser, texto) == _strptime(texto, formato), texto
+
+
+@pytest.mark.parametrize('formato, rapido, largo', [
+    ('%d/%m/%Y %H:%M:%S', True, 19),
+    ('%Y-%m-%d %H:%M', True, 16),
+    ('%Y%m%d', True, 8),
+    ('%d/%m/%y %H:%M:%S', False, None),
+    ('%d/%b/%Y %H:%M:%S', False, None),
+    #Sin día no se puede armar la fecha, y los campos repetidos no se pueden recortar
+    ('%Y-%m', False, None),
+    ('%d/%m/%Y %d', False, None),
+])
+def test_parserFechaHoraRapido(formato, rapido, largo):
+    parser = ParserFechaHora(formato)
+    assert (parser.rapido, parser.largo) == (rapido, largo)
+
+
+def test_filtrosConexionCompiladosUnaVez():
+    conexion = Conexion_Empresa(_filtros='{"formatoFecha": "%Y-%m-%d"}')
+    otra = Conexion_Empresa(_filtros='{"formatoFecha": "%Y-%m-%d"}')
+    assert conexion.filtrosConexion is otra.filtrosConexion
+    assert conexion.filtrosConexion.parserFechaHora.formato == f"%Y-%m-%d {DEFAULT_FORMATO_HORA}"
+    assert Conexion_Empresa(_filtros=None).filtrosConexion.parserFechaHora.formato == f"{DEFAULT_FORMATO_FECHA} {DEFAULT_FORMATO_HORA}"
+    with pytest.raises(Exception, match='JSON'):
+        Conexion_Empresa(_filtros='{formatoFecha').filtrosConexion
@@ -0,0 +1,109 @@
+'''
+Pruebas de la importación de archivos RES11 (ArchivoLecturaRes11.importarLecturas)
+'''
+
+import logging
+
+import pytest
+
+from conftest import nuevoArchivo, escribirArchivo, volcarLecturas, ENCABEZADO
+from telemedicion_regalias import lectura_res11
+from telemedicion_regalias.empresa import ParserFechaHora
+from telemedicion_regalias.lectura_res11 import (PL_REFLEXIVO, PL_COMPILADO, PL_COLUMNAR, LecturaMedidorRes11,
+                                                 ParserLecturaRes11)
+
+
+def linea(hora, temperatura='30.0', presion='-0.1', pulsos='4700017', fecha='01/06/2021'):
+    return f"{fecha};{hora};M001                ;1         ;{temperatura};{presion};0.3;470001.7;{pulsos};100000"
+
+
+def _parsersResumen():
+    parsers = [PL_REFLEXIVO, PL_COMPILADO]
+    if lectura_res11.np is not None:
+        parsers.append(PL_COLUMNAR)
+    return parsers
+
+
+@pytest.mark.parametrize('mapear', [False, True])
+@pytest.mark.parametrize('parser', _parsersResumen())
+def test_retomarArchivoQueCrecioConUnaLineaIncompleta(session, medidor, tmp_path, monkeypatch, parser, mapear):
+    """Una línea cortada mientras se escribía el archivo no se carga, se carga completa al retomar el archivo"""
+    if mapear:
+        if (parser != PL_COLUMNAR):
+            pytest.skip("El archivo sólo se mapea en memoria con el parser columnar")
+        monkeypatch.setattr(lectura_res11, 'TAMANIO_MINIMO_MMAP', 0)
+    ruta = tmp_path / 'archivo.txt'
+    completas = [linea('00:00:00'), linea('01:00:00'), linea('02:00:00')]
+    escribirArchivo(ruta, completas)
+    cortada = linea('03:00:00', temperatura='31.5')
+    with open(ruta, 'ab') as f:
+        f.write(cortada[:-12].encode('iso-8859-15'))
+    archivo = nuevoArchivo(session, medidor)
+    archivo.importarLecturas(ruta, parser=parser)
+    session.commit()
+    assert archivo.cantidad_registros == 3
+    assert archivo.tamanio == len(f"{ENCABEZADO}\n" + ''.join(f"{l}\n" for l in completas))
+
+    #El medidor termina de escribir la línea y agrega otra
+    with open(ruta, 'ab') as f:
+        f.write(f"{cortada[-12:]}\n{linea('04:00:00')}\n".encode('iso-8859-15'))
+    archivo.importarLecturas(ruta, parser=parser)
+    session.commit()
+    lecturas, errores, _ = volcarLecturas(session)
+    assert [fila[0] for fila in lecturas] == [1, 2, 3, 4, 5]
+    assert lecturas[3][4:6] == (0, 31.5)
+    assert not errores
+    assert (archivo.cantidad_registros, archivo.cantidad_registros_ok, archivo.cantidad_registros_err) == (5, 5, 0)
+    assert archivo.tamanio == ruta.stat().st_size
+
+
+def test_archivoSinLineasCompletas(session, medidor, tmp_path):
+    ruta = tmp_path / 'archivo.txt'
+    ruta.write_bytes(ENCABEZADO.encode('iso-8859-15'))
+    archivo = nuevoArchivo(session, medidor)
+    assert archivo.importarLecturas(ruta) is None
+    assert (archivo.cantidad_registros, archivo.tamanio) == (0, 0)
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+@pytest.mark.parametrize('parser', _parsersResumen())
+def test_resumenDeErroresPorCampo(session, medidor, tmp_path, caplog, parser, bulk):
+    """Los errores de cada campo van al canal de diagnóstico, el archivo informa la cantidad por campo"""
+    ruta = escribirArchivo(tmp_path / 'archivo.txt', [linea('00:00:00', temperatura='abc'), linea('01:00:00'), 
+                                                      linea('02:00:00', temperatura='x', presion=''),
+                                                      linea('03:00:00', presion='1,5,')])
+    archivo = nuevoArchivo(session, medidor)
+    with caplog.at_level(logging.INFO):
+        archivo.importarLecturas(ruta, bulk=bulk, parser=parser)
+    avisos = [registro.getMessage() for registro in caplog.records if registro.levelno == logging.WARNING]
+    assert avisos == [f"Archivo {archivo.nombre}: 3 lecturas con valores erróneos, cantidad de valores erróneos por campo: "
+                      "temperatura=2, presion=2"]
+
+
+def test_sinErroresNoHayResumenDeErrores(session, medidor, tmp_path, caplog):
+    ruta = escribirArchivo(tmp_path / 'archivo.txt', [linea('00:00:00'), linea('01:00:00')])
+    with caplog.at_level(logging.INFO):
+        nuevoArchivo(session, medidor).importarLecturas(ruta)
+    assert not [registro for registro in caplog.records if registro.levelno >= logging.WARNING]
+
+
+@pytest.mark.parametrize('parser', [PL_REFLEXIVO, PL_COMPILADO])
+def test_fechaHoraParseadaUnaVezPorLinea(session, medidor, tmp_path, monkeypatch, parser):
+    """Las líneas no posteriores a la última lectura cargada se descartan sin parsear el resto de sus campos"""
+    llamadas = {'fechaHora': 0, 'linea': 0}
+
+    def contar(clave, funcion):
+        def contada(*args, **kwargs):
+            llamadas[clave] += 1
+            return funcion(*args, **kwargs)
+        return contada
+    monkeypatch.setattr(ParserFechaHora, 'parsear', contar('fechaHora', ParserFechaHora.parsear))
+    monkeypatch.setattr(ParserLecturaRes11, 'parsear', contar('linea', ParserLecturaRes11.parsear))
+    monkeypatch.setattr(LecturaMedidorRes11, 'rellenarCamposFromLineaArchivo', 
+                        contar('linea', LecturaMedidorRes11.rellenarCamposFromLineaArchivo))
+    ruta = escribirArchivo(tmp_path / 'archivo.txt', [linea('01:00:00'), linea('02:00:00'), '', linea('00:30:00'), 
+                                                      linea('02:00:00', temperatura='abc'), linea('03:00:00')])
+    archivo = nuevoArchivo(session, medidor)
+    archivo.importarLecturas(ruta, parser=parser)
+    assert llamadas == {'fechaHora': 5, 'linea': 3}
+    assert (archivo.cantidad_registros, archivo.cantidad_registros_err) == (3, 0)
@@ -0,0 +1,100 @@
+'''
+Pruebas del proceso de lecturas (lectura_telemedicion)
+'''
+
+import logging
+import queue
+import socket
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+import benchmark_ingesta
+import lectura_telemedicion
+from conftest import escribirArchivo, NOMBRE_ARCHIVO
+from test_lectura_res11 import linea
+from lectura_telemedicion import _QueueHandlerDiferido, consultaEmpresasAProcesar, procesarEmpresaEnWorker
+from telemedicion_regalias.empresa import Empresa, Conexion_Empresa
+from telemedicion_regalias.medidor_fiscal import MedidorFiscal
+from telemedicion_regalias.lectura_res11 import PL_REFLEXIVO
+
+
+@pytest.fixture
+def loggerEncolado():
+    cola = queue.SimpleQueue()
+    logger = logging.getLogger('pruebas.encolado')
+    handler = _QueueHandlerDiferido(cola)
+    logger.addHandler(handler)
+    logger.propagate = False
+    yield logger, cola
+    logger.removeHandler(handler)
+
+
+def test_elMensajeSeArmaAlEncolarlo(loggerEncolado):
+    """El listener formatea el registro en otro hilo, los argumentos se pueden modificar después de loguearlos"""
+    logger, cola = loggerEncolado
+    valores = {'temperatura': '30.0'}
+    logger.warning("Valores %s", valores)
+    valores['temperatura'] = 'modificado'
+    registro = cola.get_nowait()
+    assert (registro.msg, registro.args) == ("Valores {'temperatura': '30.0'}", None)
+    assert logging.Formatter('%(levelname)s %(message)s').format(registro) == "WARNING Valores {'temperatura': '30.0'}"
+
+
+def test_laExcepcionSeFormateaAlEncolarla(loggerEncolado):
+    logger, cola = loggerEncolado
+    try:
+        raise ValueError('valor inválido')
+    except ValueError:
+        logger.exception("Error %d", 1)
+    registro = cola.get_nowait()
+    assert registro.exc_info is None
+    assert 'ValueError: valor inválido' in registro.exc_text
+    assert logging.Formatter().format(registro).startswith("Error 1\nTraceback")
+
+
+def _nuevaEmpresa(session, empresaId, port, medidores):
+    """Empresa con una conexión SFTP al puerto indicado y los medidores [(id, codigo, enviaTelemetria)]"""
+    usuario = benchmark_ingesta.USUARIO
+    ahora = datetime(2021, 1, 1)
+    codigo = f"EMP{empresaId:03d}"
+    session.add(Empresa(id=empresaId, cuit=f"3000000000{empresaId}", codigo=codigo, nombre=f"EMPRESA {codigo}", 
+                        fecha_alta=ahora, usuario_alta=usuario))
+    session.add(Conexion_Empresa(id=empresaId, _empresa_id=empresaId, _protocolo='SFTP', _host='127.0.0.1', _port=port,
+                                 _usuario=usuario, _password=benchmark_ingesta.PASSWORD, _prefijo_archivos=codigo,
+                                 _directorio_remoto=f"/{codigo}", usuario_alta=usuario, fecha_alta=ahora,
+                                 usuario_ult_mod=usuario, fecha_ult_mod=ahora))
+    for medidorId, codigoMedidor, enviaTelemetria in medidores:
+        session.add(MedidorFiscal(id=medidorId, empresa_id=empresaId, _tipo_medidor_id=1, 
+                                  codigo=codigoMedidor, descripcion=codigoMedidor, _cant_ramales=1, 
+                                  envia_telemetria=enviaTelemetria, usuario_alta=usuario, fecha_alta=ahora,
+                                  usuario_ult_mod=usuario, fecha_ult_mod=ahora))
+
+
+def test_empresasProcesadasEnWorkers(session, servidorSFTP, tmp_path, monkeypatch):
+    """Cada empresa se procesa con su propia sesión, y el error de conexión de una no afecta a las demás"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        puertoCerrado = s.getsockname()[1]
+    _nuevaEmpresa(session, 2, puertoCerrado, [(2, 'M002', True)])
+    _nuevaEmpresa(session, 3, session.get(Conexion_Empresa, 1).port, [(3, 'M003', False)])
+    session.commit()
+    escribirArchivo(servidorSFTP / NOMBRE_ARCHIVO, [linea('00:00:00'), linea('01:00:00')])
+    monkeypatch.setattr(lectura_telemedicion.config, 'DIR_DESCARGAS', tmp_path, raising=False)
+
+    empresas = consultaEmpresasAProcesar(session).all()
+    assert [(empresa.id, [medidor.codigo for medidor in empresa.medidores]) for empresa in empresas] == [
+        (1, ['M001']), (2, ['M002']), (3, [])]
+    ultimasLecturas = MedidorFiscal.getUltimasLecturasRamales(session, [medidor for empresa in empresas for medidor in empresa.medidores])
+    session.close()
+    args = Namespace(bulk=False, parser=PL_REFLEXIVO, streaming=False, ventanaDias=1, descargasParalelas=1, marcasLectura=False)
+    #La base SQLite de las pruebas comparte una única conexión, por lo que las empresas se procesan de a una
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        resultados = {empresaId: executor.submit(procesarEmpresaEnWorker, empresaId, args, ultimasLecturas).result() 
+                      for empresaId in (1, 2)}
+    assert (resultados[1].estado(), resultados[1].cantMedidores, resultados[1].cantArchivosOk) == ('OK', 1, 1)
+    assert resultados[2].estado().startswith('ERROR')
+    assert resultados[2].cantArchivosOk == 0
+    assert session.get(MedidorFiscal, 1).getFechaHoraUltimaLecturaRamal(1) == datetime(2021, 6, 1, 1)
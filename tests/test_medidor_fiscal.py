@@ -0,0 +1,206 @@
+'''
+Pruebas de MedidorFiscal
+'''
+
+import json
+import os
+from datetime import date, datetime
+
+import pytest
+from jsonschema import ValidationError
+from sqlalchemy import delete
+
+from conftest import nuevoArchivo, escribirArchivo, volcarLecturas, NOMBRE_ARCHIVO
+from test_lectura_res11 import linea
+from telemedicion_regalias import medidor_fiscal
+from telemedicion_regalias.conexionremota import InfoArchivoRemoto
+from telemedicion_regalias.medidor_fiscal import MedidorFiscal, TipoMedidorFiscal, _archivoSinCambios
+from telemedicion_regalias.lectura_res11 import ArchivoLecturaRes11, LecturaMedidorRes11, PL_REFLEXIVO, PL_COMPILADO
+
+
+#Fecha de modificación de los archivos del servidor
+MODIFICACION = datetime(2021, 6, 1, 12, 30).timestamp()
+
+
+def test_opcionesPorDefectoDeMedidoresLeidosDeLaDB(session):
+    """Los medidores obtenidos con una consulta (sin pasar por __init__) tienen las opciones de importación"""
+    session.expunge_all()
+    medidor = session.query(MedidorFiscal).filter(MedidorFiscal.codigo == 'M001').one()
+    assert medidor.dirDescargas == ''
+    assert (medidor.importacionBulk, medidor.parserLecturas, medidor.descargaStreaming) == (False, PL_REFLEXIVO, False)
+    assert (medidor.maxDiasXEjecucion, medidor.descargasParalelas) == (1, 1)
+    assert (medidor.ultimasLecturas, medidor.usarMarcasLectura) == (None, False)
+
+
+
+def test_estructuraCamposCompiladaUnaVez(session):
+    tipo = session.get(TipoMedidorFiscal, 1)
+    otroTipo = TipoMedidorFiscal(_campos_lectura=tipo._campos_lectura)
+    estructura = tipo.estructuraCampos
+    assert otroTipo.estructuraCampos is estructura is tipo.estructuraCampos
+    assert estructura.nombresCampos[:2] == ('fecha', 'hora')
+    with pytest.raises(TypeError):
+        estructura.campos['fecha'] = False
+    #Si se modifican los campos del tipo se compila la nueva estructura
+    campos = dict(estructura.campos)
+    del campos['factor_k_del_medidor']
+    tipo._campos_lectura = json.dumps(campos)
+    assert tipo.estructuraCampos is not estructura
+    assert tipo.estructuraCampos.nombresCampos == estructura.nombresCampos[:-1]
+    otroTipo._campos_lectura = json.dumps(dict(campos, fecha='si'))
+    with pytest.raises(ValidationError):
+        otroTipo.estructuraCampos
+
+
+def _descargarArchivos(medidor, tmp_path):
+    """Procesa el primer ramal del medidor con una nueva conexión (y por lo tanto un nuevo listado del directorio)"""
+    medidor.dirDescargas = tmp_path
+    conexion = medidor.empresa.conexion
+    conexion.connectServer()
+    try:
+        return medidor.cargarNuevasLecturasXRamal(1)
+    finally:
+        conexion.disconnectServer()
+
+
+def test_archivoSinCambiosNoSeDescarga(session, medidor, servidorSFTP, tmp_path):
+    """El archivo termina en una línea incompleta, por lo que el tamaño importado es menor al del servidor: 
+    se omite por su fecha de modificación"""
+    ruta = escribirArchivo(servidorSFTP / NOMBRE_ARCHIVO, [linea('00:00:00'), linea('01:00:00')])
+    with open(ruta, 'ab') as f:
+        f.write(linea('02:00:00')[:-12].encode('iso-8859-15'))
+    os.utime(ruta, (MODIFICACION, MODIFICACION))
+    assert _descargarArchivos(medidor, tmp_path) == (1, 0)
+    archivo = session.query(ArchivoLecturaRes11).one()
+    assert archivo.tamanio < ruta.stat().st_size
+    assert archivo.fecha_creacion == datetime.fromtimestamp(MODIFICACION)
+
+    assert _descargarArchivos(medidor, tmp_path) == (0, 0)
+
+
+def test_archivoModificadoConElMismoTamanioSeVuelveAImportar(session, medidor, servidorSFTP, tmp_path):
+    ruta = escribirArchivo(servidorSFTP / NOMBRE_ARCHIVO, [linea('00:00:00'), linea('01:00:00')])
+    os.utime(ruta, (MODIFICACION, MODIFICACION))
+    assert _descargarArchivos(medidor, tmp_path) == (1, 0)
+
+    #El medidor reescribe el archivo con una lectura posterior en lugar de la última, sin cambiar el tamaño
+    escribirArchivo(ruta, [linea('00:00:00'), linea('02:00:00')])
+    os.utime(ruta, (MODIFICACION + 60, MODIFICACION + 60))
+    assert _descargarArchivos(medidor, tmp_path) == (1, 0)
+    assert session.query(ArchivoLecturaRes11).one().fecha_creacion == datetime.fromtimestamp(MODIFICACION + 60)
+
+
+def test_archivosPendientesHastaElPrimeroQueNoExiste(session, medidor, servidorSFTP):
+    """Se corta en el primer día sin archivo aunque existan los de días posteriores"""
+    fechas = [date(2021, 6, dia) for dia in range(1, 6)]
+    for fecha in fechas[:2] + fechas[3:4]:
+        escribirArchivo(servidorSFTP / medidor.getNombreArchivoLecturasRes11(1, fecha), [linea('00:00:00')])
+    nombresArchivos = [(fecha, medidor.getNombreArchivoLecturasRes11(1, fecha)) for fecha in fechas]
+    conexion = medidor.empresa.conexion
+    conexion.connectServer()
+    try:
+        pendientes = medidor._filtrarArchivosPendientes(nombresArchivos)
+    finally:
+        conexion.disconnectServer()
+    assert [(fecha, nombre) for fecha, nombre, _ in pendientes] == nombresArchivos[:2]
+    assert all(infoArchivo.nombre == nombre for _, nombre, infoArchivo in pendientes)
+
+
+def test_archivosPendientesSinListado(medidor, monkeypatch):
+    """Si no se puede listar el directorio se procesan todos los archivos"""
+    def listDir():
+        raise Exception('LIST no soportado')
+    monkeypatch.setattr(medidor.empresa.conexion.conexionRemota, 'listDir', listDir)
+    nombresArchivos = [(date(2021, 6, dia), f"{dia}.txt") for dia in range(1, 3)]
+    assert medidor._filtrarArchivosPendientes(nombresArchivos) == [(fecha, nombre, None) for fecha, nombre in nombresArchivos]
+
+
+def _publicarDias(medidor, directorio, dias):
+    for dia in dias:
+        fecha = f"{dia:02d}/06/2021"
+        escribirArchivo(directorio / medidor.getNombreArchivoLecturasRes11(1, date(2021, 6, dia)), 
+                        [linea('00:00:00', fecha=fecha), linea('23:00:00', fecha=fecha)])
+
+
+@pytest.mark.parametrize('descargasParalelas', [1, 3])
+def test_ventanaDeDiasPorEjecucion(session, medidor, servidorSFTP, tmp_path, descargasParalelas):
+    """Se procesan como máximo maxDiasXEjecucion días, y los siguientes en las próximas ejecuciones hasta el 
+    primero que todavía no se publicó"""
+    _publicarDias(medidor, servidorSFTP, [1, 2, 3, 4])
+    medidor.maxDiasXEjecucion = 3
+    medidor.descargasParalelas = descargasParalelas
+    assert _descargarArchivos(medidor, tmp_path) == (3, 0)
+    assert _descargarArchivos(medidor, tmp_path) == (1, 0)
+    assert _descargarArchivos(medidor, tmp_path) == (0, 0)
+    lecturas, errores, archivos = volcarLecturas(session)
+    assert medidor.getFechaHoraUltimaLecturaRamal(1) == datetime(2021, 6, 4, 23)
+    assert (len(lecturas), errores) == (8, [])
+    assert [fila[0] for fila in archivos] == [medidor.getNombreArchivoLecturasRes11(1, date(2021, 6, dia)) for dia in range(1, 5)]
+
+
+@pytest.mark.parametrize('parser', [PL_REFLEXIVO, PL_COMPILADO])
+def test_procesarArchivosSinDescargarlos(session, medidor, servidorSFTP, tmp_path, parser):
+    """El archivo leído del servidor se carga igual que descargado, sin dejar archivos en el directorio de descargas"""
+    _publicarDias(medidor, servidorSFTP, [1, 2])
+    medidor.maxDiasXEjecucion = 2
+    medidor.parserLecturas = parser
+    (tmp_path / 'descargados').mkdir()
+    assert _descargarArchivos(medidor, tmp_path / 'descargados') == (2, 0)
+    descargado = volcarLecturas(session)
+
+    session.execute(delete(LecturaMedidorRes11))
+    session.execute(delete(ArchivoLecturaRes11))
+    session.commit()
+    medidor.descargaStreaming = True
+    (tmp_path / 'streaming').mkdir()
+    assert _descargarArchivos(medidor, tmp_path / 'streaming') == (2, 0)
+    assert volcarLecturas(session) == descargado
+    assert not list((tmp_path / 'streaming').iterdir())
+
+
+def _importarRamal(session, medidor, ramal, horas, tmp_path):
+    nombre = medidor.getNombreArchivoLecturasRes11(ramal, date(2021, 6, 1))
+    ruta = escribirArchivo(tmp_path / nombre, [linea(hora) for hora in horas])
+    nuevoArchivo(session, medidor, nombre).importarLecturas(ruta)
+    session.commit()
+
+
+@pytest.mark.parametrize('maximoElementosIn', [1, 1000])
+def test_ultimasLecturasDeTodosLosRamales(session, medidor, tmp_path, monkeypatch, maximoElementosIn):
+    monkeypatch.setattr(medidor_fiscal, 'MAXIMO_ELEMENTOS_IN', maximoElementosIn)
+    medidor._cant_ramales = 2
+    otroMedidor = MedidorFiscal(id=2, empresa_id=1, _tipo_medidor_id=1, codigo='M002', descripcion='Medidor 2',
+                                _cant_ramales=1, envia_telemetria=True, usuario_alta='prueba', fecha_alta=datetime(2021, 1, 1), 
+                                usuario_ult_mod='prueba', fecha_ult_mod=datetime(2021, 1, 1))
+    session.add(otroMedidor)
+    _importarRamal(session, medidor, 1, ['00:00:00', '05:00:00'], tmp_path)
+    _importarRamal(session, medidor, 2, ['00:00:00', '03:00:00'], tmp_path)
+    medidores = [medidor, otroMedidor]
+    ultimasLecturas = {1: {1: datetime(2021, 6, 1, 5), 2: datetime(2021, 6, 1, 3)}, 2: {}}
+    assert MedidorFiscal.getUltimasLecturasRamales(session, medidores) == ultimasLecturas
+    #La marca del ramal tiene prioridad, los ramales sin marca se calculan sobre las lecturas
+    #Como al importar cada archivo, la marca sólo avanza
+    for fechaHora in (datetime(2021, 6, 1, 8), datetime(2021, 6, 1, 6)):
+        medidor._actualizarMarcaLectura(1, fechaHora)
+        session.commit()
+    assert MedidorFiscal.getUltimasLecturasRamales(session, medidores, usarMarcas=True) == {
+        1: {1: datetime(2021, 6, 1, 8), 2: datetime(2021, 6, 1, 3)}, 2: {}}
+    assert MedidorFiscal.getUltimasLecturasRamales(session, medidores) == ultimasLecturas
+    medidor.ultimasLecturas = ultimasLecturas[1]
+    assert medidor.getFechaHoraUltimaLecturaRamal(2) == datetime(2021, 6, 1, 3)
+
+
+@pytest.mark.parametrize('infoArchivo, importado, sinCambios', [
+    #Sin fecha de modificación en el servidor sólo se compara el tamaño
+    (InfoArchivoRemoto('a', 100, None), (100, None), True),
+    (InfoArchivoRemoto('a', 120, None), (100, None), False),
+    (InfoArchivoRemoto('a', None, None), (100, None), False),
+    #Con fecha de modificación el tamaño importado puede ser menor (línea incompleta al final)
+    (InfoArchivoRemoto('a', 120, datetime(2021, 6, 1, 10, 0, 0, 500)), (100, datetime(2021, 6, 1, 10)), True),
+    (InfoArchivoRemoto('a', 120, datetime(2021, 6, 1, 10, 0, 1)), (100, datetime(2021, 6, 1, 10)), False),
+    (InfoArchivoRemoto('a', 80, datetime(2021, 6, 1, 10)), (100, datetime(2021, 6, 1, 10)), False),
+    #Archivo importado antes de guardar la fecha de modificación
+    (InfoArchivoRemoto('a', 100, datetime(2021, 6, 1, 10)), (100, None), True),
+])
+def test_archivoSinCambios(infoArchivo, importado, sinCambios):
+    assert _archivoSinCambios(infoArchivo, *importado) == sinCambios
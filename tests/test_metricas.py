@@ -0,0 +1,98 @@
+'''
+Pruebas del registro de los tiempos y las cantidades de cada etapa del proceso de lecturas
+'''
+
+import json
+import threading
+
+import pytest
+
+from conftest import nuevoArchivo, escribirArchivo
+from test_lectura_res11 import linea
+from telemedicion_regalias import metricas
+from telemedicion_regalias.lectura_res11 import PL_REFLEXIVO, PL_COMPILADO
+
+
+@pytest.fixture
+def registro():
+    registro = metricas.activar()
+    yield registro
+    metricas.desactivar()
+
+
+def test_sinRegistroNoSeMide():
+    metricas.desactivar()
+    assert metricas.medir('parseo') is metricas.medir('flush')
+    with metricas.medir('parseo'):
+        metricas.etiquetar(empresa='EMP001')
+    assert metricas.etiquetasActuales() == {}
+
+
+def test_medicionesPorEtiquetas(registro):
+    metricas.etiquetar(empresa='EMP001', medidor='M001')
+    with metricas.medir('descarga', 3):
+        pass
+    registro.registrar('descarga', 2.0)
+    metricas.etiquetar(medidor='M002')
+    registro.registrar('descarga', 1.0, cantidad=5)
+    mediciones = sorted(registro.mediciones(), key=lambda medicion: medicion['medidor'])
+    assert [(m['etapa'], m['empresa'], m['medidor'], m['ramal'], m['archivo'], m['cantidad']) for m in mediciones] == [
+        ('descarga', 'EMP001', 'M001', None, None, 4), ('descarga', 'EMP001', 'M002', None, None, 5)]
+    assert 2.0 <= mediciones[0]['segundos'] < 3.0
+
+
+def test_etiquetasPropiasDeCadaHilo(registro):
+    metricas.etiquetar(empresa='EMP001', archivo='a.txt')
+    etiquetas = metricas.etiquetasActuales()
+    otroHilo = threading.Thread(target=metricas.enEtiquetas, 
+                                args=(dict(etiquetas, archivo='b.txt'), registro.registrar, 'descarga', 1.0))
+    otroHilo.start()
+    otroHilo.join()
+    registro.registrar('parseo', 1.0)
+    assert sorted((m['etapa'], m['empresa'], m['archivo']) for m in registro.mediciones()) == [
+        ('descarga', 'EMP001', 'b.txt'), ('parseo', 'EMP001', 'a.txt')]
+    assert metricas.etiquetasActuales()['archivo'] == 'a.txt'
+
+
+def test_resumenEnOrdenDeEtapas(registro):
+    for nroArchivo in range(1, 101):
+        metricas.etiquetar(archivo=f"{nroArchivo}.txt")
+        registro.registrar('commit', nroArchivo / 100)
+        registro.registrar('conexion', 0.5, cantidad=2)
+    resumen = registro.resumen()
+    assert list(resumen) == ['conexion', 'commit']
+    assert resumen['commit'] == pytest.approx({'cantidad': 100, 'segundos': 50.5, 'muestras': 100, 
+                                               'p50': 0.51, 'p90': 0.9, 'p99': 0.99, 'maximo': 1.0})
+    assert resumen['conexion']['cantidad'] == 200
+
+
+def test_guardarJSONyPrometheus(registro, tmp_path):
+    metricas.etiquetar(empresa='EMP "1"', medidor='M001')
+    registro.registrar('descarga', 1.5, cantidad=2)
+    metricas.etiquetar(medidor='M002')
+    registro.registrar('descarga', 0.5)
+    metricas.etiquetar(empresa=None)
+    registro.registrar('conexion', 0.25)
+    registro.guardarJSON(tmp_path / 'metricas.json')
+    guardado = json.loads((tmp_path / 'metricas.json').read_text())
+    assert guardado['etapas']['descarga']['cantidad'] == 3
+    assert len(guardado['mediciones']) == 3
+    registro.guardarPrometheus(tmp_path / 'metricas.prom')
+    lineas = (tmp_path / 'metricas.prom').read_text().splitlines()
+    #Los medidores de la empresa se suman en una única serie
+    assert 'telemedicion_etapa_segundos{etapa="descarga",empresa="EMP \\"1\\""} 2.000000' in lineas
+    assert 'telemedicion_etapa_cantidad{etapa="descarga",empresa="EMP \\"1\\""} 3' in lineas
+    assert 'telemedicion_etapa_cantidad{etapa="conexion"} 1' in lineas
+    assert not (tmp_path / 'metricas.prom.tmp').exists()
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+@pytest.mark.parametrize('parser', [PL_REFLEXIVO, PL_COMPILADO])
+def test_importacionMedida(session, medidor, tmp_path, parser, bulk):
+    registro = metricas.activar()
+    ruta = escribirArchivo(tmp_path / 'archivo.txt', [linea('00:00:00'), linea('01:00:00', temperatura='abc'), linea('02:00:00')])
+    nuevoArchivo(session, medidor).importarLecturas(ruta, bulk=bulk, parser=parser)
+    resumen = registro.resumen()
+    assert resumen['parseo']['cantidad'] == 3
+    assert resumen['validacion']['cantidad'] == 3
+    assert ('insercion' in resumen) == bulk
@@ -0,0 +1,119 @@
+'''
+Paridad de los parsers de líneas: la importación de un archivo con los parsers compilado, columnar y automático
+(en ORM y bulk, leyendo el archivo o mapeado en memoria) debe cargar exactamente lo mismo que el parser reflexivo:
+las lecturas, sus errores y los totales, el tamaño y el hash del archivo
+'''
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete
+
+from conftest import nuevoArchivo, escribirArchivo, volcarLecturas, ENCABEZADO
+from telemedicion_regalias import lectura_res11
+from telemedicion_regalias.lectura_res11 import (ArchivoLecturaRes11, LecturaMedidorRes11, ErrorLecturaRes11,
+                                                 PL_REFLEXIVO, PL_COMPILADO, PL_COLUMNAR, PL_AUTOMATICO,
+                                                 MINIMO_LINEAS_COLUMNAR)
+from telemedicion_regalias.medidor_fiscal import MedidorFiscal
+
+
+CHICO = MINIMO_LINEAS_COLUMNAR // 4
+GRANDE = MINIMO_LINEAS_COLUMNAR * 5 // 2
+
+#Carga del parser reflexivo de cada fixture, es la referencia de todas las configuraciones
+_esperados = {}
+
+
+def lineasArchivo(cantidad: int) -> list:
+    """Líneas de un medidor cada un minuto, con valores inválidos, campos faltantes y entre comillas, líneas
+    desordenadas o repetidas, fechas inválidas y líneas vacías intercaladas
+    """
+    lineas = []
+    fechaHora = datetime(2021, 6, 1)
+    for nroLectura in range(cantidad):
+        fechaHoraLinea = fechaHora + timedelta(minutes=nroLectura)
+        if (nroLectura % 131 == 11):
+            #Anterior a la línea previa
+            fechaHoraLinea -= timedelta(minutes=10)
+        elif (nroLectura % 137 == 23):
+            #Igual a la línea previa
+            fechaHoraLinea -= timedelta(minutes=1)
+        fecha, hora = fechaHoraLinea.strftime('%d/%m/%Y;%H:%M:%S').split(';')
+        if (nroLectura % 173 == 17):
+            fecha = '32/06/2021'
+        campos = [fecha, hora, 'M001                ', '1         ', f"{30 + nroLectura % 7 * 0.4:.1f}", '-0.1',
+                  f"{nroLectura % 5 * 0.3:.1f}", f"{470001.7 + nroLectura:.1f}", f"{4700017 + nroLectura}", '100000']
+        if (nroLectura % 97 == 5):
+            campos[4] = 'abc'
+        if (nroLectura % 101 == 7):
+            campos[6] = '1,5e'
+        if (nroLectura % 151 == 13):
+            #Requerido vacío
+            campos[5] = ''
+        if (nroLectura % 157 == 29):
+            #Opcionales vacíos y coma decimal
+            campos[6], campos[7], campos[4] = '', '   ', campos[4].replace('.', ',')
+        if (nroLectura % 89 == 3):
+            campos[2], campos[3], campos[5] = '"M001"', '"1"', '"-0,1"'
+        if (nroLectura % 113 == 31):
+            #Faltan los últimos campos (uno de ellos requerido)
+            campos = campos[:6]
+        lineas.append(';'.join(campos))
+        if (nroLectura % 199 == 19):
+            lineas.append('')
+    return lineas
+
+
+def _importar(session, ruta, partes: list, parser: str, bulk: bool) -> tuple:
+    """Importa el archivo en una base sin lecturas, escribiéndolo por partes y retomándolo después de cada una"""
+    for clase in (ErrorLecturaRes11, LecturaMedidorRes11, ArchivoLecturaRes11):
+        session.execute(delete(clase))
+    session.commit()
+    session.expunge_all()
+    archivo = nuevoArchivo(session, session.get(MedidorFiscal, 1))
+    escritas = []
+    for parte in partes:
+        escritas.extend(parte)
+        escribirArchivo(ruta, escritas)
+        archivo.importarLecturas(ruta, bulk=bulk, parser=parser)
+        session.commit()
+    return volcarLecturas(session)
+
+
+def _configuraciones():
+    configuraciones = []
+    for parser in (PL_REFLEXIVO, PL_COMPILADO, PL_COLUMNAR, PL_AUTOMATICO):
+        for bulk in (False, True):
+            configuraciones.append(pytest.param(parser, bulk, False, id=f"{parser}-{'bulk' if bulk else 'orm'}"))
+            if parser in (PL_COLUMNAR, PL_AUTOMATICO):
+                #Sólo el parser columnar mapea el archivo en memoria
+                configuraciones.append(pytest.param(parser, bulk, True, id=f"{parser}-{'bulk' if bulk else 'orm'}-mmap"))
+    return configuraciones
+
+
+@pytest.mark.parametrize('retomar', [False, True], ids=['completo', 'retomado'])
+@pytest.mark.parametrize('cantidad', [CHICO, GRANDE], ids=['chico', 'grande'])
+@pytest.mark.parametrize('parser, bulk, mapear', _configuraciones())
+def test_parsersCarganLoMismo(session, tmp_path, monkeypatch, parser, bulk, mapear, cantidad, retomar):
+    lineas = lineasArchivo(cantidad)
+    partes = [lineas[:len(lineas) // 2], lineas[len(lineas) // 2:]] if retomar else [lineas]
+    ruta = tmp_path / 'archivo.txt'
+    if (cantidad, retomar) not in _esperados:
+        _esperados[(cantidad, retomar)] = _importar(session, ruta, partes, PL_REFLEXIVO, False)
+    esperado = _esperados[(cantidad, retomar)]
+    if mapear:
+        monkeypatch.setattr(lectura_res11, 'TAMANIO_MINIMO_MMAP', 0)
+    obtenido = _importar(session, ruta, partes, parser, bulk)
+
+    lecturas, errores, archivos = obtenido
+    assert lecturas == esperado[0]
+    assert errores == esperado[1]
+    assert archivos == esperado[2]
+    #Los fixtures ejercitan las líneas con errores, las descartadas y la lectura del archivo completo
+    assert errores and len(lecturas) < cantidad
+    assert archivos[0][4] == ruta.stat().st_size
+
+
+def test_fixturesDeUnoYOtroLadoDelMinimoColumnar():
+    assert len(lineasArchivo(CHICO)) < MINIMO_LINEAS_COLUMNAR <= len(lineasArchivo(GRANDE)) // 2
+    assert ENCABEZADO.count(';') == lineasArchivo(1)[0].count(';')
@@ -0,0 +1,68 @@
+'''
+Pruebas del parser compilado de líneas (ParserLecturaRes11): debe obtener los mismos valores y errores que el
+parseo por reflexión de LecturaMedidorRes11.rellenarCamposFromLineaArchivo
+'''
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import inspect
+
+from conftest import nuevoArchivo
+from telemedicion_regalias.lectura_res11 import (LecturaMedidorRes11, LecturaMedidorLiquido, ErrorLecturaRes11,
+                                                 ParserLecturaRes11)
+
+
+FECHA_HORA = datetime(2021, 6, 1, 10, 0, 0)
+
+LINEAS = {
+    'valida': ['01/06/2021', '10:00:00', 'M001                ', '1         ', '30.0', '-0.1', '0.3', '470001.7', '4700017', '100000'],
+    'coma_decimal': ['01/06/2021', '10:00:00', 'M001', '1', ' 30,5 ', '-0,1', '0,9', '470001,7', '4700017,9', '100000'],
+    'opcionales_vacios': ['01/06/2021', '10:00:00', 'M001', '1', '30.0', '-0.1', '', '  ', '4700017', ''],
+    'requerido_vacio': ['01/06/2021', '10:00:00', 'M001', '1', '', '-0.1', '0.3', '470001.7', '4700017', '100000'],
+    'requerido_texto_vacio': ['01/06/2021', '10:00:00', '', '1', '30.0', '-0.1', '0.3', '470001.7', '4700017', '100000'],
+    'valores_invalidos': ['01/06/2021', '10:00:00', 'M001', '1', 'abc', '-0.1', '1e', '470001.7', 'x', '100000'],
+}
+
+
+def _columnas(objeto, excluir=()):
+    """Valores de las columnas mapeadas del objeto, sin las claves que asigna la DB"""
+    return {atributo.key: getattr(objeto, atributo.key) for atributo in inspect(type(objeto)).column_attrs
+            if atributo.key not in excluir}
+
+
+def _lecturaReflexiva(claseLectura, archivo, campos):
+    lectura = claseLectura(archivo, 1, vincularArchivo=False)
+    lectura.rellenarCamposFromLineaArchivo(dict(zip(archivo.estructuraCampos, campos)), FECHA_HORA)
+    return lectura
+
+
+@pytest.mark.parametrize('claseLectura', [LecturaMedidorRes11, LecturaMedidorLiquido])
+@pytest.mark.parametrize('nombreLinea', list(LINEAS))
+def test_parserCompiladoIgualAlReflexivo(session, medidor, claseLectura, nombreLinea):
+    campos = LINEAS[nombreLinea]
+    archivo = nuevoArchivo(session, medidor)
+    reflexiva = _lecturaReflexiva(claseLectura, archivo, campos)
+    valores, errores = ParserLecturaRes11(medidor.tipoMedidor.estructuraCampos, claseLectura).parsear(campos, FECHA_HORA)
+    compilada = claseLectura.desdeValores(archivo, 1, valores, errores)
+
+    excluir = ('id', 'archivo_id', 'tiene_errores')
+    assert _columnas(compilada, excluir) == _columnas(reflexiva, excluir)
+    #La lectura reflexiva sin errores deja tiene_errores en su valor por defecto de la columna (falso)
+    assert bool(compilada.tiene_errores) == bool(reflexiva.tiene_errores) == valores['tiene_errores']
+    assert (compilada._error is None) == (reflexiva._error is None) == (errores is None)
+    if errores:
+        excluir = ('id', 'lectura_id')
+        assert _columnas(compilada._error, excluir) == _columnas(reflexiva._error, excluir)
+
+
+def test_erroresSinColumnaEnLaTablaDeErrores(session, medidor):
+    """Los campos sin columna en la tabla de errores (instalacion) marcan la lectura con errores pero no se guardan"""
+    archivo = nuevoArchivo(session, medidor)
+    campos = LINEAS['requerido_texto_vacio']
+    valores, errores = ParserLecturaRes11(medidor.tipoMedidor.estructuraCampos, LecturaMedidorRes11).parsear(campos, FECHA_HORA)
+    assert errores == {'instalacion': ''}
+    lectura = LecturaMedidorRes11.desdeValores(archivo, 1, valores, errores)
+    assert lectura.tiene_errores
+    assert not hasattr(ErrorLecturaRes11, 'instalacion')
+    assert not any(_columnas(lectura._error, ('id', 'lectura_id')).values())
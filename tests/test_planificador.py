@@ -0,0 +1,75 @@
+'''
+Pruebas de la planificación de las lecturas de las empresas en el modo daemon
+'''
+
+import pytest
+
+from telemedicion_regalias.planificador import PlanificadorEmpresas
+
+
+def test_intervaloPropioDeCadaEmpresa():
+    planificador = PlanificadorEmpresas(3600, {2: 86400}, jitter=0)
+    planificador.actualizarEmpresas([2, 1], ahora=0)
+    assert planificador.proximaEjecucion() == 0
+    assert planificador.pendientes(ahora=0) == [1, 2]
+    assert planificador.finalizar(1, True, ahora=10) == 3600
+    assert planificador.finalizar(2, True, ahora=20) == 86400
+    assert planificador.proximaEjecucion() == 3610
+    assert planificador.pendientes(ahora=3609) == []
+    assert planificador.pendientes(ahora=86420) == [1, 2]
+
+
+def test_empresaEnProcesoNoSePlanificaDeNuevo():
+    planificador = PlanificadorEmpresas(60, jitter=0)
+    planificador.actualizarEmpresas([1, 2, 3], ahora=0)
+    assert planificador.pendientes(ahora=0, limite=2) == [1, 2]
+    planificador.actualizarEmpresas([1, 2, 3], ahora=5)
+    assert planificador.pendientes(ahora=5) == [3]
+    assert planificador.proximaEjecucion() is None
+
+
+def test_empresaQuitada():
+    planificador = PlanificadorEmpresas(60, jitter=0)
+    planificador.actualizarEmpresas([1, 2], ahora=0)
+    assert planificador.pendientes(ahora=0, limite=1) == [1]
+    planificador.actualizarEmpresas([3], ahora=0)
+    #La planificada se descarta y la que estaba en proceso no se vuelve a planificar
+    assert planificador.pendientes(ahora=0) == [3]
+    assert planificador.finalizar(1, True, ahora=1) is None
+    assert planificador.finalizar(3, True, ahora=1) == 60
+    assert planificador.pendientes(ahora=1000) == [3]
+
+
+def test_esperaCrecienteDespuesDeErrores():
+    planificador = PlanificadorEmpresas(600, jitter=0, esperaMaxima=3000)
+    planificador.actualizarEmpresas([1], ahora=0)
+    esperas = []
+    for _ in range(4):
+        planificador.pendientes(ahora=float('inf'))
+        esperas.append(planificador.finalizar(1, False, ahora=0))
+    assert esperas == [1200, 2400, 3000, 3000]
+    assert planificador.fallosConsecutivos(1) == 4
+    planificador.pendientes(ahora=float('inf'))
+    assert planificador.finalizar(1, True, ahora=0) == 600
+    assert planificador.fallosConsecutivos(1) == 0
+
+
+def test_esperaMaximaMenorAlIntervalo():
+    planificador = PlanificadorEmpresas(86400, jitter=0, esperaMaxima=3600)
+    planificador.actualizarEmpresas([1], ahora=0)
+    planificador.pendientes(ahora=0)
+    assert planificador.finalizar(1, False, ahora=0) == 86400
+
+
+@pytest.mark.parametrize('exito, esperaBase', [(True, 1000), (False, 2000)])
+def test_jitter(exito, esperaBase):
+    esperas = set()
+    for _ in range(50):
+        planificador = PlanificadorEmpresas(1000, jitter=0.1)
+        planificador.actualizarEmpresas([1], ahora=0)
+        planificador.pendientes(ahora=0)
+        espera = planificador.finalizar(1, exito, ahora=0)
+        assert esperaBase * 0.9 <= espera <= esperaBase * 1.1
+        assert planificador.proximaEjecucion() == espera
+        esperas.add(espera)
+    assert len(esperas) > 1
@@ -0,0 +1,370 @@
+'''
+Benchmark de punta a punta de la ingesta de lecturas RES11:
+    ConexionRemota -> MedidorFiscal.cargarNuevasLecturasXRamal -> ArchivoLecturaRes11.importarLecturas
+
+Levanta en el mismo proceso un servidor SFTP (paramiko) o FTP/FTPES (pyftpdlib), genera archivos RES11 sintéticos
+con el formato real (ver data/descargas) para la cantidad de empresas, medidores, ramales y días indicada, y los
+procesa con procesarEmpresa contra una base SQLite creada a partir del modelo (el esquema regalias se adjunta con
+ATTACH). Informa archivos/s, lecturas/s, bytes/s y los percentiles de latencia de cada etapa (ver metricas).
+
+Ejemplo:
+    python varios/benchmark_ingesta.py --empresas 3 --medidores 4 --ramales 2 --dias 10 --protocolo SFTP
+'''
+
+import sys
+import os
+import re
+import json
+import socket
+import logging
+import tempfile
+import threading
+import time
+import warnings
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, date, timedelta
+from pathlib import Path
+
+DIR_PROYECTO = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(DIR_PROYECTO / 'packages'), str(DIR_PROYECTO)]
+
+import paramiko
+from sqlalchemy import event, text, FetchedValue
+from sqlalchemy.exc import SAWarning
+from sqlalchemy.dialects.oracle import NUMBER
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import DefaultClause
+
+from telemedicion_regalias import base, metricas
+from telemedicion_regalias.empresa import Empresa, Conexion_Empresa
+from telemedicion_regalias.medidor_fiscal import MedidorFiscal, TipoMedidorFiscal
+from telemedicion_regalias.lectura_res11 import LecturaMedidorRes11, PL_REFLEXIVO, PL_COMPILADO, PL_COLUMNAR, PL_AUTOMATICO
+import lectura_telemedicion
+import lectura_telemedicion_config as config
+
+
+USUARIO = 'benchmark'
+PASSWORD = 'benchmark'
+
+CAMPOS_LECTURA = {"fecha": True, "hora": True, "instalacion": True, "medidor": True, "temperatura": True,
+                  "presion": True, "caudal_instantaneo_gross": False, "acumulador_gross_no_reseteable": False,
+                  "acumulador_pulsos_brutos_no_reseteable": True, "factor_k_del_medidor": False}
+
+ENCABEZADO_RES11 = ("fecha     ;hora    ;instalacion         ;medidor   ;temperatura;presion;caudal_instantaneo_gross;"
+                    "Acumulador_gross_no_reseteable;acumulador_de_pulsos_no_reseteable;factor_k_del_medidor")
+
+
+
+
+#-------------------------------------------------------------------------------------------------------------------
+# Base de datos SQLite con el esquema del modelo
+#-------------------------------------------------------------------------------------------------------------------
+
+@compiles(NUMBER, 'sqlite')
+def _compilarNumberSQLite(tipo, compilador, **kw):
+    return 'INTEGER' if not tipo.scale else 'NUMERIC'
+
+
+def _regexpSubstr(texto, patron, posicion=1, ocurrencia=1, flags='', grupo=0):
+    """Equivalente (parcial) de REGEXP_SUBSTR de Oracle, utilizado en las consultas de archivos por ramal"""
+    if texto is None:
+        return None
+    coincidencia = re.search(patron, texto[posicion - 1:], re.I if 'i' in (flags or '') else 0)
+    valor = coincidencia.group(grupo) if coincidencia else None
+    return int(valor) if (valor) and (valor.isdigit()) else valor
+
+
+def initBaseSQLite(archivoDB=None):
+    """Crea la base SQLite (en memoria o en el archivo indicado) con todas las tablas del modelo.
+    Los valores que en Oracle completan los triggers (usuario y fecha de alta/modificación) se reemplazan por defaults
+    """
+    for tabla in base.Base.metadata.sorted_tables:
+        for columna in tabla.columns:
+            if isinstance(columna.server_default, FetchedValue) and not isinstance(columna.server_default, DefaultClause):
+                columna.server_default = DefaultClause(text(f"'{USUARIO}'") if 'usuario' in columna.name else text("CURRENT_TIMESTAMP"))
+    dirEsquema = ':memory:' if archivoDB is None else f"{archivoDB}.regalias"
+    base.initSQLAlchemy(f"sqlite:///{archivoDB}" if archivoDB else 'sqlite://', poolclass=StaticPool,
+                        connect_args={'check_same_thread': False})
+
+    @event.listens_for(base.engine, 'connect')
+    def _configurarConexion(conexionDBAPI, registro):
+        conexionDBAPI.execute(f"ATTACH DATABASE '{dirEsquema}' AS regalias")
+        conexionDBAPI.create_function('regexp_substr', -1, _regexpSubstr)
+
+    base.Base.metadata.create_all(base.engine)
+
+
+def cargarConfiguracion(session, args, puerto):
+    """Da de alta las empresas, conexiones y medidores del benchmark, retorna la lista de medidores"""
+    ahora = datetime.now()
+    #Los medidores nuevos se leen a partir de su fecha de alta
+    fechaAlta = datetime.combine(date.today() - timedelta(days=args.dias - 1), datetime.min.time()) + timedelta(minutes=10)
+    session.add(TipoMedidorFiscal(id=1, nombre='BENCH', _descripcion='Medidor del benchmark',
+                                  _campos_lectura=json.dumps(CAMPOS_LECTURA),
+                                  usuario_alta=USUARIO, fecha_alta=ahora, usuario_ult_mod=USUARIO, fecha_ult_mod=ahora))
+    medidores = []
+    for nroEmpresa in range(1, args.empresas + 1):
+        codigo = f"EMP{nroEmpresa:03d}"
+        session.add(Empresa(id=nroEmpresa, cuit=f"30{nroEmpresa:09d}", codigo=codigo, nombre=f"EMPRESA {codigo}",
+                            fecha_alta=ahora, usuario_alta=USUARIO))
+        session.add(Conexion_Empresa(id=nroEmpresa, _empresa_id=nroEmpresa, _protocolo=args.protocolo,
+                                     _host='127.0.0.1', _port=puerto, _usuario=USUARIO, _password=PASSWORD,
+                                     _prefijo_archivos=codigo, _directorio_remoto=f"/{codigo}",
+                                     usuario_alta=USUARIO, fecha_alta=ahora, usuario_ult_mod=USUARIO, fecha_ult_mod=ahora))
+        for nroMedidor in range(1, args.medidores + 1):
+            medidor = MedidorFiscal(id=nroEmpresa * 1000 + nroMedidor, empresa_id=nroEmpresa, _tipo_medidor_id=1,
+                                    codigo=f"M{nroEmpresa:03d}-{nroMedidor:04d}", descripcion=f"Medidor {nroMedidor}",
+                                    _cant_ramales=args.ramales, envia_telemetria=True,
+                                    usuario_alta=USUARIO, fecha_alta=fechaAlta, usuario_ult_mod=USUARIO, fecha_ult_mod=ahora)
+            session.add(medidor)
+            medidores.append((codigo, medidor.codigo))
+    session.commit()
+    return medidores
+
+
+
+
+#-------------------------------------------------------------------------------------------------------------------
+# Archivos RES11 sintéticos
+#-------------------------------------------------------------------------------------------------------------------
+
+def generarArchivos(dirRaiz, medidores, args):
+    """Genera un archivo por medidor, ramal y día con args.lecturasDia lecturas cada uno. Retorna el total de bytes"""
+    totalBytes = 0
+    intervalo = timedelta(days=1) / args.lecturasDia
+    fechas = [date.today() - timedelta(days=dia) for dia in range(args.dias - 1, -1, -1)]
+    for codigoEmpresa, codigoMedidor in medidores:
+        dirEmpresa = Path(dirRaiz, codigoEmpresa)
+        dirEmpresa.mkdir(parents=True, exist_ok=True)
+        for ramal in range(1, args.ramales + 1):
+            acumulador = 470000.0
+            for fecha in fechas:
+                nombre = f"{codigoEmpresa}_{codigoMedidor}_{ramal}_{fecha.strftime('%d%m%Y')}_RES11_DIR_REGALIAS.txt"
+                lineas = [ENCABEZADO_RES11]
+                fechaHora = datetime.combine(fecha, datetime.min.time())
+                for nroLectura in range(args.lecturasDia):
+                    acumulador += 1.7
+                    lineas.append(f"{fechaHora.strftime('%d/%m/%Y;%H:%M:%S')};{codigoMedidor:<20};{ramal:<10};"
+                                  f"{30 + nroLectura % 7 * 0.4:.1f};-0.1;{nroLectura % 5 * 0.3:.1f};{acumulador:.1f};"
+                                  f"{int(acumulador * 10)};100000")
+                    fechaHora += intervalo
+                contenido = ('\n'.join(lineas) + '\n').encode('iso-8859-15')
+                Path(dirEmpresa, nombre).write_bytes(contenido)
+                totalBytes += len(contenido)
+    return totalBytes
+
+
+
+
+#-------------------------------------------------------------------------------------------------------------------
+# Servidores locales
+#-------------------------------------------------------------------------------------------------------------------
+
+class _ArchivoSFTP(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class _InterfazSFTP(paramiko.SFTPServerInterface):
+    '''Servidor SFTP de sólo lectura sobre el directorio raiz del benchmark'''
+    raiz = None
+
+    def _ruta(self, ruta):
+        return os.path.join(self.raiz, ruta.lstrip('/').replace('..', ''))
+
+    def canonicalize(self, ruta):
+        return '/' + ruta.lstrip('/') if ruta not in ('.', '') else '/'
+
+    def list_folder(self, ruta):
+        listado = []
+        for nombre in os.listdir(self._ruta(ruta)):
+            atributos = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(self._ruta(ruta), nombre)))
+            atributos.filename = nombre
+            listado.append(atributos)
+        return listado
+
+    def stat(self, ruta):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._ruta(ruta)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, ruta, flags, attr):
+        try:
+            archivo = open(self._ruta(ruta), 'rb')
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        handle = _ArchivoSFTP(flags)
+        handle.readfile = archivo
+        handle.filename = self._ruta(ruta)
+        return handle
+
+
+class _ServidorSSH(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL if (username, password) == (USUARIO, PASSWORD) else paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+
+def iniciarServidorSFTP(dirRaiz):
+    """Inicia el servidor SFTP en un puerto libre, atendiendo cada conexión en su propio hilo. Retorna el puerto"""
+    _InterfazSFTP.raiz = str(dirRaiz)
+    clave = paramiko.RSAKey.generate(2048)
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(100)
+
+    def atender(conexion):
+        transport = paramiko.Transport(conexion)
+        transport.add_server_key(clave)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _InterfazSFTP)
+        try:
+            transport.start_server(server=_ServidorSSH())
+        except Exception as e:
+            logging.debug(f"Error en la conexión SSH del servidor (error: {e})")
+
+    def aceptar():
+        while True:
+            conexion, _ = sock.accept()
+            threading.Thread(target=atender, args=(conexion,), daemon=True).start()
+
+    threading.Thread(target=aceptar, daemon=True).start()
+    return sock.getsockname()[1]
+
+
+def iniciarServidorFTP(dirRaiz, tls=False):
+    """Inicia el servidor FTP (o FTPES si tls=True) con pyftpdlib en un puerto libre. Retorna el puerto"""
+    try:
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.servers import ThreadedFTPServer
+        if tls:
+            from pyftpdlib.handlers import TLS_FTPHandler as Handler
+        else:
+            from pyftpdlib.handlers import FTPHandler as Handler
+    except ImportError as e:
+        raise Exception(f"El servidor {'FTPES' if tls else 'FTP'} requiere pyftpdlib{' y pyOpenSSL' if tls else ''} (error: {e})")
+    autorizador = DummyAuthorizer()
+    autorizador.add_user(USUARIO, PASSWORD, str(dirRaiz), perm='elr')
+    Handler.authorizer = autorizador
+    if tls:
+        Handler.certfile = _generarCertificado(dirRaiz)
+        Handler.tls_control_required = True
+        Handler.tls_data_required = True
+    logging.getLogger('pyftpdlib').setLevel(logging.WARNING)
+    servidor = ThreadedFTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor.address[1]
+
+
+def _generarCertificado(dirRaiz):
+    """Genera un certificado autofirmado (clave y certificado en un único PEM) para el servidor FTPES"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+    clave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    certificado = x509.CertificateBuilder().subject_name(nombre).issuer_name(nombre).public_key(clave.public_key()) \
+                      .serial_number(x509.random_serial_number()) \
+                      .not_valid_before(datetime.utcnow() - timedelta(days=1)) \
+                      .not_valid_after(datetime.utcnow() + timedelta(days=1)) \
+                      .sign(clave, hashes.SHA256())
+    archivo = Path(dirRaiz).parent / 'servidor.pem'
+    archivo.write_bytes(clave.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                            serialization.NoEncryption()) +
+                        certificado.public_bytes(serialization.Encoding.PEM))
+    return str(archivo)
+
+
+
+
+#-------------------------------------------------------------------------------------------------------------------
+
+def main():
+    parser = ArgumentParser(description="Benchmark de la ingesta de lecturas RES11 con servidores y base de datos locales")
+    parser.add_argument("--empresas", type=int, default=2, help="cantidad de empresas [default: %(default)s]")
+    parser.add_argument("--medidores", type=int, default=3, help="medidores por empresa [default: %(default)s]")
+    parser.add_argument("--ramales", type=int, default=2, help="ramales por medidor [default: %(default)s]")
+    parser.add_argument("--dias", type=int, default=5, help="días de lecturas (un archivo por día y ramal) [default: %(default)s]")
+    parser.add_argument("--lecturas-dia", dest="lecturasDia", type=int, default=24,
+                        help="lecturas de cada archivo diario [default: %(default)s]")
+    parser.add_argument("--protocolo", choices=['SFTP', 'FTP', 'FTPES'], default='SFTP',
+                        help="protocolo del servidor local [default: %(default)s]")
+    parser.add_argument("--db", dest="archivoDB",
+                        help="archivo SQLite a crear para la base, si no se indica se utiliza una base en memoria")
+    parser.add_argument("--bulk", action="store_true", help="importar las lecturas en bloque [default: %(default)s]")
+    parser.add_argument("--streaming", action="store_true", help="procesar sin descargar a disco [default: %(default)s]")
+    parser.add_argument("-p", "--parser", choices=[PL_REFLEXIVO, PL_COMPILADO, PL_COLUMNAR, PL_AUTOMATICO], default=PL_REFLEXIVO,
+                        help="parser de las líneas [default: %(default)s]")
+    parser.add_argument("--descargas-paralelas", dest="descargasParalelas", type=int, default=1,
+                        help="descargas en paralelo por ramal (solo SFTP) [default: %(default)s]")
+    parser.add_argument("--metricas-json", dest="metricasJson",
+                        help="archivo en el que se guardan todas las mediciones en formato JSON")
+    parser.add_argument("-d", "--debug-level", dest="debugLevel", default='WARNING',
+                        help="nivel de log del proceso [default: %(default)s]")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.debugLevel.upper()), format='%(asctime)s %(levelname)s %(message)s')
+    #Los cortes de conexión del lado del servidor SSH y la conversión de NUMBER con decimales de SQLite no afectan la medición
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    warnings.filterwarnings('ignore', category=SAWarning)
+
+    with tempfile.TemporaryDirectory(prefix='benchmark_ingesta_') as dirTemporal:
+        dirRaiz = Path(dirTemporal, 'servidor')
+        dirRaiz.mkdir()
+        config.DIR_DESCARGAS = Path(dirTemporal, 'descargas')
+        config.DIR_DESCARGAS.mkdir()
+
+        if (args.protocolo == 'SFTP'):
+            puerto = iniciarServidorSFTP(dirRaiz)
+        else:
+            puerto = iniciarServidorFTP(dirRaiz, tls=(args.protocolo == 'FTPES'))
+
+        initBaseSQLite(args.archivoDB)
+        medidores = cargarConfiguracion(base.session, args, puerto)
+        totalBytes = generarArchivos(dirRaiz, medidores, args)
+        print(f"Generados {len(medidores) * args.ramales * args.dias} archivos ({totalBytes} bytes) para "
+              f"{args.empresas} empresas, {len(medidores)} medidores, {args.ramales} ramales y {args.dias} días")
+
+        argsProceso = Namespace(bulk=args.bulk, parser=args.parser, streaming=args.streaming, ventanaDias=args.dias,
+                                descargasParalelas=args.descargasParalelas, marcasLectura=False)
+        registroMetricas = metricas.activar()
+
+        inicio = time.perf_counter()
+        empresas = lectura_telemedicion.consultaEmpresasAProcesar(base.session).all()
+        ultimasLecturas = MedidorFiscal.getUltimasLecturasRamales(base.session,
+                                                                  [medidor for empresa in empresas for medidor in empresa.medidores])
+        resultados = [lectura_telemedicion.procesarEmpresa(empresa, argsProceso, ultimasLecturas) for empresa in empresas]
+        segundos = time.perf_counter() - inicio
+
+        cantArchivosOk = sum(resultado.cantArchivosOk for resultado in resultados)
+        cantArchivosErr = sum(resultado.cantArchivosErr for resultado in resultados)
+        cantLecturas = base.session.query(LecturaMedidorRes11).count()
+
+        print(f"Tiempo total: {segundos:.2f} s")
+        print(f"Archivos: {cantArchivosOk} OK, {cantArchivosErr} con error ({cantArchivosOk / segundos:.1f} archivos/s)")
+        print(f"Lecturas: {cantLecturas} ({cantLecturas / segundos:.1f} lecturas/s)")
+        print(f"Bytes: {totalBytes} ({totalBytes / segundos / 1024:.1f} KB/s)")
+        #Los percentiles son de la duración de cada etapa por archivo (por empresa en la conexión y el listado)
+        print(f"{'Etapa':<12} {'Muestras':>9} {'Cantidad':>9} {'Total s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'Máx ms':>9}")
+        for etapa, datos in registroMetricas.resumen().items():
+            print(f"{etapa:<12} {datos['muestras']:>9} {datos['cantidad']:>9} {datos['segundos']:>9.2f} "
+                  f"{datos['p50'] * 1000:>9.1f} {datos['p90'] * 1000:>9.1f} {datos['p99'] * 1000:>9.1f} "
+                  f"{datos['maximo'] * 1000:>9.1f}")
+        if (args.metricasJson):
+            registroMetricas.guardarJSON(args.metricasJson)
+        base.session.close()
+    return 0 if cantArchivosErr == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())